@@ -0,0 +1,95 @@
+"""
+Measure how many upstream fetches and how much cache the story keys save when
+readers reach the same NZ Herald stories by many URLs: under other section paths,
+on the bare host, with tracking query strings, and without the trailing slash.
+
+Readers get stories via ``stories.get_story`` from the stand-in upstream of
+``benchmarks/standin.py``, which serves a story by its ID at any section path, as
+the NZ Herald does, with each story reached by a few random variants of its URL.
+Report the upstream fetches against the distinct normalized URLs, which is what
+caching by URL would have fetched, and the dedup report of the story cache (see
+``stories.get_dedup_report``).
+
+Run this from the project root via ``uv run python benchmarks/dedup.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import random
+import string
+import sys
+import tempfile
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["UPSTREAM_RATE_LIMIT"] = "1000000"
+
+import standin
+
+server = standin.start()
+os.environ["UPSTREAM_BASE_URL"] = server.base_url
+
+import search_index as si
+import stories as sto
+
+SECTIONS = ["nz", "business", "world", "sport", "kahu", "the-country"]
+QUERIES = ["", "", "?ref=rss", "?utm_source=facebook&utm_medium=social", "#comments"]
+
+
+def make_url_variant(story_id: str, slug: str, rng: random.Random) -> str:
+    """
+    Return a random URL of the story of the given ID and slug.
+    """
+    host = rng.choice(["https://www.nzherald.co.nz", "https://nzherald.co.nz"])
+    path = f"/{rng.choice(SECTIONS)}/{slug}/{story_id}" + rng.choice(["/", ""])
+    return host + path + rng.choice(QUERIES)
+
+
+def main(n_stories: int, n_views: int, seed: int) -> None:
+    # Keep the search index out of the data folder
+    si.index_story = lambda story: None
+    rng = random.Random(seed)
+    stories = [
+        (
+            "".join(rng.choices(string.ascii_uppercase + string.digits, k=26)),
+            f"a-benchmark-story-{i}",
+        )
+        for i in range(n_stories)
+    ]
+    urls = [make_url_variant(*rng.choice(stories), rng) for __ in range(n_views)]
+
+    for url in urls:
+        assert sto.get_story(url) is not None, url
+
+    by_url = len({sto.normalize_url(url) for url in urls})
+    print(
+        f"{n_views} views of {n_stories} stories by {len(set(urls))} distinct URLs, "
+        f"{by_url} once normalized:"
+    )
+    print(f"  upstream fetches: {server.n_requests} (caching by URL: {by_url})")
+    r = sto.get_dedup_report()
+    print(f"  URLs per story: {r['url_ratio']:.2f} ({r['urls']} -> {r['stories']})")
+    print(
+        f"  stories per rendering: {r['content_ratio']:.2f} "
+        f"({r['stories']} -> {r['contents']})"
+    )
+    print(
+        f"  images per distinct image: {r['image_ratio']:.2f} "
+        f"({r['images']} -> {r['distinct_images']})"
+    )
+    print(
+        f"  cached {r['bytes'] / 1000:.0f} kB, saving {r['bytes_saved'] / 1000:.0f} kB "
+        "against caching by URL"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stories", type=int, default=100, help="distinct stories")
+    parser.add_argument("--views", type=int, default=1000, help="story views")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    main(args.stories, args.views, args.seed)
@@ -0,0 +1,85 @@
+"""
+Benchmark the throughput of ``index.display_page``, serialization included,
+building each page layout on every call (as before layouts were memoized)
+versus returning the memoized plain layouts.
+Also benchmark the full Dash callback request for the login page.
+
+Run this from the project root via ``uv run python benchmarks/display_page.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import sys
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import dash._utils as du
+import flask_login as fl
+
+import index
+from app import User
+
+PATHNAMES = {
+    "login": "/login",
+    "main": "/nz/some-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/",
+    "reading_list": "/reading-list",
+    "search": "/search",
+}
+
+
+def rate(f, n: int) -> float:
+    """
+    Return the number of calls per second of the given function over ``n`` calls.
+    """
+    t = time.perf_counter()
+    for __ in range(n):
+        f()
+    return n / (time.perf_counter() - t)
+
+
+def main(n: int) -> None:
+    print("Calls per second of display_page plus serialization:")
+    with index.server.test_request_context():
+        fl.login_user(User(id=0, username="benchmark"))
+        for page, pathname in PATHNAMES.items():
+            before = rate(lambda: du.to_json(index.PAGES[page].layout()), n)
+            after = rate(lambda: du.to_json(index.display_page(pathname)), n)
+            print(
+                f"  {page:<14} before {before:8.0f}, after {after:8.0f} "
+                f"({after / before:.1f}x)"
+            )
+
+    client = index.server.test_client()
+    payload = {
+        "output": "page-content.children",
+        "outputs": {"id": "page-content", "property": "children"},
+        "inputs": [{"id": "location", "property": "pathname", "value": "/login"}],
+        "changedPropIds": ["location.pathname"],
+        "state": [],
+    }
+
+    def request():
+        r = client.post("/_dash-update-component", json=payload)
+        assert r.status_code == 200
+
+    after = rate(request, n)
+    index.get_layout.cache_clear()
+    memoized = index.get_layout
+    index.get_layout = lambda page: index.PAGES[page].layout()
+    before = rate(request, n)
+    index.get_layout = memoized
+    print(
+        "Requests per second of the login page callback: "
+        f"before {before:.0f}, after {after:.0f} ({after / before:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=500, help="number of calls to time")
+    args = parser.parse_args()
+    main(args.n)
@@ -0,0 +1,115 @@
+"""
+Benchmark the cost of dispatching story URLs to their sources' extractors (see
+``extractors.get_extractor``) on the NZ Herald hot path, against the check and
+normalization that it replaced: a substring test for ``nzherald.co.nz`` followed
+by taking the URL's path.
+
+Time both per URL over a mix of URL variants, with the registered extractors and
+with many more stand-in sources registered, to show that the router doesn't slow
+down as sources are added, and set the times against that of parsing a story page,
+to show how little of a story view dispatching takes.
+
+Run this from the project root via ``uv run python benchmarks/extractor_dispatch.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import sys
+import timeit
+import urllib.parse as up
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import extractors as ex
+import standin
+import stories as sto
+
+URLS = [
+    "https://www.nzherald.co.nz/nz/a-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/",
+    "https://nzherald.co.nz/business/a-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/?ref=rss",
+    "www.nzherald.co.nz/world/a-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/",
+    "https://www.newsroom.co.nz/pro/governing-in-a-pandemic",
+    "https://example.com/not-a-story",
+]
+
+
+def old_dispatch(url: str) -> str | None:
+    """
+    Return the normalized URL of the given URL as before the extractor registry,
+    or ``None`` if it isn't an NZ Herald URL.
+    """
+    if "nzherald.co.nz" not in url:
+        return None
+    path = up.urlparse(url.strip()).path or "/"
+    return f"https://www.nzherald.co.nz{path}"
+
+
+def new_dispatch(url: str) -> str | None:
+    """
+    Return the normalized URL of the given URL by its extractor, or ``None`` if it
+    has none.
+    """
+    extractor = ex.get_extractor(url)
+    if extractor is None:
+        return None
+    return extractor.normalize_url(url)
+
+
+def time_per_url(function, n: int) -> float:
+    """
+    Return the best time in microseconds per call of the given function on the
+    URLs.
+    """
+    times = timeit.repeat(lambda: [function(url) for url in URLS], number=n, repeat=5)
+    return 1e6 * min(times) / n / len(URLS)
+
+
+def register_standins(n: int) -> None:
+    """
+    Register stand-in sources until the given number of sources are registered.
+    """
+    while len(ex.extractors) < n:
+        extractor = ex.Extractor()
+        extractor.domain = f"news-source-{len(ex.extractors)}.co.nz"
+        extractor.base_url = f"https://www.{extractor.domain}"
+        ex.register(extractor)
+
+
+def main(n: int, source_counts: list[int], n_elements: int) -> None:
+    url = "https://www.nzherald.co.nz/nz/a-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/"
+    page = standin.make_page(up.urlparse(url).path, n_elements)
+    sto.parse_story(page, url)
+    parse_us = (
+        1e6
+        * min(timeit.repeat(lambda: sto.parse_story(page, url), number=10, repeat=3))
+        / 10
+    )
+
+    print(f"Dispatching {len(URLS)} URL variants, per URL:")
+    print(f"  {'before the registry':<32}{time_per_url(old_dispatch, n):>10.2f} µs")
+    for count in sorted(source_counts):
+        register_standins(count)
+        label = f"registry of {len(ex.extractors)} sources"
+        print(f"  {label:<32}{time_per_url(new_dispatch, n):>10.2f} µs")
+    print(
+        f"Parsing an NZ Herald story of {n_elements} elements takes "
+        f"{parse_us / 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=20000, help="calls per timing")
+    parser.add_argument(
+        "--sources",
+        type=int,
+        nargs="+",
+        default=[2, 10, 100],
+        help="numbers of registered sources to time",
+    )
+    parser.add_argument("--elements", type=int, default=120, help="elements per story")
+    args = parser.parse_args()
+    main(args.n, args.sources, args.elements)
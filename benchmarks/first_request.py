@@ -0,0 +1,95 @@
+"""
+Measure the time to first request after Gunicorn recycles a worker, with and
+without preloading the app in the Gunicorn master.
+
+Run one worker with one thread that is recycled every ``--max-requests`` requests
+and time sequential requests to the app's layout: the first request after a
+recycle waits for the new worker to boot.
+
+Run this from the project root via ``uv run python benchmarks/first_request.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import statistics
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "nzharold"
+
+
+def wait_for(url: str, timeout: float = 60) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{url} did not respond within {timeout} s")
+
+
+def run(preload: bool, port: int, max_requests: int, n_requests: int) -> dict:
+    """
+    Run the app under Gunicorn with the given settings, make the given number of
+    requests, and return the latencies in seconds of the first requests after
+    recycles and of the other requests.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(
+            f"exec(open({str(APP_DIR / 'gunicorn_config.py')!r}).read())\n"
+            f"workers = 1\nthreads = 1\nbind = '127.0.0.1:{port}'\n"
+            f"preload_app = {preload}\naccesslog = None\n"
+            f"max_requests = {max_requests}\nmax_requests_jitter = 0\n"
+        )
+    env = os.environ | {"SECRET_KEY": os.getenv("SECRET_KEY", "benchmark")}
+    p = subprocess.Popen(
+        ["gunicorn", "-c", f.name, "wsgi:application"],
+        cwd=APP_DIR,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/_dash-layout"
+    try:
+        wait_for(url)
+        latencies = []
+        for __ in range(n_requests):
+            t = time.perf_counter()
+            urllib.request.urlopen(url).read()
+            latencies.append(time.perf_counter() - t)
+    finally:
+        p.terminate()
+        p.wait()
+        os.unlink(f.name)
+
+    # The request made in wait_for() counts towards the first worker's requests
+    after_recycle = latencies[max_requests - 1 :: max_requests]
+    others = [
+        x for i, x in enumerate(latencies) if (i + 1 - max_requests) % max_requests
+    ]
+    return {"after_recycle": after_recycle, "others": others}
+
+
+def main(port: int, max_requests: int, n_requests: int) -> None:
+    for preload in [False, True]:
+        r = run(preload, port, max_requests, n_requests)
+        print(
+            f"preload_app = {preload}: first request after recycle "
+            f"mean {statistics.mean(r['after_recycle']) * 1e3:.0f} ms, "
+            f"max {max(r['after_recycle']) * 1e3:.0f} ms "
+            f"({len(r['after_recycle'])} recycles); other requests "
+            f"median {statistics.median(r['others']) * 1e3:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5090)
+    parser.add_argument("--max-requests", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    main(args.port, args.max_requests, args.requests)
@@ -0,0 +1,92 @@
+"""
+Benchmark the per-request overhead of the request guards in ``guard.py``: the bot
+user agent matcher, the bot blocking middleware around a Flask request, and the
+token bucket rate limiter.
+Requests cycle through a few browser user agents, as real traffic mostly does,
+plus unique ones that miss the matcher's memo.
+
+Run this from the project root via ``uv run python benchmarks/guard.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import sys
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import guard as gu
+import index
+import settings as st
+
+BROWSERS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+]
+BOT = "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.2)"
+
+
+def per_call(f, args: list) -> float:
+    """
+    Return the mean microseconds per call of the given function over the given
+    arguments.
+    """
+    t = time.perf_counter()
+    for arg in args:
+        f(arg)
+    return 1e6 * (time.perf_counter() - t) / len(args)
+
+
+def main(n: int) -> None:
+    agents = gu.read_bot_user_agents(st.config.BOT_USER_AGENTS_PATH)
+    common = [BROWSERS[i % len(BROWSERS)] for i in range(n)]
+    unique = [f"{BROWSERS[i % len(BROWSERS)]} build/{i}" for i in range(n)]
+    lowered = [a.lower() for a in agents]
+
+    def naive(user_agent):
+        user_agent = user_agent.lower()
+        return any(a in user_agent for a in lowered)
+
+    print(f"Microseconds per user agent check against {len(agents)} bot user agents:")
+    print(f"  substring loop, common agents   {per_call(naive, common):7.2f}")
+    is_bot = gu.make_bot_matcher(agents)
+    print(f"  matcher, common agents          {per_call(is_bot, common):7.2f}")
+    is_bot = gu.make_bot_matcher(agents)
+    print(f"  matcher, unique agents          {per_call(is_bot, unique):7.2f}")
+    assert is_bot(BOT) and not any(is_bot(a) for a in BROWSERS)
+
+    limiter = gu.TokenBucketLimiter(rate=1e9, burst=10)
+    ips = [f"10.0.{i % 256}.{i % 100}" for i in range(n)]
+    print(f"  token bucket, per take          {per_call(limiter.allow, ips):7.2f}")
+
+    # A cheap request through the whole Flask app, with and without the middleware
+    server = index.server
+    guarded = server.wsgi_app
+    client = server.test_client()
+
+    def request(user_agent):
+        client.get("/_internal/guard", headers={"User-Agent": user_agent})
+
+    common = common[: n // 10]
+    with_guard = per_call(request, common)
+    server.wsgi_app = guarded.app
+    without_guard = per_call(request, common)
+    server.wsgi_app = guarded
+    print("Microseconds per Flask request:")
+    print(f"  without middleware              {without_guard:7.1f}")
+    print(f"  with middleware                 {with_guard:7.1f}")
+    bot = per_call(request, [BOT] * len(common))
+    print(f"  bot, refused by middleware      {bot:7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=100_000, help="number of checks")
+    args = parser.parse_args()
+    main(args.n)
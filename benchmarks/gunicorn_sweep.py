@@ -0,0 +1,499 @@
+"""
+Sweep Gunicorn configurations, numbers of workers and threads per worker and
+worker classes, under a replayable mix of traffic, and recommend the
+configuration with the most throughput whose tail latency meets a target.
+
+Each configuration serves the app of ``benchmarks/story_files.py``, the app with a
+faked logged-in user, via ``gunicorn_config.py`` with fresh caches, and replays
+the same trace of requests from the start: story views via the Dash callback
+``update_story``, mostly of popular stories and partly of new ones, which need an
+upstream fetch and a parse, story JSON requests, and page loads.
+Upstream is the stand-in of ``benchmarks/standin.py``, with made-up stories at a
+given latency, or with the pages of an archive of upstream fetches (see
+``nzharold/archive.py``) at their recorded latencies.
+
+Worker classes are ``gthread`` (and ``sync``, its single-threaded form),
+``gevent``, if installed, and ``uvicorn``, Uvicorn's worker serving the app as WSGI,
+if installed; the others are skipped.
+The report of each sweep, a Markdown table of the results with the recommendation,
+goes to the results folder with the raw results and the trace, and
+``--write-env`` writes the recommendation to ``.env``, from which
+``gunicorn_config.py`` reads it.
+
+The load generator runs on the same host, so give it spare cores or compare
+configurations only relative to each other.
+
+Run this from the project root via ``uv run python benchmarks/gunicorn_sweep.py``.
+"""
+
+import argparse
+import collections
+import concurrent.futures as cf
+import http.client
+import itertools as it
+import json
+import multiprocessing as mp
+import os
+import pathlib as pl
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import story_files as sf
+
+PORT = 5034
+UPSTREAM_PORT = 5035
+UPSTREAM_URL = f"http://127.0.0.1:{UPSTREAM_PORT}"
+STORY_BASE_URL = "https://www.nzherald.co.nz"
+DEFAULT_MIX = "cached=60,new=15,json=15,page=10"
+N_POPULAR = 50
+
+try:
+    from uvicorn.workers import UvicornWorker
+
+    class UvicornWSGIWorker(UvicornWorker):
+        """
+        Uvicorn's Gunicorn worker, serving a WSGI app.
+        """
+
+        CONFIG_KWARGS = UvicornWorker.CONFIG_KWARGS | {"interface": "wsgi"}
+
+except ImportError:
+    UvicornWSGIWorker = None
+
+WORKER_CLASSES = {
+    "gthread": "gthread",
+    "sync": "sync",
+    "gevent": "gevent",
+    "uvicorn": "gunicorn_sweep.UvicornWSGIWorker",
+}
+
+
+def is_supported(worker_class: str) -> bool:
+    if worker_class == "gevent":
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            return False
+    elif worker_class == "uvicorn":
+        return UvicornWSGIWorker is not None
+    return worker_class in WORKER_CLASSES
+
+
+def make_trace(mix: dict[str, float], n: int, seed: int) -> list[tuple[str, str]]:
+    """
+    Return a trace of the given number of (kind, story path) requests in the given
+    mix of kinds, the same for the same seed.
+    Popular stories are requested with Zipf-like frequencies.
+    """
+    rng = random.Random(seed)
+    popular = [f"/nz/popular-{i}/" for i in range(N_POPULAR)]
+    weights = [1 / (i + 1) for i in range(N_POPULAR)]
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=n)
+    trace = []
+    for i, kind in enumerate(kinds):
+        if kind == "new":
+            path = f"/nz/new-{seed}-{i}/"
+        else:
+            path = rng.choices(popular, weights=weights)[0]
+        trace.append((kind, path))
+    return trace
+
+
+def make_request(kind: str, path: str, cookie: str, callback: dict) -> tuple:
+    """
+    Return the (method, path, body, headers) of the request of the given kind for
+    the story at the given path.
+    """
+    headers = {"Cookie": cookie, "Accept-Encoding": "gzip"}
+    if kind in ("cached", "new"):
+        payload = callback | {
+            "inputs": [callback["inputs"][0] | {"value": STORY_BASE_URL + path}]
+        }
+        body = json.dumps(payload).encode()
+        headers["Content-Type"] = "application/json"
+        return "POST", "/_dash-update-component", body, headers
+    elif kind == "json":
+        return "GET", f"/story{path[:-1]}.json", None, headers
+    else:
+        return "GET", "/", None, headers
+
+
+def client_process(requests: list, n_threads: int, duration: float, results) -> None:
+    """
+    Make the given requests from the given number of threads, each over its own
+    keep-alive connection, for at most the given seconds, and put the list of
+    (kind, seconds, status) results on the results queue.
+    """
+    todo = iter(requests)
+    lock = threading.Lock()
+    end = time.perf_counter() + duration
+    done = []
+
+    def work():
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+        while time.perf_counter() < end:
+            with lock:
+                request = next(todo, None)
+            if request is None:
+                break
+            kind, method, path, body, headers = request
+            t = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                r = conn.getresponse()
+                r.read()
+                status = r.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=60)
+                status = 0
+            done.append((kind, time.perf_counter() - t, status))
+        conn.close()
+
+    with cf.ThreadPoolExecutor(n_threads) as executor:
+        for __ in range(n_threads):
+            executor.submit(work)
+    results.put(done)
+
+
+def get_tree_rss(pid: int) -> int:
+    """
+    Return the total RSS in bytes of the given process and its descendants.
+    """
+    children = {}
+    for stat in pl.Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    total = 0
+    todo = [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while todo:
+        p = todo.pop()
+        try:
+            total += int(pl.Path(f"/proc/{p}/statm").read_text().split()[1]) * page_size
+        except OSError:
+            pass
+        todo.extend(children.get(p, []))
+    return total
+
+
+def wait_for(url: str, timeout: float = 30) -> None:
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} didn't respond")
+
+
+def run_config(config: dict, requests: list, args) -> dict:
+    """
+    Serve the app under the given Gunicorn configuration with fresh caches, replay
+    the given requests against it, and return the results.
+    """
+    tmp = pl.Path(tempfile.mkdtemp())
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--config",
+        str(ROOT / "nzharold" / "gunicorn_config.py"),
+        "--chdir",
+        str(ROOT / "nzharold"),
+        "--pythonpath",
+        f"{ROOT / 'benchmarks'},{ROOT / 'nzharold'}",
+        "--bind",
+        f"127.0.0.1:{PORT}",
+        "--workers",
+        str(config["workers"]),
+        "--threads",
+        str(config["threads"]),
+        "--worker-class",
+        WORKER_CLASSES[config["worker_class"]],
+        "--access-logfile",
+        "/dev/null",
+        "--pid",
+        str(tmp / "gunicorn.pid"),
+        "story_files:application",
+    ]
+    env = (
+        os.environ
+        | {
+            "CACHE_DIR": str(tmp / "cache"),
+            "SEARCH_DB_PATH": str(tmp / "search.sqlite"),
+            "UPSTREAM_BASE_URL": UPSTREAM_URL,
+            "UPSTREAM_RATE_LIMIT": "1000000",
+            "FETCH_BURST_PER_IP": "1000000",
+            "FETCH_BURST_PER_USER": "1000000",
+            "PARSE_MODE": args.parse_mode,
+            "WARM_STORIES": "0",
+        }
+        | to_env(config)
+    )
+    gunicorn = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{PORT}/_internal/health")
+        results = mp.Queue()
+        n_processes = min(args.client_processes, args.clients)
+        clients = [
+            mp.Process(
+                target=client_process,
+                args=(
+                    requests[i::n_processes],
+                    len(range(i, args.clients, n_processes)),
+                    args.duration,
+                    results,
+                ),
+            )
+            for i in range(n_processes)
+        ]
+        t = time.perf_counter()
+        for client in clients:
+            client.start()
+        done = list(it.chain.from_iterable(results.get() for __ in clients))
+        elapsed = time.perf_counter() - t
+        rss = get_tree_rss(gunicorn.pid)
+        for client in clients:
+            client.join()
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait()
+
+    ok = sorted(seconds for __, seconds, status in done if status == 200)
+    by_kind = {}
+    for kind in sorted({kind for kind, __, __ in done}):
+        times = sorted(s for k, s, status in done if k == kind and status == 200)
+        by_kind[kind] = 1000 * percentile(times, 0.99) if times else None
+    return config | {
+        "requests": len(done),
+        "errors": len(done) - len(ok),
+        "requests/s": len(ok) / elapsed,
+        "p50 ms": 1000 * statistics.median(ok) if ok else None,
+        "p95 ms": 1000 * percentile(ok, 0.95) if ok else None,
+        "p99 ms": 1000 * percentile(ok, 0.99) if ok else None,
+        "p99 ms by kind": by_kind,
+        "error statuses": dict(
+            collections.Counter(status for __, __, status in done if status != 200)
+        ),
+        "RSS MB": rss / 2**20,
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def recommend(results: list[dict], slo_ms: float, max_error_rate: float):
+    """
+    Return the pair (result, reason) of the recommended configuration: the one with
+    the most throughput among those with at most the given rate of errors and a
+    99th percentile latency within the given target, or else the one with the
+    lowest 99th percentile latency.
+    """
+    valid = [
+        r
+        for r in results
+        if r["p99 ms"] is not None and r["errors"] <= max_error_rate * r["requests"]
+    ]
+    meeting = [r for r in valid if r["p99 ms"] <= slo_ms]
+    if meeting:
+        # Prefer fewer processes, hence less memory, among near-equals
+        best = max(r["requests/s"] for r in meeting)
+        near = [r for r in meeting if r["requests/s"] >= 0.95 * best]
+        choice = min(near, key=lambda r: (r["workers"], -r["requests/s"]))
+        return choice, (
+            f"the most throughput, within 5%, with p99 within {slo_ms:.0f} ms, "
+            "on the fewest workers"
+        )
+    if valid:
+        choice = min(valid, key=lambda r: r["p99 ms"])
+        return choice, f"no configuration met p99 {slo_ms:.0f} ms; lowest p99"
+    return None, "every configuration failed"
+
+
+def format_report(results: list[dict], choice, reason: str, info: dict) -> str:
+    columns = ["requests/s", "p50 ms", "p95 ms", "p99 ms", "errors", "RSS MB"]
+    lines = [
+        f"# Gunicorn sweep {info['date']}",
+        "",
+        ", ".join(f"{k}: {v}" for k, v in info.items() if k != "date"),
+        "",
+        "| class | workers | threads | " + " | ".join(columns) + " |",
+        "|---|---:|---:|" + "---:|" * len(columns),
+    ]
+    for r in results:
+        cells = [
+            "-" if r[c] is None else f"{r[c]:.1f}" if isinstance(r[c], float) else r[c]
+            for c in columns
+        ]
+        lines.append(
+            f"| {r['worker_class']} | {r['workers']} | {r['threads']} | "
+            + " | ".join(str(c) for c in cells)
+            + " |"
+        )
+    lines.append("")
+    if choice is None:
+        lines.append(f"No recommendation: {reason}.")
+    else:
+        lines.append(
+            f"Recommended: {choice['worker_class']}, {choice['workers']} workers, "
+            f"{choice['threads']} threads ({reason}):"
+        )
+        lines += ["", "```", *[f"{k}={v}" for k, v in to_env(choice).items()], "```"]
+    return "\n".join(lines) + "\n"
+
+
+def to_env(config: dict) -> dict[str, str]:
+    """
+    Return the settings of the given configuration as environment variables.
+    A worker may have as many upstream fetches in flight as it has threads, as in
+    the default configuration; gevent and Uvicorn workers keep the default.
+    """
+    env = {
+        "GUNICORN_WORKERS": str(config["workers"]),
+        "GUNICORN_THREADS": str(config["threads"]),
+        "GUNICORN_WORKER_CLASS": WORKER_CLASSES[config["worker_class"]],
+    }
+    if config["worker_class"] in ("gthread", "sync"):
+        env["UPSTREAM_MAX_CONCURRENCY"] = str(config["threads"])
+    return env
+
+
+def get_configs(args) -> list[dict]:
+    configs = []
+    for worker_class in args.classes.split(","):
+        if not is_supported(worker_class):
+            print(f"Skipping worker class {worker_class}, which isn't installed")
+            continue
+        # Only gthread workers have threads
+        threads = args.threads if worker_class == "gthread" else [1]
+        for workers, n_threads in it.product(args.workers, threads):
+            config = {
+                "worker_class": worker_class,
+                "workers": workers,
+                "threads": n_threads,
+            }
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def main(args) -> None:
+    mix = {
+        kind: float(weight)
+        for kind, weight in (item.split("=") for item in args.mix.split(","))
+    }
+    trace = make_trace(mix, args.requests, args.seed)
+    cookie = sf.make_session_cookie()
+    callback = json.loads(sf.make_callback_body(""))
+    requests = [
+        (kind, *make_request(kind, path, cookie, callback)) for kind, path in trace
+    ]
+
+    command = [sys.executable, str(ROOT / "benchmarks" / "standin.py")]
+    command += ["--port", str(UPSTREAM_PORT)]
+    if args.upstream_archive:
+        command += ["--archive", args.upstream_archive]
+    upstream = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for(
+            f"{UPSTREAM_URL}/_standin?latency={args.latency}&n_elements={args.elements}"
+        )
+        for config in get_configs(args):
+            result = run_config(config, requests, args)
+            print(
+                f"{config['worker_class']:>8} {config['workers']:>3} workers "
+                f"{config['threads']:>3} threads: {result['requests/s']:7.1f} "
+                f"requests/s, p99 {result['p99 ms'] or 0:7.0f} ms, "
+                f"{result['errors']} errors"
+            )
+            results.append(result)
+    finally:
+        upstream.terminate()
+
+    choice, reason = recommend(results, args.slo_ms, args.max_error_rate)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    info = {
+        "date": stamp,
+        "host": platform.node(),
+        "cores": os.cpu_count(),
+        "python": platform.python_version(),
+        "mix": args.mix,
+        "seed": args.seed,
+        "clients": args.clients,
+        "duration s": args.duration,
+        "upstream": args.upstream_archive or f"stand-in, {args.latency} s latency",
+        "elements": args.elements,
+        "parse mode": args.parse_mode,
+    }
+    report = format_report(results, choice, reason, info)
+    print()
+    print(report)
+
+    out = pl.Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    (out / f"gunicorn_sweep-{stamp}.md").write_text(report)
+    (out / f"gunicorn_sweep-{stamp}.json").write_text(
+        json.dumps({"info": info, "results": results, "trace": trace}, indent=1)
+    )
+    print(f"Saved the report and results to {out}/gunicorn_sweep-{stamp}.*")
+
+    if args.write_env and choice is not None:
+        import dotenv as de
+
+        for key, value in to_env(choice).items():
+            de.set_key(ROOT / ".env", key, value)
+        print(f"Wrote the recommendation to {ROOT / '.env'}")
+
+
+def parse_ints(text: str) -> list[int]:
+    return [int(n) for n in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=parse_ints, default=[1, 2, 4])
+    parser.add_argument("--threads", type=parse_ints, default=[1, 4, 8])
+    parser.add_argument("--classes", default="gthread,sync,gevent,uvicorn")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of request kinds")
+    parser.add_argument("--requests", type=int, default=3000, help="trace length")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the trace")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds per configuration at most"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.2, help="stand-in upstream latency, s"
+    )
+    parser.add_argument("--elements", type=int, default=60, help="elements per story")
+    parser.add_argument("--upstream-archive", help="archive for the stand-in to serve")
+    parser.add_argument("--parse-mode", default="thread", choices=["thread", "process"])
+    parser.add_argument("--slo-ms", type=float, default=1000, help="p99 target")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--out", default=str(ROOT / "benchmarks" / "results"))
+    parser.add_argument(
+        "--write-env", action="store_true", help="write the recommendation to .env"
+    )
+    main(parser.parse_args())
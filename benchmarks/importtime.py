@@ -0,0 +1,66 @@
+"""
+Audit the time it takes to import the app, as a Gunicorn worker does, using
+``python -X importtime``.
+Print the total import time and the slowest top-level imports, noting which
+packages the app imports lazily.
+
+Run this from the project root via ``uv run python benchmarks/importtime.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import subprocess
+import sys
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "nzharold"
+LAZY_PACKAGES = ["bs4", "markdownify", "requests"]
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int, int]]:
+    """
+    Parse the given ``-X importtime`` output into a list of triples
+    (module, self time in microseconds, cumulative time in microseconds),
+    where nested modules keep their indentation.
+    """
+    result = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        result.append((module.rstrip()[1:], int(self_us), int(cumulative_us)))
+    return result
+
+
+def main(module: str = "wsgi", n_top: int = 20) -> None:
+    env = os.environ | {"SECRET_KEY": os.getenv("SECRET_KEY", "benchmark")}
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = parse_importtime(p.stderr)
+    target = next(r for r in rows if r[0] == module)
+    print(f"Importing {module} took {target[2] / 1e3:.0f} ms")
+
+    print(f"\nSlowest {n_top} imports by cumulative time:")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[2])[:n_top]:
+        print(f"{cumulative_us / 1e3:8.1f} ms {self_us / 1e3:8.1f} ms  {name}")
+
+    print("\nLazily imported packages (should be absent):")
+    imported = {name.strip() for name, *__ in rows}
+    for package in LAZY_PACKAGES:
+        status = "imported" if package in imported else "not imported"
+        print(f"  {package}: {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="wsgi", help="module to import")
+    parser.add_argument("--top", type=int, default=20, help="number of imports to list")
+    args = parser.parse_args()
+    main(args.module, args.top)
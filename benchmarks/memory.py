@@ -0,0 +1,130 @@
+"""
+Measure how a worker's memory grows as it serves story views, to tell whether
+workers need recycling after a number of requests (Gunicorn's ``max_requests``)
+or only above a memory threshold (``WORKER_MAX_RSS``).
+
+Readers view distinct uncached stories via the Dash callback ``update_story``,
+against the Flask test client with a faked logged-in user, from the stand-in
+upstream of ``benchmarks/standin.py``.
+Report the worker's RSS every so many views, first untraced, then with
+allocations traced by tracemalloc, along with the views per second, which shows
+the cost of tracing, the memory attributed to the callback (see
+``memory.track``) and the allocation sites that grew the most over the traced
+views.
+
+Run this from the project root via ``uv run python benchmarks/memory.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["FETCH_BURST_PER_IP"] = "1000000"
+os.environ["FETCH_BURST_PER_USER"] = "1000000"
+os.environ["UPSTREAM_RATE_LIMIT"] = "1000000"
+
+import standin
+
+server = standin.start()
+os.environ["UPSTREAM_BASE_URL"] = server.base_url
+
+import app as ap
+import index
+import memory as mem
+import search_index as si
+
+MB = 2**20
+
+
+def make_view(client, dependencies: list[dict]):
+    """
+    Return a function that views the story at a given URL via the callback
+    ``update_story`` with the given test client.
+    """
+    query_url = {"id": "query-url", "property": "value"}
+    dep = next(d for d in dependencies if d["inputs"][0] == query_url)
+    outputs = [o.rsplit(".", 1) for o in dep["output"].strip(".").split("...")]
+
+    def view(url: str) -> None:
+        payload = {
+            "output": dep["output"],
+            "outputs": [{"id": i, "property": p} for i, p in outputs],
+            "inputs": [query_url | {"value": url}],
+            "changedPropIds": ["query-url.value"],
+            "state": [s | {"value": None} for s in dep["state"]],
+        }
+        r = client.post("/_dash-update-component", json=payload)
+        assert r.status_code == 200, r.status_code
+
+    return view
+
+
+def run(view, n: int, every: int) -> float:
+    """
+    View the given number of new stories, printing the RSS every given number of
+    views, and return the views per second.
+    """
+    print(f"    {'views':>8}{'RSS MB':>10}{'traced MB':>12}")
+    t = time.perf_counter()
+    for i in range(1, n + 1):
+        view(f"https://www.nzherald.co.nz/nz/{uuid.uuid4().hex}/")
+        if i % every == 0:
+            traced = tracemalloc.get_traced_memory()[0]
+            print(f"    {i:>8}{mem.get_rss() / MB:>10.1f}{traced / MB:>12.1f}")
+    return n / (time.perf_counter() - t)
+
+
+def main(n: int, every: int, frames: int, n_sites: int) -> None:
+    # Keep the search index out of the measurements and out of the data folder
+    si.index_story = lambda story: None
+    ap.login_manager.user_loader(lambda user_id: ap.User(id=0, username="benchmark"))
+    client = index.server.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "0"
+        session["_fresh"] = True
+    view = make_view(client, client.get("/_dash-dependencies").get_json())
+
+    # Warm up the code paths
+    for __ in range(20):
+        view(f"https://www.nzherald.co.nz/nz/{uuid.uuid4().hex}/")
+
+    print(f"Untraced, RSS {mem.get_rss() / MB:.1f} MB after warming up:")
+    rate = run(view, n, every)
+    print(f"    {rate:.1f} views/s")
+
+    tracemalloc.start(frames)
+    first = mem.take_snapshot()
+    mem.calls.clear()
+    print(f"Traced with {frames} frames:")
+    rate = run(view, n, every)
+    print(f"    {rate:.1f} views/s")
+    stats = mem.calls["update_story"]
+    print(
+        f"    update_story: peak traced {stats['max_peak'] / MB:.2f} MB at most, "
+        f"RSS growth {stats['rss_growth'] / stats['calls'] / 1024:.1f} kB per call"
+    )
+    print("    Allocation sites that grew the most:")
+    for site in mem.diff_snapshots(mem.take_snapshot(), first, n_sites):
+        print(
+            f"    {site['size_diff'] / 1024:>10.1f} kB {site['count_diff']:>+8} "
+            f"blocks  {site['site']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=1000, help="story views per run")
+    parser.add_argument("--every", type=int, default=200, help="views per report")
+    parser.add_argument("--frames", type=int, default=1, help="frames to trace")
+    parser.add_argument("--sites", type=int, default=10, help="sites to list")
+    args = parser.parse_args()
+    main(args.n, args.every, args.frames, args.sites)
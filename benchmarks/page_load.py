@@ -0,0 +1,149 @@
+"""
+Measure the bytes transferred and the time taken to load the app's first page in a
+headless browser, cold, with an empty browser cache, and warm, on a second visit,
+with the static assets built (see ``nzharold/static_assets.py``) and without, when
+pages link Bootstrap on its CDN and Dash serves ``assets/`` and its component
+scripts uncompressed and to be revalidated.
+
+Build the assets into a temporary folder, with the vendored files if any, serve the
+app under Gunicorn with each, and load the page in Chromium via Playwright until
+the page content renders, counting the bytes of the page and of the resources that
+it loads by their Resource Timing transfer sizes, which are zero for those served
+from the browser cache.
+
+Run this from the project root via
+``uv run --with playwright python benchmarks/page_load.py``, having installed the
+browser via ``uv run --with playwright playwright install chromium``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "nzharold"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+# The bytes transferred for the page and its resources, and the resources
+# transferred rather than served from the browser cache
+TRANSFER_SCRIPT = """() => {
+    const entries = performance.getEntriesByType("navigation")
+        .concat(performance.getEntriesByType("resource"));
+    return [
+        entries.reduce((total, entry) => total + entry.transferSize, 0),
+        entries.filter((entry) => entry.transferSize > 0).length,
+    ];
+}"""
+
+
+def wait_for(url: str, timeout: float = 60) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{url} did not respond within {timeout} s")
+
+
+def build(static_dir: pl.Path) -> None:
+    """
+    Build the static assets into the given folder.
+    """
+    subprocess.run(
+        [sys.executable, "static_assets.py", "build"],
+        cwd=APP_DIR,
+        env=os.environ | {"STATIC_DIR": str(static_dir)},
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def load(context, url: str) -> dict:
+    """
+    Load the page at the given URL in a new tab of the given browser context until
+    its content renders and return the seconds taken, the bytes transferred, and
+    the number of resources transferred.
+    """
+    page = context.new_page()
+    t = time.perf_counter()
+    page.goto(url)
+    page.wait_for_selector("#page-content > *")
+    seconds = time.perf_counter() - t
+    # Let the resources loaded on demand finish
+    page.wait_for_load_state("networkidle")
+    transferred, n_resources = page.evaluate(TRANSFER_SCRIPT)
+    page.close()
+    return {"seconds": seconds, "bytes": transferred, "resources": n_resources}
+
+
+def run(browser, static_dir: pl.Path, port: int, n_loads: int) -> dict:
+    """
+    Serve the app with the given static folder and return the cold and warm loads
+    of its first page, each loaded the given number of times.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
+        f.write(
+            f"exec(open({str(APP_DIR / 'gunicorn_config.py')!r}).read())\n"
+            f"workers = 1\nbind = '127.0.0.1:{port}'\naccesslog = None\n"
+        )
+    p = subprocess.Popen(
+        ["gunicorn", "-c", f.name, "wsgi:application"],
+        cwd=APP_DIR,
+        env=os.environ | {"STATIC_DIR": str(static_dir)},
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/"
+    result = {"cold": [], "warm": []}
+    try:
+        wait_for(url)
+        for __ in range(n_loads):
+            context = browser.new_context()
+            result["cold"].append(load(context, url))
+            result["warm"].append(load(context, url))
+            context.close()
+    finally:
+        p.terminate()
+        p.wait()
+        os.unlink(f.name)
+    return result
+
+
+def main(port: int, n_loads: int) -> None:
+    from playwright.sync_api import sync_playwright
+
+    with tempfile.TemporaryDirectory() as tmp:
+        static_dir = pl.Path(tmp) / "static"
+        build(static_dir)
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch()
+            for label, directory in [
+                ("CDN and unbuilt assets", pl.Path(tmp) / "none"),
+                ("built assets", static_dir),
+            ]:
+                result = run(browser, directory, port, n_loads)
+                print(f"{label}, median of {n_loads} loads:")
+                for kind, loads in result.items():
+                    seconds = statistics.median(x["seconds"] for x in loads)
+                    kb = statistics.median(x["bytes"] for x in loads) / 1000
+                    n_resources = statistics.median(x["resources"] for x in loads)
+                    print(
+                        f"  {kind}: {seconds * 1000:.0f} ms, {kb:.0f} kB in "
+                        f"{n_resources:.0f} transfers"
+                    )
+            browser.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5040)
+    parser.add_argument("-n", type=int, default=5, help="loads per configuration")
+    args = parser.parse_args()
+    main(args.port, args.n)
@@ -0,0 +1,187 @@
+"""
+Count the server requests per page view and time to content for a few pages,
+by replaying the initial callback cascade that the Dash renderer runs after
+loading a page, against the Flask test client.
+
+The cascade starts with the app layout; callbacks whose inputs are all in the
+layout fire first, unless they prevent initial calls, then callbacks whose inputs
+are changed or newly inserted by the responses fire in the next wave, and so on.
+Requests in a wave run in parallel in a browser, so the time to content is the sum
+over the sequential round trips (page, layout, then one per wave) of the network
+round-trip time plus the slowest server time of the round trip.
+Clientside callbacks cost no request and are not replayed.
+
+A logged-in user is faked and the story page is served from a prefilled story
+cache in a temporary folder, so no database or upstream is needed.
+
+Run this from the project root via ``uv run python benchmarks/page_view.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+
+import app as ap
+import index
+import stories as sto
+
+STORY_PATH = "/nz/a-benchmark-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/"
+STORY = {
+    "url": f"https://www.nzherald.co.nz{STORY_PATH}",
+    "title": "A benchmark story",
+    "elements": [
+        {"type": "text", "content": f"<p>Paragraph {i} of the story.</p>" * 3}
+        for i in range(30)
+    ]
+    + [{"type": "image", "src": "https://example.com/image.jpg", "caption": "Image"}],
+}
+PATHNAMES = {"story": STORY_PATH, "reading list": "/reading-list", "search": "/search"}
+
+
+def walk(tree, found: dict) -> dict:
+    """
+    Collect the props of the components with IDs in the given plain component tree
+    into the given dictionary of ID -> props and return it.
+    """
+    if isinstance(tree, list):
+        for item in tree:
+            walk(item, found)
+    elif isinstance(tree, dict) and "props" in tree:
+        props = tree["props"]
+        if "id" in props:
+            found[props["id"]] = props
+        walk(props.get("children"), found)
+    return found
+
+
+def parse_outputs(output: str) -> list[tuple[str, str]]:
+    return [tuple(o.rsplit(".", 1)) for o in output.strip(".").split("...") if o]
+
+
+def view_page(client, dependencies: list[dict], pathname: str) -> tuple[int, int, float]:
+    """
+    Replay a page view of the given pathname and return the triple
+    (number of requests, number of sequential round trips, server time in seconds).
+    """
+    t = time.perf_counter()
+    layout = client.get("/_dash-layout").get_json()
+    elapsed = time.perf_counter() - t
+    n_requests = n_round_trips = 2  # Page HTML and layout
+    props = walk(layout, {})
+    props["location"]["pathname"] = pathname
+
+    def fire(dep) -> bool:
+        return all(i["id"] in props for i in dep["inputs"])
+
+    wave = [
+        d
+        for d in dependencies
+        if not d["prevent_initial_call"] and not d["clientside_function"] and fire(d)
+    ]
+    while wave:
+        # Callbacks wait for the callbacks in their wave whose outputs they depend on
+        blocked = [
+            d
+            for d in wave
+            if any(
+                (i["id"], i["property"]) in parse_outputs(other["output"])
+                for i in d["inputs"]
+                for other in wave
+                if other is not d
+            )
+        ]
+        wave = [d for d in wave if d not in blocked]
+        changed = set()
+        new_ids = set()
+        latencies = []
+        for dep in wave:
+            payload = {
+                "output": dep["output"],
+                "outputs": [
+                    {"id": i, "property": p} for i, p in parse_outputs(dep["output"])
+                ],
+                "inputs": [
+                    i | {"value": props[i["id"]].get(i["property"])}
+                    for i in dep["inputs"]
+                ],
+                "changedPropIds": [],
+                "state": [
+                    s | {"value": props.get(s["id"], {}).get(s["property"])}
+                    for s in dep["state"]
+                ],
+            }
+            if len(payload["outputs"]) == 1:
+                payload["outputs"] = payload["outputs"][0]
+            t = time.perf_counter()
+            r = client.post("/_dash-update-component", json=payload)
+            latencies.append(time.perf_counter() - t)
+            n_requests += 1
+            if r.status_code != 200:
+                continue
+            for id_, new_props in r.get_json()["response"].items():
+                props.setdefault(id_, {}).update(new_props)
+                for prop, value in new_props.items():
+                    changed.add((id_, prop))
+                    if prop == "children":
+                        inserted = walk(value, {})
+                        props.update(inserted)
+                        new_ids |= set(inserted)
+
+        elapsed += max(latencies)
+        n_round_trips += 1
+        wave = blocked + [
+            d
+            for d in dependencies
+            if d not in blocked
+            and not d["clientside_function"]
+            and fire(d)
+            and (
+                any((i["id"], i["property"]) in changed for i in d["inputs"])
+                or (
+                    not d["prevent_initial_call"]
+                    and any(i["id"] in new_ids for i in d["inputs"])
+                )
+            )
+        ]
+
+    return n_requests, n_round_trips, elapsed
+
+
+def main(n: int, rtt: float) -> None:
+    sto.cache_story(STORY)
+    ap.login_manager.user_loader(lambda user_id: ap.User(id=0, username="benchmark"))
+    client = index.server.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "0"
+        session["_fresh"] = True
+    dependencies = client.get("/_dash-dependencies").get_json()
+
+    for page, pathname in PATHNAMES.items():
+        results = [view_page(client, dependencies, pathname) for __ in range(n)]
+        n_requests, n_round_trips, __ = results[0]
+        server_time = statistics.median(r[2] for r in results)
+        print(
+            f"{page:<14} {n_requests} requests in {n_round_trips} round trips per "
+            f"page view; time to content {(server_time + n_round_trips * rtt) * 1e3:.0f}"
+            f" ms at {rtt * 1e3:.0f} ms round-trip time "
+            f"({server_time * 1e3:.1f} ms on the server)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=50, help="number of page views")
+    parser.add_argument(
+        "--rtt", type=float, default=0.05, help="network round-trip time in seconds"
+    )
+    args = parser.parse_args()
+    main(args.n, args.rtt)
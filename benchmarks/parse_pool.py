@@ -0,0 +1,135 @@
+"""
+Benchmark the parsing and rendering of freshly fetched stories in a worker's
+threads (``PARSE_MODE=thread``) against in its parsing processes
+(``PARSE_MODE=process``), under many concurrent requests for distinct stories.
+Each request gets a story that isn't cached, as a reader's first view of it does,
+from the stand-in upstream of ``benchmarks/standin.py``, run in a process of its
+own so as not to contend for this one's GIL.
+
+The parsing processes only pay off with a core each to run on, so compare runs on
+machines with different numbers of cores.
+
+Run this from the project root via ``uv run python benchmarks/parse_pool.py``.
+"""
+
+import argparse
+import concurrent.futures as cf
+import os
+import pathlib as pl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["UPSTREAM_RATE_LIMIT"] = "1000000"
+os.environ["UPSTREAM_MAX_CONCURRENCY"] = "1000"
+
+import standin
+
+UPSTREAM_URL = "http://127.0.0.1:5031"
+os.environ["UPSTREAM_BASE_URL"] = UPSTREAM_URL
+
+import index
+import settings as st
+import stories as sto
+from pages import main as mp
+
+
+def run(mode: str, n_threads: int, n_stories: int) -> dict:
+    st.config.PARSE_MODE = mode
+    urls = [
+        f"https://www.nzherald.co.nz/nz/{uuid.uuid4().hex}/" for __ in range(n_stories)
+    ]
+    times = []
+
+    def request(url):
+        t = time.perf_counter()
+        story, __ = mp.get_rendered_story(url)
+        assert story is not None
+        times.append(time.perf_counter() - t)
+
+    cpu = time.process_time()
+    t = time.perf_counter()
+    with cf.ThreadPoolExecutor(n_threads) as executor:
+        list(executor.map(request, urls))
+    elapsed = time.perf_counter() - t
+    cpu = time.process_time() - cpu
+
+    times.sort()
+    return {
+        "stories/s": n_stories / elapsed,
+        "p50 ms": 1000 * statistics.median(times),
+        "p99 ms": 1000 * times[int(0.99 * len(times))],
+        "worker CPU ms/story": 1000 * cpu / n_stories,
+    }
+
+
+def main(threads: list[int], n_stories: int, n_elements: int, latency: float) -> None:
+    upstream = subprocess.Popen(
+        [sys.executable, str(ROOT / "benchmarks" / "standin.py"), "--port", "5031"],
+        stdout=subprocess.DEVNULL,
+    )
+    control = f"{UPSTREAM_URL}/_standin?latency={latency}&n_elements={n_elements}"
+    for __ in range(50):
+        try:
+            urllib.request.urlopen(control).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    try:
+        compare(threads, n_stories, n_elements, latency)
+    finally:
+        upstream.terminate()
+
+
+def compare(threads: list[int], n_stories: int, n_elements: int, latency: float):
+    page = standin.make_page("/nz/example/", n_elements)
+    print(
+        f"{n_stories} uncached stories of {n_elements} elements ({len(page) // 1000} "
+        f"kB pages, {1000 * latency:.0f} ms upstream latency), "
+        f"{st.config.PARSE_PROCESSES} parsing processes, {os.cpu_count()} cores:"
+    )
+
+    # Start the parsing processes and warm the stories' code paths in both modes
+    sto.start_parse_pool()
+    for mode in ["thread", "process"]:
+        run(mode, 1, st.config.PARSE_PROCESSES)
+
+    for n_threads in threads:
+        results = {
+            mode: run(mode, n_threads, n_stories) for mode in ["thread", "process"]
+        }
+        print(f"  {n_threads} concurrent requests")
+        print(f"    {'':<22}" + "".join(f"{mode:>12}" for mode in results))
+        for key in results["thread"]:
+            print(
+                f"    {key:<22}" + "".join(f"{r[key]:>12.1f}" for r in results.values())
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--threads",
+        default="16,32",
+        help="comma-separated numbers of concurrent requests",
+    )
+    parser.add_argument("--stories", type=int, default=320, help="stories per run")
+    parser.add_argument("--elements", type=int, default=120, help="elements per story")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="upstream latency in seconds"
+    )
+    args = parser.parse_args()
+    main(
+        [int(n) for n in args.threads.split(",")],
+        args.stories,
+        args.elements,
+        args.latency,
+    )
@@ -0,0 +1,140 @@
+"""
+Benchmark how readers' upstream fetches fare against background fetches (live
+refreshes and prefetches) under the upstream fetch scheduler (see
+``nzharold/scheduler.py``), against the same load with every fetch in one class,
+which is how fetches competed before there were classes.
+
+Background threads fetch stories back to back in the revalidation and prefetch
+classes, while readers fetch stories one at a time with a pause between, half of
+them stories that the prefetch threads have queued, which the readers' fetches
+cancel, all from one stand-in upstream of ``benchmarks/standin.py`` with the
+given latency.
+Report the readers' fetch times and, per class, the fetches admitted, timed out,
+and cancelled, and the waits for a slot.
+
+Run this from the project root via ``uv run python benchmarks/scheduler.py``.
+"""
+
+import argparse
+import os
+import pathlib as pl
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["UPSTREAM_RATE_LIMIT"] = "1000000"
+os.environ["UPSTREAM_FAILURE_RATE"] = "1.1"
+
+import standin
+
+server = standin.start()
+os.environ["UPSTREAM_BASE_URL"] = server.base_url
+
+import scheduler as sch
+import settings as st
+import stories as sto
+
+
+def new_url() -> str:
+    return f"https://www.nzherald.co.nz/nz/{uuid.uuid4().hex}/"
+
+
+def run(n_readers: int, n_background: int, duration: float, classes: bool) -> dict:
+    """
+    Run the load for the given seconds, with the background fetches in their
+    classes if ``classes``, or else in the interactive class, and return the
+    readers' fetch times and the scheduler's stats.
+    """
+    sch.scheduler = sch.Scheduler(reserve=st.config.UPSTREAM_INTERACTIVE_RESERVE)
+    end = time.monotonic() + duration
+    upcoming = []
+    lock = threading.Lock()
+    times = []
+
+    def background(i: int) -> None:
+        priority = ["revalidation", "prefetch"][i % 2] if classes else "interactive"
+        while time.monotonic() < end:
+            url = new_url()
+            if priority == "prefetch" or not classes:
+                with lock:
+                    upcoming.append(url)
+            try:
+                with sch.work(priority, f"background-{i}"):
+                    sto.fetch_upstream(url, wait=st.config.UPSTREAM_BACKGROUND_WAIT)
+            except sto.UpstreamUnavailable:
+                pass
+
+    def reader(i: int) -> None:
+        rng = random.Random(i)
+        while time.monotonic() < end:
+            with lock:
+                url = upcoming.pop() if upcoming and rng.random() < 0.5 else new_url()
+            t = time.perf_counter()
+            try:
+                with sch.work("interactive", f"reader-{i}"):
+                    sto.fetch_upstream(url)
+            except sto.UpstreamUnavailable:
+                times.append(float("inf"))
+            else:
+                times.append(time.perf_counter() - t)
+            time.sleep(rng.uniform(0.05, 0.15))
+
+    threads = [
+        threading.Thread(target=background, args=(i,)) for i in range(n_background)
+    ] + [threading.Thread(target=reader, args=(i,)) for i in range(n_readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"times": sorted(times), "stats": sch.scheduler.get_stats()}
+
+
+def main(n_readers: int, n_background: int, duration: float, latency: float) -> None:
+    server.latency = latency
+    print(
+        f"{n_readers} readers and {n_background} background threads, "
+        f"{st.config.UPSTREAM_MAX_CONCURRENCY} fetches per host, "
+        f"{latency * 1000:.0f} ms upstream latency, {duration:.0f} s per run:"
+    )
+    for label, classes in [("one class", False), ("priority classes", True)]:
+        result = run(n_readers, n_background, duration, classes)
+        times = result["times"]
+        ok = [t for t in times if t != float("inf")]
+        print(f"  {label}:")
+        print(
+            f"    reader fetches: {len(times)}, turned away {len(times) - len(ok)}, "
+            f"median {statistics.median(ok) * 1000:.0f} ms, "
+            f"p95 {ok[int(0.95 * (len(ok) - 1))] * 1000:.0f} ms"
+        )
+        for priority, stats in result["stats"]["classes"].items():
+            if not stats["admitted"] + stats["timed_out"] + stats["cancelled"]:
+                continue
+            print(
+                f"    {priority:<13} admitted {stats['admitted']:>5}, "
+                f"timed out {stats['timed_out']:>4}, "
+                f"cancelled {stats['cancelled']:>4}, wait "
+                f"p50 {stats['wait_p50'] * 1000:>6.0f} ms, "
+                f"p95 {stats['wait_p95'] * 1000:>6.0f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=4, help="reader threads")
+    parser.add_argument(
+        "--background", type=int, default=12, help="background fetch threads"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="upstream latency in seconds"
+    )
+    args = parser.parse_args()
+    main(args.readers, args.background, args.duration, args.latency)
@@ -0,0 +1,179 @@
+"""
+A local stand-in for the NZ Herald, which serves made-up story pages in the
+NZ Herald's format at every path, with configurable latency and failures, to test
+and benchmark the app without touching upstream.
+
+Point the app at it via the ``UPSTREAM_BASE_URL`` setting, e.g. run
+``uv run python benchmarks/standin.py --port 5030 --latency 2 --failure-rate 0.5``
+and start the app with ``UPSTREAM_BASE_URL=http://127.0.0.1:5030``.
+Change the latency, failure rate, and number of elements per story of a running
+stand-in via a request like ``GET /_standin?latency=0.1&failure_rate=0&n_elements=30``.
+
+To serve real recorded pages instead, at their recorded latency, pass an archive
+of upstream fetches (see ``nzharold/archive.py``) via ``--archive``, e.g.
+``--archive data/archive``; paths that the archive lacks get made-up pages.
+
+Benchmarks can also start it in a thread via :func:`start`.
+
+Run this from the project root via ``uv run python benchmarks/standin.py``.
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import pathlib as pl
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse as up
+
+
+def make_page(path: str, n_elements: int = 30) -> str:
+    """
+    Return the HTML of a made-up NZ Herald story page for the given path, the same
+    for the same story ID, whatever the section path, as the NZ Herald serves a
+    story at any, or for the same path if it has no story ID.
+    """
+    match = re.search(r"/([0-9A-Z]{26})/?$", path)
+    key = match.group(1) if match else path
+    seed = int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16)
+    elements = []
+    for i in range(n_elements):
+        if i % 8 == 7:
+            elements.append(
+                {
+                    "type": "image",
+                    "additional_properties": {
+                        "originalUrl": f"https://images.example.com/{seed}/{i}.jpg"
+                    },
+                    "caption": f"Image {i} of story {seed}",
+                }
+            )
+        else:
+            elements.append(
+                {
+                    "type": "text",
+                    "content": f"<p>Paragraph {i} of story {seed}, with "
+                    '<a href="https://www.nzherald.co.nz/nz/another-story/">a link'
+                    "</a> and some more words to make it longer.</p>",
+                }
+            )
+    content = json.dumps({"elements": elements, "promo": True})
+    return (
+        f"<html><head><title>Story {seed}</title></head><body>"
+        '<script id="fusion-metadata" type="application/javascript">'
+        f"Fusion.globalContent={content};Fusion.globalContentConfig={{}};"
+        "</script></body></html>"
+    )
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status: int, body: str, content_type: str = "text/html") -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        url = up.urlparse(self.path)
+        if url.path == "/_standin":
+            params = up.parse_qs(url.query)
+            if "latency" in params:
+                server.latency = float(params["latency"][0])
+            if "failure_rate" in params:
+                server.failure_rate = float(params["failure_rate"][0])
+            if "n_elements" in params:
+                server.n_elements = int(params["n_elements"][0])
+            self.send(
+                200,
+                json.dumps(
+                    {
+                        "latency": server.latency,
+                        "failure_rate": server.failure_rate,
+                        "n_elements": server.n_elements,
+                        "n_requests": server.n_requests,
+                    }
+                ),
+                "application/json",
+            )
+            return
+
+        with server.lock:
+            server.n_requests += 1
+        found = None
+        if server.archive is not None:
+            found = server.archive.find(f"https://www.nzherald.co.nz{url.path}")
+        if found is not None:
+            time.sleep(found["fetch_time"])
+            self.send_response(found["status"])
+            self.send_header(
+                "Content-Type", found["headers"].get("content-type", "text/html")
+            )
+            self.send_header("Content-Length", str(len(found["content"])))
+            self.end_headers()
+            self.wfile.write(found["content"])
+            return
+
+        time.sleep(server.latency * random.uniform(0.8, 1.2))
+        if random.random() < server.failure_rate:
+            self.send(503, "Service unavailable")
+        else:
+            self.send(200, make_page(url.path, server.n_elements))
+
+
+class StandinServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0, failure_rate: float = 0):
+        super().__init__(address, Handler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.n_elements = 30
+        self.n_requests = 0
+        self.archive = None
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start(port: int = 0, latency: float = 0, failure_rate: float = 0) -> StandinServer:
+    """
+    Start a stand-in server on the given port (any free one if 0) in a daemon
+    thread and return it.
+    """
+    server = StandinServer(("127.0.0.1", port), latency, failure_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5030)
+    parser.add_argument("--latency", type=float, default=0, help="seconds")
+    parser.add_argument(
+        "--failure-rate", type=float, default=0, help="fraction of 503 responses"
+    )
+    parser.add_argument("--archive", help="directory of an archive to serve from")
+    args = parser.parse_args()
+    server = StandinServer(("127.0.0.1", args.port), args.latency, args.failure_rate)
+    if args.archive:
+        sys.path.insert(0, str(pl.Path(__file__).resolve().parent.parent / "nzharold"))
+        import archive as ar
+
+        server.archive = ar.Archive(args.archive)
+    print(f"Serving stand-in NZ Herald at {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,231 @@
+"""
+Benchmark serving a cached story under Gunicorn: the current path, the Dash
+callback ``update_story``, which serialises the story view in Python per request,
+against the story JSON endpoint ``/story/<path>.json``, which sends the render
+files (see ``cache.EncodedFiles``) as they are, by ``sendfile``, in each content
+coding.
+
+Gunicorn serves this module's app, the app with a faked logged-in user, from one
+worker on a temporary story cache, while client processes request one cached
+story over keep-alive connections as fast as they can.
+Report the requests per second, the response size, and the worker's CPU time
+per request, read from ``/proc``.
+The clients compete with the worker for cores, so on a machine with few cores the
+CPU time per request is the telling number.
+
+Run this from the project root via ``uv run python benchmarks/story_files.py``.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing as mp
+import os
+import pathlib as pl
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp())
+
+import app as ap
+import index
+
+# The app that Gunicorn serves, with every session of user ID 0 logged in
+ap.login_manager.user_loader(lambda user_id: ap.User(id=0, username="benchmark"))
+application = index.server
+
+PORT = 5032
+STORY_PATH = "/nz/a-benchmark-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/"
+ENCODINGS = {"identity": "identity", "gzip": "gzip, deflate", "br": "gzip, br"}
+
+
+def store_story(n_elements: int) -> str:
+    """
+    Cache a parsed and rendered story of the given number of elements and return
+    its URL.
+    """
+    import rendering as rn
+    import standin
+    import stories as sto
+
+    url = f"https://www.nzherald.co.nz{STORY_PATH}"
+    story = sto.parse_story(standin.make_page(STORY_PATH, n_elements), url)
+    rendered = rn.render(story)
+    sto.cache_story(story, rendered)
+    return url
+
+
+def make_callback_body(url: str) -> bytes:
+    """
+    Return the body of the Dash request of the callback ``update_story`` for the
+    story at the given URL.
+    """
+    dependencies = index.server.test_client().get("/_dash-dependencies").get_json()
+    query_url = {"id": "query-url", "property": "value"}
+    dep = next(d for d in dependencies if d["inputs"][0] == query_url)
+    outputs = [o.rsplit(".", 1) for o in dep["output"].strip(".").split("...")]
+    payload = {
+        "output": dep["output"],
+        "outputs": [{"id": i, "property": p} for i, p in outputs],
+        "inputs": [dep["inputs"][0] | {"value": url}],
+        "changedPropIds": ["query-url.value"],
+        "state": [s | {"value": None} for s in dep["state"]],
+    }
+    return json.dumps(payload).encode()
+
+
+def make_session_cookie() -> str:
+    server = index.server
+    serializer = server.session_interface.get_signing_serializer(server)
+    session = serializer.dumps({"_user_id": "0", "_fresh": True})
+    return f"{server.config['SESSION_COOKIE_NAME']}={session}"
+
+
+def request_loop(method, path, body, headers, duration, results) -> None:
+    """
+    Make the given request over one keep-alive connection for the given seconds
+    and put the pair (number of requests, response size) on the results queue.
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", PORT)
+    n = size = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        conn.request(method, path, body=body, headers=headers)
+        r = conn.getresponse()
+        content = r.read()
+        assert r.status == 200, (r.status, content[:200])
+        size = len(content)
+        n += 1
+    conn.close()
+    results.put((n, size))
+
+
+def get_cpu_seconds(pids: list[int]) -> float:
+    """
+    Return the user plus system CPU seconds used so far by the given processes.
+    """
+    total = 0
+    for pid in pids:
+        fields = pl.Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def run(method, path, body, headers, n_clients: int, duration: float, pids) -> dict:
+    results = mp.Queue()
+    clients = [
+        mp.Process(
+            target=request_loop, args=(method, path, body, headers, duration, results)
+        )
+        for __ in range(n_clients)
+    ]
+    cpu = get_cpu_seconds(pids)
+    t = time.perf_counter()
+    for client in clients:
+        client.start()
+    counts = [results.get() for __ in clients]
+    elapsed = time.perf_counter() - t
+    cpu = get_cpu_seconds(pids) - cpu
+    for client in clients:
+        client.join()
+
+    n = sum(c for c, __ in counts)
+    return {
+        "requests/s": n / elapsed,
+        "response kB": counts[0][1] / 1000,
+        "worker CPU ms/request": 1000 * cpu / n,
+    }
+
+
+def main(n_clients: int, duration: float, n_elements: int) -> None:
+    import cache as ca
+
+    url = store_story(n_elements)
+    cookie = make_session_cookie()
+    paths = {
+        "Dash callback": (
+            "POST",
+            "/_dash-update-component",
+            make_callback_body(url),
+            {"Content-Type": "application/json"},
+        )
+    }
+    for encoding, accept in ENCODINGS.items():
+        if encoding == "br" and ca.get_brotli() is None:
+            print("Skipping br, since the brotli package isn't installed")
+            continue
+        headers = {"Accept-Encoding": accept}
+        path = f"/story{STORY_PATH[:-1]}.json"
+        paths[f"JSON file, {encoding}"] = ("GET", path, None, headers)
+
+    pidfile = pl.Path(os.environ["CACHE_DIR"]) / "gunicorn.pid"
+    gunicorn = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            str(ROOT / "nzharold" / "gunicorn_config.py"),
+            "--chdir",
+            str(ROOT / "nzharold"),
+            "--pythonpath",
+            str(ROOT / "benchmarks"),
+            "--bind",
+            f"127.0.0.1:{PORT}",
+            "--workers",
+            "1",
+            "--max-requests",
+            "0",
+            "--pid",
+            str(pidfile),
+            "story_files:application",
+        ],
+        env=os.environ | {"PARSE_MODE": "thread"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for __ in range(100):
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", PORT)
+                conn.request("GET", "/_internal/health")
+                health = json.loads(conn.getresponse().read())
+                break
+            except (OSError, ValueError):
+                time.sleep(0.2)
+        else:
+            raise RuntimeError("Gunicorn didn't start")
+        pids = [health["pid"]]
+
+        print(
+            f"A cached story of {n_elements} elements, {n_clients} clients, one "
+            f"Gunicorn worker, {os.cpu_count()} cores:"
+        )
+        results = {}
+        for name, (method, path, body, headers) in paths.items():
+            headers = headers | {"Cookie": cookie}
+            # Warm up, then measure
+            run(method, path, body, headers, 1, 0.5, pids)
+            results[name] = run(method, path, body, headers, n_clients, duration, pids)
+
+        keys = list(next(iter(results.values())))
+        print(f"  {'':<20}" + "".join(f"{k:>24}" for k in keys))
+        for name, result in results.items():
+            print(f"  {name:<20}" + "".join(f"{result[k]:>24.2f}" for k in keys))
+    finally:
+        gunicorn.terminate()
+        gunicorn.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per run")
+    parser.add_argument("--elements", type=int, default=120, help="elements per story")
+    args = parser.parse_args()
+    main(args.clients, args.duration, args.elements)
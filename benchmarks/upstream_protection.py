@@ -0,0 +1,144 @@
+"""
+Benchmark how one app worker copes with a slow or failing upstream, with and
+without the upstream protections: the cap on upstream fetches in flight per
+worker (``UPSTREAM_MAX_CONCURRENCY``) and the circuit breaker.
+
+A worker's 16 threads (4 Gunicorn workers of 4 threads share the load in
+production) serve a steady stream of requests, of which some view uncached
+stories, which need upstream, and the rest view a cached story.
+Upstream is the stand-in server of ``benchmarks/standin.py``, made slow or
+failing.
+Report the latency of the cached views, including time queued for a thread,
+and the outcomes of the uncached ones.
+
+Run this from the project root via
+``uv run python benchmarks/upstream_protection.py``.
+"""
+
+import argparse
+import collections
+import concurrent.futures as cf
+import itertools as it
+import os
+import pathlib as pl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp()
+os.environ["FETCH_BURST_PER_IP"] = "1000000"
+os.environ["UPSTREAM_RATE_LIMIT"] = "1000"
+os.environ["UPSTREAM_TIMEOUT"] = "10"
+
+import standin
+
+server = standin.start()
+os.environ["UPSTREAM_BASE_URL"] = server.base_url
+
+import index
+import settings as st
+import stories as sto
+from pages import main as mp
+
+CACHED_URL = "https://www.nzherald.co.nz/nz/a-cached-story/"
+SCENARIOS = {
+    "slow upstream (4 s)": {"latency": 4, "failure_rate": 0},
+    "failing upstream (503s)": {"latency": 0.05, "failure_rate": 1},
+}
+
+
+def view(url: str) -> str:
+    """
+    View the story at the given URL as a request would and return the outcome.
+    """
+    with index.server.test_request_context():
+        props, story = mp.get_story_view(url)
+    if story is not None:
+        return "story"
+    message = props["story-content"]["children"].children
+    return "turned away" if "slow to respond" in message else "failed"
+
+
+def run(protected: bool, rate: float, duration: float, story_share: float) -> dict:
+    if protected:
+        n_slots = st.config.UPSTREAM_MAX_CONCURRENCY
+        sto._fetch_slots = threading.BoundedSemaphore(n_slots)
+        sto.breakers.clear()
+        sto.breakers.default_factory = lambda: sto.CircuitBreaker(
+            failure_rate=st.config.UPSTREAM_FAILURE_RATE,
+            slow_call=st.config.UPSTREAM_SLOW_CALL,
+            cooldown=st.config.UPSTREAM_COOLDOWN,
+        )
+    else:
+        sto._fetch_slots = threading.BoundedSemaphore(1_000_000)
+        sto.breakers.clear()
+        sto.breakers.default_factory = lambda: sto.CircuitBreaker(failure_rate=2)
+
+    cached_times = []
+    outcomes = collections.Counter()
+    # Unique story URLs, so that no run finds the stories of another in the cache
+    urls = (f"https://www.nzherald.co.nz/nz/{uuid.uuid4().hex}/" for __ in it.count())
+
+    def request(arrival: float, uncached: bool):
+        if uncached:
+            outcomes[view(next(urls))] += 1
+        else:
+            view(CACHED_URL)
+            cached_times.append(time.perf_counter() - arrival)
+
+    n_requests = int(rate * duration)
+    n_stories = int(story_share * n_requests)
+    with cf.ThreadPoolExecutor(16) as worker:
+        start = time.perf_counter()
+        for i in range(n_requests):
+            arrival = start + i / rate
+            time.sleep(max(0, arrival - time.perf_counter()))
+            # Spread the story views evenly over the requests
+            uncached = i * n_stories // n_requests < (i + 1) * n_stories // n_requests
+            worker.submit(request, arrival, uncached)
+
+    cached_times.sort()
+    return {
+        "cached p50 ms": 1000 * statistics.median(cached_times),
+        "cached p99 ms": 1000 * cached_times[int(0.99 * len(cached_times))],
+        **{f"uncached {k}": outcomes[k] for k in ["story", "turned away", "failed"]},
+    }
+
+
+def main(rate: float, duration: float, story_share: float) -> None:
+    page = standin.make_page("/nz/a-cached-story/")
+    sto.store_story(sto.parse_story(page, CACHED_URL))
+    print(
+        f"{rate:.0f} requests per second for {duration:.0f} s, {story_share:.0%} of "
+        "them for uncached stories, on one worker of 16 threads:"
+    )
+    for name, behaviour in SCENARIOS.items():
+        server.latency = behaviour["latency"]
+        server.failure_rate = behaviour["failure_rate"]
+        results = {
+            "unprotected": run(False, rate, duration, story_share),
+            "protected": run(True, rate, duration, story_share),
+        }
+        print(f"  {name}")
+        print(f"    {'':<24}" + "".join(f"{k:>14}" for k in results))
+        for key in results["protected"]:
+            print(
+                f"    {key:<24}" + "".join(f"{r[key]:>14.0f}" for r in results.values())
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=20, help="requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--story-share", type=float, default=0.3, help="share of uncached story views"
+    )
+    args = parser.parse_args()
+    main(args.rate, args.duration, args.story_share)
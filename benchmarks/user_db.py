@@ -0,0 +1,203 @@
+"""
+Benchmark user lookups, as on login and on every request, by 4 Gunicorn-like
+worker processes of 4 threads each, while another process writes users in bulk,
+as the command line interface does.
+Compare the default SQLite setup (rollback journal, default pragmas and pool) with
+the ``SQLITE_PRAGMAS`` and ``SQLALCHEMY_ENGINE_OPTIONS`` settings.
+Password hashing is left out, since it costs the same either way.
+
+Also show the query plans of the user lookups, to check that they use indexes.
+
+Run this from the project root via ``uv run python benchmarks/user_db.py``.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import pathlib as pl
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "nzharold"))
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import sqlalchemy as sa
+
+import settings as st
+
+st.config.SQLALCHEMY_DATABASE_URI = (
+    f"sqlite:///{pl.Path(tempfile.mkdtemp()) / 'users.sqlite'}"
+)
+
+import user_management as um
+
+LOOKUPS = {
+    "by ID": "SELECT * FROM user WHERE id = :value",
+    "by username": "SELECT * FROM user WHERE username = :value",
+    "by email": "SELECT * FROM user WHERE email = :value",
+}
+
+
+def make_user(username: str) -> dict:
+    return {"username": username, "email": f"{username}@example.com", "password": "x"}
+
+
+def make_engine(tuned: bool) -> sa.engine.Engine:
+    if tuned:
+        return sa.create_engine(
+            st.config.SQLALCHEMY_DATABASE_URI, **st.config.SQLALCHEMY_ENGINE_OPTIONS
+        )
+    return sa.create_engine(st.config.SQLALCHEMY_DATABASE_URI)
+
+
+def setup_database(tuned: bool, n_users: int) -> None:
+    """
+    Create a database of the given number of users in the rollback journal mode
+    or, if tuned, in the write-ahead logging mode.
+    """
+    path = pl.Path(st.config.SQLALCHEMY_DATABASE_URI.removeprefix("sqlite:///"))
+    for p in path.parent.glob(f"{path.name}*"):
+        p.unlink()
+
+    engine = make_engine(tuned)
+    um.User.metadata.create_all(engine)
+    with engine.begin() as conn:
+        if not tuned:
+            conn.exec_driver_sql("PRAGMA journal_mode = delete")
+        conn.execute(
+            um.user_table.insert(),
+            [make_user(f"user{i}") for i in range(n_users)],
+        )
+    engine.dispose()
+
+
+def read(tuned: bool, n_threads: int, n_users: int, duration: float, queue) -> None:
+    """
+    Look up random users by username then by ID, as a login then a request do, in
+    the given number of threads for the given number of seconds, and put the
+    pair (list of lookup times in seconds, number of errors) on the given queue.
+    """
+    engine = make_engine(tuned)
+    times = []
+    errors = []
+    stop = time.perf_counter() + duration
+
+    def run():
+        while time.perf_counter() < stop:
+            i = random.randrange(n_users)
+            t = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(sa.text(LOOKUPS["by username"]), {"value": f"user{i}"})
+                    conn.execute(sa.text(LOOKUPS["by ID"]), {"value": i + 1})
+            except sa.exc.OperationalError:
+                errors.append(1)
+            else:
+                times.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=run) for __ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.put((times, len(errors)))
+
+
+def write(tuned: bool, batch_size: int, duration: float, queue) -> None:
+    """
+    Insert users in transactions of the given size for the given number of seconds
+    and put the pair (number of users written, number of errors) on the given
+    queue.
+    """
+    engine = make_engine(tuned)
+    n = 0
+    n_errors = 0
+    stop = time.perf_counter() + duration
+    while time.perf_counter() < stop:
+        rows = [make_user(f"new{n + j}") for j in range(batch_size)]
+        try:
+            with engine.begin() as conn:
+                conn.execute(um.user_table.insert(), rows)
+        except sa.exc.OperationalError:
+            n_errors += 1
+        else:
+            n += batch_size
+    queue.put((n, n_errors))
+
+
+def run(tuned: bool, n_users: int, duration: float, batch_size: int) -> dict:
+    if tuned:
+        if not sa.event.contains(sa.engine.Engine, "connect", um.set_sqlite_pragmas):
+            sa.event.listen(sa.engine.Engine, "connect", um.set_sqlite_pragmas)
+    else:
+        sa.event.remove(sa.engine.Engine, "connect", um.set_sqlite_pragmas)
+    setup_database(tuned, n_users)
+
+    ctx = mp.get_context("fork")
+    read_queue = ctx.Queue()
+    write_queue = ctx.Queue()
+    readers = [
+        ctx.Process(target=read, args=(tuned, 4, n_users, duration, read_queue))
+        for __ in range(4)
+    ]
+    writer = ctx.Process(target=write, args=(tuned, batch_size, duration, write_queue))
+    for p in readers + [writer]:
+        p.start()
+
+    times = []
+    n_read_errors = 0
+    for __ in readers:
+        t, e = read_queue.get()
+        times += t
+        n_read_errors += e
+    n_written, n_write_errors = write_queue.get()
+    for p in readers + [writer]:
+        p.join()
+
+    times.sort()
+    return {
+        "logins/s": len(times) / duration,
+        "p50 ms": 1000 * statistics.median(times) if times else float("nan"),
+        "p99 ms": 1000 * times[int(0.99 * len(times))] if times else float("nan"),
+        "max ms": 1000 * times[-1] if times else float("nan"),
+        "failed logins": n_read_errors,
+        "users written/s": n_written / duration,
+        "failed writes": n_write_errors,
+    }
+
+
+def main(n_users: int, duration: float, batch_size: int) -> None:
+    results = {
+        "default": run(False, n_users, duration, batch_size),
+        "tuned": run(True, n_users, duration, batch_size),
+    }
+    print(
+        f"User lookups by 4 processes x 4 threads for {duration:.0f} s during bulk "
+        f"writes of {batch_size} users per transaction:"
+    )
+    print(f"  {'':<16}" + "".join(f"{name:>12}" for name in results))
+    for key in results["default"]:
+        print(f"  {key:<16}" + "".join(f"{r[key]:>12.1f}" for r in results.values()))
+
+    print("Query plans of the user lookups:")
+    engine = make_engine(True)
+    with engine.connect() as conn:
+        for name, query in LOOKUPS.items():
+            plan = conn.execute(sa.text(f"EXPLAIN QUERY PLAN {query}"), {"value": 1})
+            print(f"  {name:<12} {'; '.join(row[-1] for row in plan)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=10_000, help="number of users")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per run")
+    parser.add_argument(
+        "--batch-size", type=int, default=100, help="users written per transaction"
+    )
+    args = parser.parse_args()
+    main(args.users, args.duration, args.batch_size)
@@ -5,8 +5,11 @@ Throughout the docstrings "locally" and "remotely" abbreviate "on your local mac
 and "on the web server", respectively.
 """
 
+import concurrent.futures as cf
+import json
 import os
 import pathlib as pl
+import time
 import uuid
 import re
 import shlex
@@ -215,6 +218,175 @@ def init_local_env(ctx):
     update_local_port(ctx)
 
 
+def get_local_pidfile(port: int) -> pl.Path:
+    """
+    Return the path of the pidfile of the local Gunicorn instance on the given port
+    started by :func:`run_local_cluster`, which is in the instance's cache folder.
+    """
+    return ROOT / "cache" / f"node_{port}" / "gunicorn.pid"
+
+
+@fr.task
+def run_local_cluster(ctx, ports: str = "5021,5022,5023"):
+    """
+    Locally, run one Gunicorn instance of the app on each of the given
+    comma-separated ports, each with its own cache folder and all sharing one
+    multi-node story cache, to test cache sharding.
+    Stop an instance to see its keys move to the other instances, or reload them
+    via ``fab reload-local-cluster``.
+
+    To run this from the command line, do
+    ``fab run-local-cluster --ports 5021,5022,5023``.
+    """
+    ports = [int(p) for p in ports.split(",")]
+    nodes = [f"http://127.0.0.1:{p}" for p in ports]
+    token = uuid.uuid4().hex
+    print("-" * 10, f"Running app instances at {', '.join(nodes)}...")
+    promises = []
+    with ctx.cd(ROOT / PROJECT):
+        for port, node in zip(ports, nodes):
+            pidfile = get_local_pidfile(port)
+            pidfile.parent.mkdir(parents=True, exist_ok=True)
+            env = {
+                "CACHE_NODE": node,
+                "CACHE_PEERS": ",".join(nodes),
+                "CACHE_PEER_TOKEN": token,
+                "CACHE_DIR": str(pidfile.parent),
+                "GUNICORN_PIDFILE": str(pidfile),
+            }
+            promises.append(
+                ctx.run(
+                    f"uv run gunicorn -c gunicorn_config.py -b 127.0.0.1:{port} "
+                    "wsgi:application",
+                    env=env,
+                    asynchronous=True,
+                )
+            )
+    for promise in promises:
+        promise.join()
+
+
+def reload_gracefully(
+    c,
+    pidfile: pl.Path | str,
+    port: int,
+    warm: bool = True,
+    timeout: float = 60,
+    use_sudo: bool = False,
+) -> bool:
+    """
+    Over the given connection, local or remote, reload the Gunicorn instance of the
+    app with the given pidfile and local port without dropping a request, and
+    return ``True`` if the reload succeeded.
+    Do so as follows.
+
+    1. If ``warm``, fetch the most recently read stories that aren't freshly cached
+       via a request to ``/_internal/warm``.
+    2. Send the master USR2, so that it starts a new master with the new code, which
+       loads the most recently read stories into memory and forks new workers on the
+       same sockets.
+       HUP wouldn't do, since it forks the new workers from the app that the master
+       preloaded, which is the old code.
+    3. Wait for a worker of the new master to answer ``/_internal/health``.
+    4. Send the old master TERM, so that its workers finish their requests in flight
+       and exit, leaving the new master to serve.
+
+    If no worker of the new master answers within ``timeout`` seconds, then stop the
+    new master instead, leaving the old one serving, and return ``False``.
+    Use sudo to send the signals if ``use_sudo``.
+    """
+    base_url = f"http://127.0.0.1:{port}"
+
+    def signal(pid: int, name: str):
+        command = f"kill -{name} {pid}"
+        if use_sudo:
+            return sudo(c, command, hide=True, warn=True)
+        return c.run(command, hide=True, warn=True)
+
+    def read_pid(path) -> int | None:
+        result = c.run(f"cat {path}", hide=True, warn=True)
+        return int(result.stdout) if result.ok and result.stdout.strip() else None
+
+    def get_master() -> int | None:
+        result = c.run(
+            f"curl -sf --max-time 5 {base_url}/_internal/health", hide=True, warn=True
+        )
+        return json.loads(result.stdout)["master"] if result.ok else None
+
+    old_pid = read_pid(pidfile)
+    if old_pid is None:
+        print(f"No Gunicorn master process ID in {pidfile}")
+        return False
+
+    if warm:
+        result = c.run(
+            f"curl -sf -X POST --max-time {timeout} {base_url}/_internal/warm",
+            hide=True,
+            warn=True,
+        )
+        print(f"Warmed the cache at {base_url}: {result.stdout.strip() or 'failed'}")
+
+    signal(old_pid, "USR2")
+    deadline = time.monotonic() + timeout
+    new_pid = None
+    # The old and new workers share the sockets, so poll until a new one answers
+    while time.monotonic() < deadline:
+        new_pid = new_pid or read_pid(f"{pidfile}.2")
+        if new_pid is not None and get_master() == new_pid:
+            break
+        time.sleep(0.5)
+    else:
+        print(f"The new Gunicorn master at {base_url} isn't healthy; rolling back")
+        # A new master that is still starting writes its pidfile soon; one that
+        # failed to start has exited already
+        deadline = time.monotonic() + timeout
+        while new_pid is None and time.monotonic() < deadline:
+            time.sleep(0.5)
+            new_pid = read_pid(f"{pidfile}.2")
+        if new_pid is not None:
+            signal(new_pid, "TERM")
+        return False
+
+    signal(old_pid, "TERM")
+    # The new master takes over the pidfile once the old one has exited
+    deadline = time.monotonic() + timeout
+    while read_pid(pidfile) != new_pid:
+        if time.monotonic() > deadline:
+            print(f"The old Gunicorn master {old_pid} at {base_url} hasn't exited")
+            return False
+        time.sleep(0.5)
+
+    print(f"Reloaded Gunicorn at {base_url}: master {old_pid} -> {new_pid}")
+    return True
+
+
+@fr.task
+def reload_local_cluster(
+    ctx, ports: str = "5021,5022,5023", warm: bool = True, timeout: float = 60
+):
+    """
+    Locally, gracefully reload the Gunicorn instances started by
+    :func:`run_local_cluster` on the given comma-separated ports, all at once, as
+    :func:`reload_gunicorn` does on the web server.
+    Load test the instances meanwhile to check that no request fails.
+
+    To run this from the command line, do
+    ``fab reload-local-cluster --ports 5021,5022,5023``.
+    """
+    ports = [int(p) for p in ports.split(",")]
+    print("-" * 10, f"Reloading the app instances on ports {ports}...")
+    with cf.ThreadPoolExecutor(len(ports)) as executor:
+        results = executor.map(
+            lambda port: reload_gracefully(
+                ctx, get_local_pidfile(port), port, warm=warm, timeout=timeout
+            ),
+            ports,
+        )
+        failed = [port for port, ok in zip(ports, results) if not ok]
+    if failed:
+        raise RuntimeError(f"Reloading failed on ports {failed}")
+
+
 @fr.task
 def init_project_folder(ctx):
     """
@@ -286,9 +458,9 @@ def delete_project_folder(ctx):
 
 
 @fr.task
-def rsync_push(ctx):
+def rsync_push(ctx, host: str = HOST):
     """
-    Push files in local Git branch 'master' to remote 'production'
+    Push files in local Git branch 'master' to the given host (defaults to HOST)
     using Rsync and ignoring all Git-ignored and Git-related files.
     If Git LFS is detected (if '.gitattributes' file is presest), download LFS
     files from remote 'origin' before pushing.
@@ -302,7 +474,7 @@ def rsync_push(ctx):
             ctx.run("git lfs pull")
 
     with ctx.cd(ROOT):
-        rsync_cmd = f"rsync -av --delete --exclude-from='.gitignore' --exclude='.git*' --exclude='.pre-commit*' {ROOT} {HOST}:{REMOTE_DIR}"
+        rsync_cmd = f"rsync -av --delete --exclude-from='.gitignore' --exclude='.git*' --exclude='.pre-commit*' {ROOT} {host}:{REMOTE_DIR}"
         ctx.run(rsync_cmd)
 
 
@@ -430,6 +602,24 @@ def add_apache_bot_blocking(ctx):
                     sudo(c, "service apache2 restart")
 
 
+@fr.task
+def update_bot_user_agents(ctx):
+    """
+    Locally, update the list of AI bot user agents that the app refuses (see
+    ``guard.py``) from https://github.com/ai-robots-txt.
+    Commit the list to deploy it.
+    """
+    import httpx
+
+    r = httpx.get(
+        "https://raw.githubusercontent.com/ai-robots-txt/ai.robots.txt/refs/heads/main/robots.json"
+    )
+    r.raise_for_status()
+    path = ROOT / "data" / "bot_user_agents.txt"
+    path.write_text("\n".join(r.json()) + "\n", encoding="utf-8")
+    print(f"Wrote {len(r.json())} bot user agents to {path}")
+
+
 def delete_apache(ctx):
     """
     Remotely, disable and delete the Apache setup for the app on its domain.
@@ -449,6 +639,22 @@ def delete_apache(ctx):
                 sudo(c, "service apache2 restart")
 
 
+def set_notify_service_type(service: str) -> str:
+    """
+    Set the type of the text of a systemd service file to "notify", accepting
+    notifications from all the service's processes, so that Gunicorn can tell
+    systemd which master to follow on a graceful reload (see :func:`reload_gunicorn`).
+    """
+    service = re.sub(r"^(Type|NotifyAccess)=.*\n", "", service, flags=re.MULTILINE)
+    return re.sub(
+        r"^\[Service\]\n",
+        "[Service]\nType=notify\nNotifyAccess=all\n",
+        service,
+        count=1,
+        flags=re.MULTILINE,
+    )
+
+
 @fr.task
 def init_gunicorn(ctx):
     """
@@ -458,6 +664,8 @@ def init_gunicorn(ctx):
     # Make the Gunicorn conf file locally, then copy it to the server
     filename = f"dash.{PROJECT}.service"
     su.make_gunicorn_service("uv", PROJECT, out_path=ROOT / filename)
+    path = ROOT / filename
+    path.write_text(set_notify_service_type(path.read_text()))
     with fr.Connection(HOST, config=CONFIG) as c:
         gunicorn_dir = pl.Path("/etc/systemd/system/")
         path = gunicorn_dir / filename
@@ -529,22 +737,75 @@ def init_user_db(ctx):
 
 
 @fr.task
-def update_virtualenv(ctx):
+def update_virtualenv(ctx, host: str = HOST):
     print("-" * 10, "Updating virtualenv...")
-    with fr.Connection(HOST, config=CONFIG) as c:
+    with fr.Connection(host, config=CONFIG) as c:
         with c.cd(REMOTE_DIR / PROJECT):
             c.run("bash -ic 'uv sync --no-dev --frozen'")
 
 
 @fr.task
-def restart_gunicorn(ctx):
+def build_static(ctx, host: str = HOST):
+    """
+    Remotely, build the app's fingerprinted and compressed static assets from the
+    vendored files pushed (see ``static_assets.py``), before the new app starts,
+    since the app links the build that it finds when it starts.
+    Vendor the files that weren't pushed first, and fail if that fails.
+    """
+    print("-" * 10, "Building static assets...")
+    with fr.Connection(host, config=CONFIG) as c:
+        with c.cd(REMOTE_DIR / PROJECT):
+            c.run(
+                f"bash -ic 'uv run python {PROJECT}/static_assets.py build "
+                "--vendor-missing --require-vendored'"
+            )
+
+
+@fr.task
+def restart_gunicorn(ctx, host: str = HOST):
     print("-" * 10, "Restarting Gunicorn service...")
     filename = f"dash.{PROJECT}.service"
-    with fr.Connection(HOST, config=CONFIG) as c:
+    with fr.Connection(host, config=CONFIG) as c:
         sudo(c, f"/usr/bin/systemctl restart {filename}")
         sudo(c, f"/usr/bin/systemctl status {filename}")
 
 
+@fr.task
+def reload_gunicorn(ctx, host: str = HOST, warm: bool = True) -> bool:
+    """
+    Remotely, reload the Gunicorn service of the app on the given host (defaults to
+    HOST) without dropping requests in flight or starting workers with empty
+    memory caches, as :func:`reload_gracefully` describes, and return ``True`` if
+    the reload succeeded.
+    If the service isn't of type "notify", which reloads take (see ``on_exit`` in
+    ``gunicorn_config.py``), then restart it instead; recreate the service via
+    ``fab delete-gunicorn init-gunicorn`` to fix that.
+
+    To run this from the command line, do ``fab reload-gunicorn`` or, to skip the
+    cache warming, ``fab reload-gunicorn --no-warm``.
+    """
+    print("-" * 10, f"Reloading Gunicorn service on {host}...")
+    filename = f"dash.{PROJECT}.service"
+    with fr.Connection(host, config=CONFIG) as c:
+        service_type = c.run(
+            f"systemctl show -p Type --value {filename}", hide=True
+        ).stdout.strip()
+        if service_type != "notify":
+            print(f"The service is of type {service_type!r}, so restarting it instead")
+            restart_gunicorn(ctx, host=host)
+            return True
+
+        ok = reload_gracefully(
+            c,
+            REMOTE_DIR / PROJECT / "gunicorn.pid",
+            get_local_port(ctx),
+            warm=warm,
+            use_sudo=True,
+        )
+        sudo(c, f"/usr/bin/systemctl status {filename}")
+    return ok
+
+
 @fr.task
 def deploy_app(ctx):
     """
@@ -559,6 +820,7 @@ def deploy_app(ctx):
     rsync_push(ctx)
     init_dotenv(ctx)
     init_virtualenv(ctx)
+    build_static(ctx)
     init_user_db(ctx)
     init_apache(ctx)
     add_apache_bot_blocking(ctx)
@@ -567,16 +829,68 @@ def deploy_app(ctx):
 
 
 @fr.task
-def update_app(ctx):
+def update_app(ctx, warm: bool = True, restart: bool = False):
     """
     Update the app after you've made a new release.
     This entails locally pushing the master branch to 'production',
-    remotely Poetry installing the main dependencies, and remotely restarting Gunicorn.
+    remotely Poetry installing the main dependencies, building the static assets,
+    and remotely reloading Gunicorn gracefully (:func:`reload_gunicorn`), warming
+    the cache first if ``warm``.
+    If ``restart``, then restart Gunicorn instead, which drops the requests in
+    flight; do so only if a reload fails.
+
+    To run this from the command line, do ``fab update-app``, or
+    ``fab update-app --no-warm`` to skip the cache warming, or
+    ``fab update-app --restart``.
     """
     print("-" * 10, "Updating app...")
     rsync_push(ctx)
     update_virtualenv(ctx)
-    restart_gunicorn(ctx)
+    build_static(ctx)
+    if restart:
+        restart_gunicorn(ctx)
+    elif not reload_gunicorn(ctx, warm=warm):
+        raise RuntimeError(
+            "Reloading Gunicorn failed, so the old app is still serving; "
+            "fix the new app, or restart Gunicorn via 'fab update-app --restart'"
+        )
+
+
+@fr.task
+def update_app_on_hosts(
+    ctx, hosts: str = HOST, parallel: int = 2, warm: bool = True
+) -> None:
+    """
+    Update the app on each of the given comma-separated hosts as :func:`update_app`
+    does, but reloading Gunicorn gracefully (:func:`reload_gunicorn`), and on at most
+    ``parallel`` hosts at a time, so that the other hosts keep serving.
+    A host whose new Gunicorn master isn't healthy keeps its old one.
+
+    To run this from the command line, do
+    ``fab update-app-on-hosts --hosts user@host1,user@host2 --parallel 2``.
+    """
+    hosts = hosts.split(",")
+    print("-" * 10, f"Updating app on {', '.join(hosts)}...")
+
+    def update(host: str) -> bool:
+        rsync_push(ctx, host=host)
+        update_virtualenv(ctx, host=host)
+        build_static(ctx, host=host)
+        return reload_gunicorn(ctx, host=host, warm=warm)
+
+    with cf.ThreadPoolExecutor(parallel) as executor:
+        futures = {host: executor.submit(update, host) for host in hosts}
+    failed = []
+    for host, future in futures.items():
+        try:
+            ok = future.result()
+        except Exception as e:
+            print(f"Updating {host} failed: {e}")
+            ok = False
+        if not ok:
+            failed.append(host)
+    if failed:
+        raise RuntimeError(f"Updating failed on {', '.join(failed)}")
 
 
 @fr.task
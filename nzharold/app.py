@@ -1,32 +1,19 @@
-import dash_bootstrap_components as dbc
 import flask_login as fl
 from dash_extensions import enrich as dee
 
+import cache as ca
+import guard as gu
+import memory as mem
+import metrics as mt
 import settings as st
+import static_assets as sa
 import user_management as um
 
 # --------------
 # Configuration
 # --------------
-# fs = dee.FileSystemStore(cache_dir=st.config.CACHE_DIR)
-app = dee.DashProxy(
-    __name__,
-    # transforms=[
-    #     dee.ServersideOutputTransform(backend=fs),
-    # ],
-    suppress_callback_exceptions=True,
-    external_stylesheets=[
-        dbc.themes.BOOTSTRAP,
-        dbc.icons.BOOTSTRAP,
-    ],
-    meta_tags=[{"name": "viewport", "content": "width=device-width"}],
-)
-app.server.config.from_object(st.config)
-server = app.server
-
 # Add 'lang' attribute to html tag
-
-app.index_string = """
+INDEX_STRING = """
 <!DOCTYPE html>
 <html lang='en-NZ' role='main'>
     <head>
@@ -46,13 +33,8 @@ app.index_string = """
 </html>
 """
 
-
-# Connect the database
-um.db.init_app(server)
-
 # Set up the login manager
 login_manager = fl.LoginManager()
-login_manager.init_app(server)
 login_manager.login_view = "/login"
 
 
@@ -65,4 +47,75 @@ def load_user(user_id):
     """
     Callback to reload the user object
     """
-    return User.query.get(int(user_id))
+    return um.db.session.get(User, int(user_id))
+
+
+class App(dee.DashProxy):
+    """
+    The Dash app, whose pages link the built static assets, if any (see
+    ``static_assets.py``), and leave out the scripts of component libraries that
+    the app doesn't use.
+    """
+
+    def interpolate_index(self, **kwargs) -> str:
+        kwargs["scripts"] = sa.trim_scripts(kwargs["scripts"])
+        favicon = sa.get_favicon_html()
+        if favicon is not None:
+            kwargs["favicon"] = favicon
+        return super().interpolate_index(**kwargs)
+
+
+def create_app() -> App:
+    """
+    Create the Dash app and set up its Flask server: connect the user database,
+    the login manager, the story cache, the request guards, the static assets, and
+    the metrics publisher.
+    The pages then register their callbacks on the app and ``index.py`` sets its
+    layout.
+
+    Creating the app neither opens connections nor starts threads, so that a
+    preloading Gunicorn master can create it and fork workers from it.
+    """
+    app = App(
+        __name__,
+        # Keep the stories being read on the server; see cache.StoryStore
+        transforms=[
+            dee.ServersideOutputTransform(backends=[ca.story_store]),
+        ],
+        suppress_callback_exceptions=True,
+        # Link the built assets if there is a build, or else link Bootstrap on its
+        # CDN and let Dash link the assets
+        external_stylesheets=sa.get_stylesheets(),
+        external_scripts=sa.get_scripts(),
+        include_assets_files=sa.get_manifest() is None,
+        meta_tags=[{"name": "viewport", "content": "width=device-width"}],
+    )
+    app.server.config.from_object(st.config)
+    app.index_string = INDEX_STRING
+
+    # Connect the database
+    um.db.init_app(app.server)
+
+    # Set up the login manager
+    login_manager.init_app(app.server)
+
+    # Register the internal endpoint of the story cache
+    ca.init_app(app.server)
+
+    # Refuse bots
+    gu.init_app(app.server)
+
+    # Register the memory diagnostics endpoint
+    mem.init_app(app.server)
+
+    # Serve the built static assets
+    sa.init_app(app.server)
+
+    # Publish the runtime metrics of the admin dashboard
+    mt.init_app(app.server)
+
+    return app
+
+
+app = create_app()
+server = app.server
@@ -0,0 +1,370 @@
+"""
+A rolling archive of upstream fetches in WARC files, by which to reproduce broken
+parses, serve stories when upstream is down, and stand in for upstream in
+benchmarks.
+"""
+
+import datetime as dt
+import gzip
+import os
+import pathlib as pl
+import queue
+import threading
+import time
+import traceback
+import urllib.parse as up
+import uuid
+import zlib
+
+import click
+from loguru import logger
+
+import helpers as hp
+import settings as st
+
+# Response headers that describe the transfer rather than the body, which is
+# archived decoded
+DROPPED_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+
+
+def make_record(warc_type: str, url: str, block: bytes, **fields) -> bytes:
+    """
+    Return the WARC record of the given type for the given target URL and block,
+    with the given extra header fields, compressed as one gzip member.
+    Field names get their underscores replaced by hyphens.
+    """
+    headers = {
+        "WARC-Type": warc_type,
+        "WARC-Record-ID": f"<urn:uuid:{uuid.uuid4()}>",
+        "WARC-Date": dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "WARC-Target-URI": url,
+        "Content-Type": f"application/http; msgtype={warc_type}",
+    }
+    headers |= {name.replace("_", "-"): value for name, value in fields.items()}
+    headers["Content-Length"] = len(block)
+    head = "WARC/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    return gzip.compress(head.encode("utf-8") + b"\r\n" + block + b"\r\n\r\n")
+
+
+def parse_head(head: bytes) -> tuple[str, dict[str, str]]:
+    """
+    Return the pair (first line, header fields) of the given head of a WARC record
+    or HTTP message, with lowercase field names.
+    """
+    first, *lines = head.decode("utf-8", errors="replace").split("\r\n")
+    fields = {}
+    for line in lines:
+        name, __, value = line.partition(":")
+        fields[name.strip().lower()] = value.strip()
+    return first, fields
+
+
+def read_members(data: bytes, start: int = 0):
+    """
+    Iterate over the (offset, decompressed member, end offset) triples of the
+    complete gzip members in the given data from the given offset on.
+    """
+    pos = start
+    while pos < len(data):
+        d = zlib.decompressobj(wbits=31)
+        try:
+            member = d.decompress(data[pos:])
+        except zlib.error:
+            return
+        if not d.eof:
+            # A member still being written
+            return
+        end = len(data) - len(d.unused_data)
+        yield pos, member, end
+        pos = end
+
+
+def split_record(member: bytes) -> tuple[dict[str, str], bytes]:
+    """
+    Return the pair (WARC header fields, block) of the given decompressed record.
+    """
+    head, __, rest = member.partition(b"\r\n\r\n")
+    __, fields = parse_head(head)
+    return fields, rest[: int(fields.get("content-length", len(rest)))]
+
+
+class Archive:
+    """
+    A directory of WARC files of upstream fetches, to which this process appends
+    files of at most about ``file_bytes`` bytes, deleting the oldest files once the
+    directory exceeds ``max_bytes``.
+    Lookups go through an index of the latest response per URL, which is extended
+    with the records written since on a miss.
+    """
+
+    def __init__(
+        self,
+        directory: pl.Path | str,
+        file_bytes: int = 64 * 2**20,
+        max_bytes: int = 2 * 2**30,
+    ):
+        self.directory = pl.Path(directory)
+        self.file_bytes = file_bytes
+        self.max_bytes = max_bytes
+        self._path = None
+        self._index = {}
+        self._scanned = {}
+        self._lock = threading.Lock()
+
+    def paths(self) -> list[pl.Path]:
+        """
+        Return the paths of the archive's files from oldest to newest.
+        """
+        return sorted(self.directory.glob("*.warc.gz"), key=lambda p: p.name)
+
+    def write(self, url: str, request_headers: dict, response, fetch_time: float):
+        """
+        Append the request and response records of a fetch of the given URL, made
+        with the given request headers, which got the given Requests response in
+        the given seconds.
+        """
+        parts = up.urlsplit(url)
+        request = f"GET {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+        request += "".join(f"{k}: {v}\r\n" for k, v in request_headers.items())
+        headers = {
+            k: v for k, v in response.headers.items() if k.lower() not in DROPPED_HEADERS
+        }
+        headers["Content-Length"] = len(response.content)
+        head = f"HTTP/1.1 {response.status_code} {response.reason}\r\n" + "".join(
+            f"{k}: {v}\r\n" for k, v in headers.items()
+        )
+        record_id = f"<urn:uuid:{uuid.uuid4()}>"
+        response_record = make_record(
+            "response",
+            url,
+            head.encode("latin-1") + b"\r\n" + response.content,
+            WARC_Record_ID=record_id,
+            WARC_Fetch_Time=f"{fetch_time:.4f}",
+        )
+        request_record = make_record(
+            "request",
+            url,
+            request.encode("latin-1") + b"\r\n",
+            WARC_Concurrent_To=record_id,
+        )
+
+        try:
+            full = self._path.stat().st_size >= self.file_bytes
+        except (AttributeError, FileNotFoundError):
+            full = True
+        if full:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d%H%M%S")
+            self._path = self.directory / f"upstream-{stamp}-{os.getpid()}.warc.gz"
+            self.prune()
+        # One write per fetch, so that readers see whole records or none
+        with self._path.open("ab") as tgt:
+            tgt.write(request_record + response_record)
+
+    def prune(self) -> int:
+        """
+        Delete the oldest files while the archive exceeds ``max_bytes``, but never
+        the file being written, and return the number of files deleted.
+        """
+        files = [(p, p.stat().st_size) for p in self.paths() if p != self._path]
+        total = sum(size for __, size in files)
+        if self._path is not None and self._path.exists():
+            total += self._path.stat().st_size
+        n = 0
+        for path, size in files:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            n += 1
+        return n
+
+    def iter_records(self, path: pl.Path, start: int = 0):
+        """
+        Iterate over the (offset, WARC header fields, block, end offset) tuples of
+        the complete records in the given file from the given offset on.
+        """
+        try:
+            with path.open("rb") as src:
+                src.seek(start)
+                data = src.read()
+        except FileNotFoundError:
+            return
+        for offset, member, end in read_members(data):
+            fields, block = split_record(member)
+            yield start + offset, fields, block, start + end
+
+    def _scan(self) -> None:
+        """
+        Add the responses written since the last scan to the index.
+        """
+        for path in self.paths():
+            start = self._scanned.get(path, 0)
+            for offset, fields, __, end in self.iter_records(path, start):
+                if fields.get("warc-type") == "response":
+                    self._index[fields["warc-target-uri"]] = (path, offset)
+                self._scanned[path] = end
+
+    def find(self, url: str) -> dict | None:
+        """
+        Return the latest archived response for the given URL as a dictionary with
+        the keys ``"status"``, ``"reason"``, ``"headers"``, ``"content"``,
+        ``"fetch_time"`` (seconds), and ``"date"`` (the WARC date), or return
+        ``None`` if there is none.
+        """
+        with self._lock:
+            if url not in self._index:
+                self._scan()
+            location = self._index.get(url)
+        if location is None:
+            return None
+
+        path, offset = location
+        try:
+            with path.open("rb") as src:
+                src.seek(offset)
+                d = zlib.decompressobj(wbits=31)
+                member = b""
+                while not d.eof:
+                    chunk = src.read(2**16)
+                    if not chunk:
+                        break
+                    member += d.decompress(chunk)
+        except FileNotFoundError:
+            # Pruned since indexed
+            with self._lock:
+                self._index.pop(url, None)
+            return None
+
+        fields, block = split_record(member)
+        head, __, content = block.partition(b"\r\n\r\n")
+        status_line, headers = parse_head(head)
+        __, status, reason = (status_line.split(" ", 2) + [""])[:3]
+        return {
+            "status": int(status),
+            "reason": reason,
+            "headers": headers,
+            "content": content,
+            "fetch_time": float(fields.get("warc-fetch-time", 0)),
+            "date": fields.get("warc-date", ""),
+        }
+
+
+archive = Archive(
+    st.config.ARCHIVE_DIR,
+    file_bytes=st.config.ARCHIVE_FILE_BYTES,
+    max_bytes=st.config.ARCHIVE_MAX_BYTES,
+)
+_queue = queue.Queue()
+
+
+def _run_recorder() -> None:
+    while True:
+        url, response = _queue.get()
+        try:
+            archive.write(
+                url,
+                dict(response.request.headers),
+                response,
+                response.elapsed.total_seconds(),
+            )
+        except OSError as e:
+            logger.error(f"Failed to archive the fetch of {url}: {e}")
+        finally:
+            _queue.task_done()
+
+
+recorder = hp.LazyThread(_run_recorder)
+
+
+def record(url: str, response) -> None:
+    """
+    Queue the given Requests response to a fetch of the story at the given
+    normalized URL for archiving by the background recorder thread, so that the
+    request thread doesn't wait on the write.
+    """
+    recorder.start()
+    _queue.put((url, response))
+
+
+def replay(url: str, delay: float = 0):
+    """
+    Return the latest archived response for the given normalized URL as a
+    Requests response, or ``None`` if there is none.
+    First wait the given factor of the recorded fetch time, to replay upstream's
+    latency too.
+    """
+    import requests
+
+    found = archive.find(url)
+    if found is None:
+        return None
+
+    time.sleep(delay * found["fetch_time"])
+    r = requests.Response()
+    r.status_code = found["status"]
+    r.reason = found["reason"]
+    r.headers = requests.structures.CaseInsensitiveDict(found["headers"])
+    r._content = found["content"]
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    r.url = url
+    r.elapsed = dt.timedelta(seconds=found["fetch_time"])
+    return r
+
+
+# Add a command line interface
+@click.group()
+def cli():
+    """
+    A basic set of commands for inspecting the archive of upstream fetches.
+    """
+    pass
+
+
+@cli.command("list")
+def list_command() -> None:
+    """
+    List the archived responses, oldest first.
+    """
+    for path in archive.paths():
+        for __, fields, block, __ in archive.iter_records(path):
+            if fields.get("warc-type") == "response":
+                status = block.split(b"\r\n", 1)[0].decode("latin-1")
+                click.echo(
+                    f"{fields.get('warc-date')} {status} "
+                    f"{float(fields.get('warc-fetch-time', 0)):.3f} s "
+                    f"{fields.get('warc-target-uri')}"
+                )
+
+
+@cli.command("parse")
+@click.argument("url")
+def parse_command(url: str) -> None:
+    """
+    Parse and render the latest archived response for the given story URL, as the
+    app would, and print the time taken and the result or the error.
+    """
+    import stories as sto
+
+    url = sto.normalize_url(url)
+    r = replay(url)
+    if r is None:
+        raise click.ClickException(f"{url} isn't archived")
+
+    t = time.perf_counter()
+    try:
+        story, __ = sto.parse_page(r.content, r.encoding or "utf-8", url, pooled=False)
+    except Exception:
+        click.echo(traceback.format_exc())
+        raise click.ClickException(
+            f"Failed to parse {url} after {time.perf_counter() - t:.3f} s"
+        )
+    click.echo(
+        f"Parsed and rendered {url} ({r.status_code}, {len(r.content)} bytes) in "
+        f"{time.perf_counter() - t:.3f} s: {story['title']!r} with "
+        f"{len(story['elements'])} elements"
+    )
+
+
+if __name__ == "__main__":
+    cli()
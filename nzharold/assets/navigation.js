@@ -0,0 +1,58 @@
+// Navigate within the app when a reader follows a story's internal links, which
+// dcc.Markdown renders as plain anchors that would otherwise reload the whole app.
+// Also ask the server to prefetch a linked story when a reader hovers over its link.
+(function () {
+    const prefetched = new Set();
+
+    function internalLink(event) {
+        const link = event.target.closest && event.target.closest("#story-content a");
+        if (!link) {
+            return null;
+        }
+        const href = link.getAttribute("href");
+        if (!href || !href.startsWith("/") || href.startsWith("//")) {
+            return null;
+        }
+        return link;
+    }
+
+    document.addEventListener("click", function (event) {
+        const link = internalLink(event);
+        if (
+            !link
+            || event.defaultPrevented
+            || event.button !== 0
+            || event.metaKey
+            || event.ctrlKey
+            || event.shiftKey
+            || event.altKey
+            || link.target === "_blank"
+        ) {
+            return;
+        }
+        event.preventDefault();
+        // Same as dcc.Link, which dcc.Location listens for
+        window.history.pushState({}, "", link.getAttribute("href"));
+        window.dispatchEvent(new CustomEvent("_dashprivate_pushstate"));
+        window.scrollTo(0, 0);
+    });
+
+    function prefetch(event) {
+        const link = internalLink(event);
+        if (!link) {
+            return;
+        }
+        const path = link.getAttribute("href");
+        if (prefetched.has(path)) {
+            return;
+        }
+        prefetched.add(path);
+        fetch("/_prefetch?" + new URLSearchParams({path: path}), {
+            method: "POST",
+            credentials: "same-origin",
+        }).catch(function () {});
+    }
+
+    document.addEventListener("mouseover", prefetch);
+    document.addEventListener("focusin", prefetch);
+})();
@@ -0,0 +1,64 @@
+// Apply the reader settings in the browser, over the page and story already shown,
+// so that changing them costs no request to the server.
+// applyToContent mirrors apply_reader_settings in pages/main.py, which applies the
+// settings to the stories that the server sends.
+(function () {
+    const DEFAULTS = {images: true, image_quality: "high", font_size: "medium", dark: false};
+
+    function imageSrc(src, quality, resizer) {
+        if (!resizer || !resizer.url || !(quality in resizer.widths)) {
+            return src;
+        }
+        return resizer.url
+            .replace("{url}", encodeURIComponent(src))
+            .replace("{width}", resizer.widths[quality]);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        reader: {
+            applyAppearance: function (settings) {
+                settings = Object.assign({}, DEFAULTS, settings);
+                document.documentElement.setAttribute(
+                    "data-bs-theme", settings.dark ? "dark" : "light"
+                );
+                return "reader-font-" + settings.font_size;
+            },
+
+            applyToContent: function (settings, content, resizer) {
+                if (!Array.isArray(content)) {
+                    return window.dash_clientside.no_update;
+                }
+                settings = Object.assign({}, DEFAULTS, settings);
+                let changed = false;
+                const result = content.map(function (item) {
+                    const props = item && item.props;
+                    if (!props || props.className !== "story-image") {
+                        return item;
+                    }
+                    const children = props.children;
+                    const caption = children[children.length - 1];
+                    const oldSrc = children.length > 1 ? children[0].props.src : null;
+                    const newSrc = settings.images
+                        ? imageSrc(props["data-src"], settings.image_quality, resizer)
+                        : null;
+                    if (newSrc === oldSrc) {
+                        return item;
+                    }
+                    changed = true;
+                    const img = {
+                        type: "Img",
+                        namespace: "dash_html_components",
+                        props: {src: newSrc, width: "100%"},
+                    };
+                    return Object.assign({}, item, {
+                        props: Object.assign({}, props, {
+                            children: newSrc ? [img, caption] : [caption],
+                        }),
+                    });
+                });
+                // Leave the story alone when only the appearance changed
+                return changed ? result : window.dash_clientside.no_update;
+            },
+        },
+    });
+})();
@@ -0,0 +1,790 @@
+"""
+A cache for parsed stories and rendered story content.
+
+On a single node, the cache is a :class:`LocalCache`: a small in-memory tier per
+worker in front of a directory of JSON files shared by all the workers of the node.
+
+If ``CACHE_PEERS`` is configured, then the cache is a :class:`ShardedCache`, which
+distributes keys over the peer nodes by consistent hashing (:class:`HashRing`),
+so that each story is fetched from upstream by one node only, no matter how many
+nodes serve the app.
+Peers read and write each other's local caches via the internal endpoint
+``/_internal/cache`` registered by :func:`init_app`.
+
+Rendered stories are also written to :class:`EncodedFiles` in each content coding
+that browsers accept, so that the story JSON endpoint can send them as they are.
+
+Separately, :class:`StoryStore` is the Dash server-side store of the stories being
+read, which lets callbacks re-render a story without refetching it or sending it
+through the browser.
+"""
+
+import bisect
+import collections
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import pathlib as pl
+import threading
+import time
+
+import flask
+from dash_extensions import enrich as dee
+from loguru import logger
+
+import metrics as mt
+import settings as st
+
+
+def hash_key(key: str) -> str:
+    """
+    Return the SHA1 hex digest of the given key.
+    """
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class LocalCache:
+    """
+    A two-tier cache of JSON-serialisable values on this node: an in-memory LRU
+    tier of at most ``max_items`` values per process in front of a directory of
+    JSON files.
+    Values older than ``ttl`` seconds are treated as missing, unless ``ttl`` is
+    ``None``.
+    Deleted keys are logged in the directory, so that the node's other processes
+    drop them from memory too (see :meth:`sync_deletes`), and :meth:`compact`
+    rotates the log.
+    """
+
+    def __init__(
+        self, cache_dir: pl.Path | str, max_items: int = 256, ttl: float | None = None
+    ):
+        self.cache_dir = pl.Path(cache_dir)
+        self.max_items = max_items
+        self.ttl = ttl
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # The inode of the delete log that this process reads and the bytes of it
+        # read, from its end at the start, since the memory holds nothing yet;
+        # forked processes continue from where their parent was.
+        # Create the log, so that a rotation is seen as a change of inode
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._delete_log.touch()
+        self._deletes_log_id, self._deletes_read = self._get_delete_log_end()
+
+    def _path(self, key: str) -> pl.Path:
+        h = hash_key(key)
+        return self.cache_dir / h[:2] / f"{h}.json"
+
+    def _files(self):
+        # Only the folders of hash prefixes, since other caches keep their files
+        # under the same directory
+        return self.cache_dir.glob("[0-9a-f][0-9a-f]/*.json")
+
+    @property
+    def _delete_log(self) -> pl.Path:
+        return self.cache_dir / "deleted.log"
+
+    @property
+    def _old_delete_log(self) -> pl.Path:
+        return self.cache_dir / "deleted.log.old"
+
+    def _get_delete_log_end(self) -> tuple[int | None, int]:
+        try:
+            stat = self._delete_log.stat()
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def _is_fresh(self, created: float) -> bool:
+        return self.ttl is None or time.time() - created < self.ttl
+
+    def get(self, key: str, stale: bool = False):
+        """
+        Return the value stored under the given key or ``None`` if there is no
+        fresh value.
+        If ``stale``, then return the value even if it isn't fresh.
+        """
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if stale or self._is_fresh(item[0]):
+                    self._memory.move_to_end(key)
+                    mt.record_cache("memory", True)
+                    return item[1]
+                del self._memory[key]
+        mt.record_cache("memory", False)
+
+        try:
+            with self._path(key).open() as src:
+                record = json.load(src)
+        except (FileNotFoundError, ValueError):
+            mt.record_cache("disk", False)
+            return None
+
+        if record["key"] != key or not (stale or self._is_fresh(record["created"])):
+            mt.record_cache("disk", False)
+            return None
+
+        mt.record_cache("disk", True)
+        self._remember(key, record["created"], record["value"])
+        return record["value"]
+
+    def set(self, key: str, value) -> None:
+        """
+        Store the given value under the given key.
+        """
+        created = time.time()
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that other workers never read a
+        # partially written file
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp_path.open("w") as tgt:
+            json.dump({"key": key, "created": created, "value": value}, tgt)
+        os.replace(tmp_path, path)
+        self._remember(key, created, value)
+
+    def delete(self, key: str) -> None:
+        """
+        Delete the value stored under the given key, if any, and log the key for
+        the node's other processes.
+        """
+        with self._lock:
+            self._memory.pop(key, None)
+        self._path(key).unlink(missing_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Appends of a line are atomic, so processes can log at once
+        with self._delete_log.open("a") as tgt:
+            tgt.write(json.dumps(key) + "\n")
+
+    def sync_deletes(self) -> int:
+        """
+        Drop from this process's memory the values whose keys other processes have
+        logged as deleted since the last call, and return the number of keys read.
+        If the log was rotated since, read the rest of the old log first.
+        """
+        log_id, __ = self._get_delete_log_end()
+        keys = []
+        if log_id != self._deletes_log_id:
+            try:
+                old_id = self._old_delete_log.stat().st_ino
+            except FileNotFoundError:
+                old_id = None
+            if self._deletes_log_id is not None and old_id == self._deletes_log_id:
+                keys += self._read_deletes(self._old_delete_log)
+            self._deletes_log_id, self._deletes_read = log_id, 0
+        if log_id is not None:
+            keys += self._read_deletes(self._delete_log)
+
+        with self._lock:
+            for key in keys:
+                self._memory.pop(key, None)
+        return len(keys)
+
+    def _read_deletes(self, path: pl.Path) -> list[str]:
+        try:
+            with path.open("rb") as src:
+                src.seek(self._deletes_read)
+                data = src.read()
+        except FileNotFoundError:
+            return []
+
+        # Leave a line still being written for the next call
+        data = data[: data.rfind(b"\n") + 1]
+        self._deletes_read += len(data)
+        return [json.loads(line) for line in data.splitlines()]
+
+    def size(self) -> tuple[int, int, int]:
+        """
+        Return the number of values in this process's memory, and the number of
+        files on disk and their total size in bytes.
+        """
+        n_files = n_bytes = 0
+        for path in self._files():
+            try:
+                n_bytes += path.stat().st_size
+            except FileNotFoundError:
+                continue
+            n_files += 1
+        return len(self._memory), n_files, n_bytes
+
+    def compact(self, keep_stale: float = 0) -> int:
+        """
+        Delete the files of the values older than ``ttl`` plus ``keep_stale``
+        seconds, by their files' modification times, and the temporary files of
+        interrupted writes, and return the number of files deleted.
+        Stale values are kept for a while, since they are served when upstream is
+        unavailable.
+        Also rotate the delete log, so that it doesn't grow without bound.
+        The previous log is kept until the next rotation for the processes that
+        haven't read it to its end, which they do every ``METRICS_INTERVAL``
+        seconds (see :func:`metrics.publish`).
+        """
+        self.sync_deletes()
+        try:
+            os.replace(self._delete_log, self._old_delete_log)
+            self._delete_log.touch()
+        except FileNotFoundError:
+            pass
+
+        if self.ttl is None:
+            return 0
+        now = time.time()
+        n = 0
+        for pattern, max_age in [
+            ("[0-9a-f][0-9a-f]/*.json", self.ttl + keep_stale),
+            ("[0-9a-f][0-9a-f]/*.tmp", 3600),
+        ]:
+            for path in self.cache_dir.glob(pattern):
+                try:
+                    if now - path.stat().st_mtime > max_age:
+                        path.unlink()
+                        n += 1
+                except FileNotFoundError:
+                    continue
+        return n
+
+    def items(self, prefix: str = ""):
+        """
+        Iterate over the (key, value) pairs stored on disk whose keys start with
+        the given prefix, whether fresh or not.
+        """
+        for path in self._files():
+            try:
+                with path.open() as src:
+                    record = json.load(src)
+            except (FileNotFoundError, ValueError):
+                continue
+            if record["key"].startswith(prefix):
+                yield record["key"], record["value"]
+
+    def _remember(self, key: str, created: float, value) -> None:
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+
+def get_brotli():
+    """
+    Return the brotli module, or ``None`` if the optional brotli package isn't
+    installed.
+    """
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class EncodedFiles:
+    """
+    A directory of JSON-serialised values, each stored in a file per content
+    coding: ``identity``, ``gzip``, and ``br`` if the brotli package is installed.
+    Files are served as they are, so that a response needs no serialisation or
+    compression, and its bytes can go from the page cache to the socket by
+    ``sendfile`` under Gunicorn.
+    Values older than ``ttl`` seconds are treated as missing, unless ``ttl`` is
+    ``None``.
+    """
+
+    SUFFIXES = {"identity": "", "gzip": ".gz", "br": ".br"}
+
+    def __init__(self, directory: pl.Path | str, ttl: float | None = None):
+        self.directory = pl.Path(directory)
+        self.ttl = ttl
+
+    def _path(self, key: str, encoding: str = "identity") -> pl.Path:
+        h = hash_key(key)
+        return self.directory / h[:2] / f"{h}.json{self.SUFFIXES[encoding]}"
+
+    def set(self, key: str, value) -> None:
+        """
+        Store the given value under the given key in every content coding.
+        """
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        encoded = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        brotli = get_brotli()
+        if brotli is not None:
+            # Quality 11 compresses a few percent better at ten times the time
+            encoded["br"] = brotli.compress(data, quality=9)
+        # Write the identity file last, since its time stamp dates the value
+        encoded["identity"] = data
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for encoding, content in encoded.items():
+            path = self._path(key, encoding)
+            tmp_path = path.with_name(
+                f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            )
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+
+    def find(self, key: str, accept_encodings) -> tuple[pl.Path, str] | None:
+        """
+        Return the pair (file path, content coding) of the value stored under the
+        given key in the coding that best matches the given ``Accept-Encoding``
+        header, as parsed by Werkzeug, or return ``None`` if there is no fresh value.
+        """
+        path = self._path(key)
+        try:
+            created = path.stat().st_mtime
+        except FileNotFoundError:
+            mt.record_cache("render_files", False)
+            return None
+        if self.ttl is not None and time.time() - created >= self.ttl:
+            mt.record_cache("render_files", False)
+            return None
+
+        mt.record_cache("render_files", True)
+        encoding = accept_encodings.best_match(["br", "gzip"])
+        if encoding is not None and self._path(key, encoding).exists():
+            return self._path(key, encoding), encoding
+        if encoding == "br" and accept_encodings["gzip"]:
+            return self._path(key, "gzip"), "gzip"
+        return path, "identity"
+
+    def delete(self, key: str) -> None:
+        """
+        Delete the files of the value stored under the given key, if any.
+        """
+        for encoding in self.SUFFIXES:
+            self._path(key, encoding).unlink(missing_ok=True)
+
+    def size(self) -> tuple[int, int]:
+        """
+        Return the number of values stored and the total size in bytes of their
+        files in all content codings.
+        """
+        n_values = n_bytes = 0
+        for path in self.directory.glob("*/*"):
+            try:
+                n_bytes += path.stat().st_size
+            except FileNotFoundError:
+                continue
+            n_values += path.suffix == ".json"
+        return n_values, n_bytes
+
+    def compact(self) -> int:
+        """
+        Delete the files of the values older than ``ttl`` seconds, which are never
+        sent, and the temporary files of interrupted writes, and return the number
+        of files deleted.
+        """
+        now = time.time()
+        n = 0
+        for path in self.directory.glob("*/*"):
+            try:
+                age = now - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".tmp":
+                expired = age > 3600
+            else:
+                # A value's time stamp is that of its identity file
+                identity = path.with_name(path.name.split(".")[0] + ".json")
+                try:
+                    age = now - identity.stat().st_mtime
+                    expired = self.ttl is not None and age >= self.ttl
+                except FileNotFoundError:
+                    expired = True
+            if expired:
+                path.unlink(missing_ok=True)
+                n += 1
+        return n
+
+
+class HashRing:
+    """
+    A consistent-hash ring of nodes, each placed on the ring at ``replicas``
+    virtual points, so that adding or removing a node only moves the keys
+    adjacent to its points.
+    """
+
+    def __init__(self, nodes: list[str] = (), replicas: int = 100):
+        self.replicas = replicas
+        self._points = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(s: str) -> int:
+        return int(hashlib.md5(s.encode("utf-8")).hexdigest()[:16], 16)
+
+    @property
+    def nodes(self) -> list[str]:
+        return sorted(set(self._nodes.values()))
+
+    def add(self, node: str) -> None:
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            self._nodes[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node: str) -> None:
+        for i in range(self.replicas):
+            point = self._hash(f"{node}#{i}")
+            if self._nodes.pop(point, None) is not None:
+                self._points.remove(point)
+
+    def get_nodes(self, key: str, n: int = 1, exclude=()) -> list[str]:
+        """
+        Return the first ``n`` distinct nodes clockwise from the given key on the
+        ring, skipping the nodes in ``exclude``.
+        The first of these is the key's owner and the next ones are the nodes that
+        would successively own the key if the preceding ones left the ring.
+        """
+        result = []
+        if not self._points:
+            return result
+
+        start = bisect.bisect(self._points, self._hash(key))
+        for i in range(len(self._points)):
+            node = self._nodes[self._points[(start + i) % len(self._points)]]
+            if node not in result and node not in exclude:
+                result.append(node)
+                if len(result) == n:
+                    break
+
+        return result
+
+
+class ShardedCache:
+    """
+    A cache whose keys are distributed by consistent hashing over the nodes
+    ``peers``, one of which is this node, ``node``.
+    Values are stored in the local caches of the key's first ``n_copies``
+    nodes on the ring.
+
+    A peer that fails to respond is treated as down for ``retry_after`` seconds,
+    during which its keys fall to the next nodes on the ring.
+    When a node joins the ring, it takes over keys from its successors, so on a
+    miss, the owner of a key asks the key's next node on the ring for it before
+    giving up.
+    """
+
+    def __init__(
+        self,
+        local: LocalCache,
+        node: str,
+        peers: list[str],
+        token: str,
+        n_copies: int = 1,
+        timeout: float = 0.5,
+        retry_after: float = 30,
+    ):
+        self.local = local
+        self.node = node
+        self.ring = HashRing(sorted(set(peers) | {node}))
+        self.token = token
+        self.n_copies = n_copies
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._down = {}
+        self._session = None
+
+    def _live_nodes(self, key: str, n: int) -> list[str]:
+        now = time.time()
+        down = {p for p, until in self._down.items() if until > now}
+        return self.ring.get_nodes(key, n, exclude=down)
+
+    def _mark_down(self, peer: str, error: Exception) -> None:
+        logger.warning(f"Cache peer {peer} is unavailable: {error}")
+        self._down[peer] = time.time() + self.retry_after
+
+    def _request(self, method: str, peer: str, key: str, value=None, **params):
+        """
+        Make the given request to the internal cache endpoint of the given peer and
+        return the response, or ``None`` if the peer fails to respond.
+        """
+        import requests
+
+        if self._session is None:
+            self._session = requests.Session()
+        try:
+            r = self._session.request(
+                method,
+                f"{peer}/_internal/cache",
+                params={"key": key, **params},
+                json=value,
+                headers={"X-Cache-Token": self.token},
+                timeout=self.timeout,
+            )
+            r.raise_for_status()
+        except requests.RequestException as e:
+            self._mark_down(peer, e)
+            return None
+
+        self._down.pop(peer, None)
+        return r
+
+    def _get_from(self, peer: str, key: str, stale: bool = False):
+        if peer == self.node:
+            return self.local.get(key, stale=stale)
+
+        r = self._request("GET", peer, key, **({"stale": 1} if stale else {}))
+        if r is None or r.status_code == 204:
+            mt.record_cache("peer", False)
+            return None
+        mt.record_cache("peer", True)
+        return r.json()
+
+    def _set_on(self, peer: str, key: str, value) -> bool:
+        if peer == self.node:
+            self.local.set(key, value)
+            return True
+        return self._request("PUT", peer, key, value) is not None
+
+    def get(self, key: str, stale: bool = False):
+        """
+        Return the value stored under the given key or ``None`` if no node on the
+        ring has a fresh value.
+        If ``stale``, then return the value even if it isn't fresh.
+        """
+        nodes = self._live_nodes(key, self.n_copies + 1)
+        for i, peer in enumerate(nodes):
+            value = self._get_from(peer, key, stale=stale)
+            if value is not None:
+                # Hand the value off to the key's current owner, unless it's stale,
+                # since the owner would store it as new
+                if i > 0 and not stale and self._down.get(nodes[0], 0) < time.time():
+                    self._set_on(nodes[0], key, value)
+                return value
+
+        # Nodes that were down might have left a copy here
+        if self.node not in nodes:
+            return self.local.get(key, stale=stale)
+
+        return None
+
+    def set(self, key: str, value) -> None:
+        """
+        Store the given value under the given key on the key's nodes, falling back
+        to this node if none of them respond.
+        """
+        stored = False
+        for peer in self._live_nodes(key, self.n_copies):
+            stored |= self._set_on(peer, key, value)
+        if not stored:
+            self.local.set(key, value)
+
+    def delete(self, key: str, tier: str = "cache") -> None:
+        """
+        Delete the value stored under the given key on all live nodes, from their
+        local caches or, given ``tier``, from another of the tiers that each node
+        keeps of its own (see :func:`get_node_tier`).
+        """
+        for peer in self._live_nodes(key, len(self.ring.nodes)):
+            if peer == self.node:
+                (self.local if tier == "cache" else get_node_tier(tier)).delete(key)
+            elif tier == "cache":
+                self._request("DELETE", peer, key)
+            else:
+                self._request("DELETE", peer, key, tier=tier)
+
+
+class StoryStore(dee.FileSystemBackend):
+    """
+    A Dash server-side backend that stores values in a directory of at most
+    ``threshold`` files that expire after ``default_timeout`` seconds, like its
+    parent class, and additionally keeps the total size of the files under
+    ``max_bytes`` by deleting the least recently written ones.
+    The size is checked every ``prune_every`` writes per process.
+    """
+
+    def __init__(
+        self, cache_dir: pl.Path | str, max_bytes: int, prune_every: int = 50, **kwargs
+    ):
+        super().__init__(str(cache_dir), **kwargs)
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._n_sets = 0
+
+    def set(self, key, value, timeout=None, mgmt_element=False) -> bool:
+        result = super().set(key, value, timeout=timeout, mgmt_element=mgmt_element)
+        if not mgmt_element:
+            self._n_sets += 1
+            if self._n_sets % self.prune_every == 0:
+                self.prune_size()
+        return result
+
+    def _stat_files(self) -> list[tuple[float, int, str]]:
+        result = []
+        for path in self._list_dir():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def size(self) -> tuple[int, int]:
+        """
+        Return the number of files in the store and their total size in bytes.
+        """
+        files = self._stat_files()
+        return len(files), sum(size for __, size, __ in files)
+
+    def prune_size(self) -> int:
+        """
+        If the store is larger than ``max_bytes``, then delete its least recently
+        written files until it is at most 90% of that size.
+        Return the number of files deleted.
+        """
+        files = sorted(self._stat_files())
+        total = sum(size for __, size, __ in files)
+        if total <= self.max_bytes:
+            return 0
+
+        n = 0
+        for __, size, path in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            n += 1
+
+        self._update_count(delta=-n)
+        return n
+
+    def compact(self) -> int:
+        """
+        Delete the expired files and then, if the store is still too large, the
+        least recently written ones (see :meth:`prune_size`), and return the number
+        of files deleted.
+        """
+        n = self.size()[0]
+        self._remove_expired(time.time())
+        self.prune_size()
+        return n - self.size()[0]
+
+
+def make_cache(config=st.config) -> LocalCache | ShardedCache:
+    """
+    Return the cache described by the given configuration.
+    """
+    local = LocalCache(
+        config.CACHE_DIR, max_items=config.CACHE_MAX_ITEMS, ttl=config.CACHE_TTL
+    )
+    if not config.CACHE_PEERS:
+        return local
+
+    if not config.CACHE_NODE:
+        raise ValueError("CACHE_NODE must be set when CACHE_PEERS is set")
+    if not config.CACHE_PEER_TOKEN:
+        raise ValueError("CACHE_PEER_TOKEN must be set when CACHE_PEERS is set")
+
+    return ShardedCache(
+        local,
+        config.CACHE_NODE,
+        config.CACHE_PEERS,
+        token=config.CACHE_PEER_TOKEN,
+        n_copies=config.CACHE_COPIES,
+        timeout=config.CACHE_PEER_TIMEOUT,
+    )
+
+
+cache = make_cache()
+local_cache = cache.local if isinstance(cache, ShardedCache) else cache
+render_files = EncodedFiles(st.config.RENDER_FILES_DIR, ttl=st.config.CACHE_TTL)
+story_store = StoryStore(
+    st.config.STORE_DIR,
+    max_bytes=st.config.STORE_MAX_BYTES,
+    threshold=st.config.STORE_MAX_ITEMS,
+    default_timeout=st.config.STORE_TTL,
+)
+
+
+def get_node_tier(tier: str):
+    """
+    Return this node's cache tier of the given name: ``"cache"``, the local story
+    cache, ``"render_files"``, or ``"story_store"``.
+    """
+    return {
+        "cache": local_cache,
+        "render_files": render_files,
+        "story_store": story_store,
+    }[tier]
+
+
+def delete_on_nodes(tier: str, key: str) -> None:
+    """
+    Delete the value under the given key from the given tier (see
+    :func:`get_node_tier`) of this node and, if the cache is sharded, of all the
+    live peers, since each node writes its own render files and story store.
+    """
+    if isinstance(cache, ShardedCache):
+        cache.delete(key, tier=tier)
+    else:
+        get_node_tier(tier).delete(key)
+
+
+def compact() -> dict:
+    """
+    Delete this node's expired cache files, those of values stale for more than
+    ``CACHE_KEEP_STALE`` seconds, of renderings too old to send, and of story
+    store entries past their expiry or over its size limit, and return the number
+    of files deleted by tier.
+    """
+    return {
+        "disk": local_cache.compact(keep_stale=st.config.CACHE_KEEP_STALE),
+        "render_files": render_files.compact(),
+        "story_store": story_store.compact(),
+    }
+
+
+# ------------------
+# Internal endpoint
+# ------------------
+blueprint = flask.Blueprint("cache", __name__)
+
+
+@blueprint.route("/_internal/cache", methods=["GET", "PUT", "DELETE"])
+def peer_cache():
+    """
+    Read, write, or delete the value under the query parameter ``key`` in this
+    node's local cache on behalf of a peer.
+    Reads return stale values too if the query parameter ``stale`` is set.
+    Deletes are from the tier in the query parameter ``tier`` if set (see
+    :func:`get_node_tier`).
+    Return status 204 on a read miss.
+    """
+    token = flask.request.headers.get("X-Cache-Token", "")
+    if not st.config.CACHE_PEER_TOKEN or not hmac.compare_digest(
+        token, st.config.CACHE_PEER_TOKEN
+    ):
+        flask.abort(403)
+
+    key = flask.request.args.get("key")
+    if not key:
+        flask.abort(400)
+
+    if flask.request.method == "GET":
+        value = local_cache.get(key, stale=bool(flask.request.args.get("stale")))
+        if value is None:
+            return "", 204
+        return flask.jsonify(value)
+    elif flask.request.method == "PUT":
+        local_cache.set(key, flask.request.get_json())
+    else:
+        try:
+            get_node_tier(flask.request.args.get("tier", "cache")).delete(key)
+        except KeyError:
+            flask.abort(400)
+
+    return "", 204
+
+
+def init_app(server: flask.Flask) -> None:
+    """
+    Register the internal cache endpoint on the given Flask server.
+    """
+    server.register_blueprint(blueprint)
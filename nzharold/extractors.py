@@ -0,0 +1,289 @@
+"""
+Extractors of stories from the pages of the news sites that the app reads, in a
+registry keyed by domain.
+
+Each extractor declares its site's domain and base URL, its upstream limits (the
+requests per second per host, the fetches in flight per worker, and the
+connections to keep per host), the element types that it produces, and its
+extraction strategy, the cheapest way to get a story out of its site's pages.
+All of them produce stories in the same form (see :meth:`Extractor.extract`), so
+that the cache, the search index, and the rendering are shared.
+
+A story URL is dispatched to its extractor by a compiled regular expression that
+picks out its host, which is then looked up with its parent domains in the
+registry (see :func:`get_extractor`), so that adding sources costs the NZ Herald
+stories nothing.
+NZ Herald stories are served at their paths, and those of the other sources at
+their paths under their domains, e.g. ``/newsroom.co.nz/pro/a-story``.
+"""
+
+import json
+import re
+import urllib.parse as up
+
+import settings as st
+
+# The element types that the rendering supports, with their keys besides "type"
+ELEMENT_TYPES = {"text": {"content"}, "image": {"src", "caption"}}
+
+
+class Extractor:
+    """
+    The extractor of stories from the pages of one news site.
+    Subclasses set the class attributes and implement :meth:`extract`.
+    """
+
+    # Short name of the source, kept with its stories
+    name = ""
+    # Domain of the site, which matches its subdomains too
+    domain = ""
+    # Scheme and host of the site's normalized URLs
+    base_url = ""
+    # Maximum number of upstream requests to start per second per host, or None
+    # for the setting UPSTREAM_RATE_LIMIT
+    rate_limit = None
+    # Number of connections to keep open to the site
+    max_connections = 2
+    # Maximum number of fetches from the site in flight per worker, or None for the
+    # setting UPSTREAM_MAX_CONCURRENCY
+    max_concurrency = None
+    # Element types that extract() produces, from ELEMENT_TYPES
+    element_types = ("text",)
+    # Pattern of the site's story IDs in story URL paths, if they have them, with
+    # the ID as its first group
+    id_pattern = None
+
+    @property
+    def path_prefix(self) -> str:
+        """
+        Return the prefix of the paths at which the app serves the site's stories.
+        """
+        return f"/{self.domain}"
+
+    def normalize_url(self, url: str) -> str:
+        """
+        Return the given URL of a story on the site in the form
+        ``<base URL><path>``, that is, without its query string and fragment and
+        with the site's canonical host, so that URL variants share cache entries.
+        """
+        url = url.strip()
+        if "//" not in url:
+            url = f"//{url}"
+        path = up.urlsplit(url).path or "/"
+        return f"{self.base_url}{path}"
+
+    def get_story_id(self, url: str) -> str | None:
+        """
+        Return the site's ID of the story at the given URL, if the URL has it, or
+        else ``None``.
+        """
+        if self.id_pattern is None:
+            return None
+        match = self.id_pattern.search(up.urlsplit(url).path)
+        return match and match.group(1)
+
+    def extract(self, text: str, url: str) -> dict:
+        """
+        Parse the given HTML text of the story page at the given normalized URL
+        and return a dictionary with the keys
+
+        - ``"url"``: the given URL
+        - ``"source"``: the name of the source
+        - ``"id"``: the site's ID of the story, if the page has it, or ``None``
+        - ``"title"``: the story's title
+        - ``"elements"``: list of the story's elements as dictionaries, each with
+          a ``"type"`` key from the extractor's ``element_types`` and the keys of
+          that type (see ``ELEMENT_TYPES``); text elements have the HTML key
+          ``"content"``, and image elements have the keys ``"src"`` and
+          ``"caption"``
+
+        Raise a ``ValueError`` if the page has no story.
+        """
+        raise NotImplementedError
+
+
+class NZHerald(Extractor):
+    """
+    Extract NZ Herald stories from the JSON content that the pages embed for
+    their Fusion front end, which spares walking the page's markup.
+    """
+
+    name = "nzherald"
+    domain = "nzherald.co.nz"
+    base_url = "https://www.nzherald.co.nz"
+    element_types = ("text", "image")
+    # The trailing segment of story paths, e.g. YQMPIC4PJQWJCR2SF7AHYX3BO4
+    id_pattern = re.compile(r"/([0-9A-Z]{26})/?$")
+
+    @property
+    def path_prefix(self) -> str:
+        return ""
+
+    @property
+    def max_connections(self) -> int:
+        return st.config.BATCH_MAX_WORKERS
+
+    def extract(self, text: str, url: str) -> dict:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(text, "html.parser")
+        metadata = soup.find(id="fusion-metadata")
+        if metadata is None or not metadata.contents:
+            raise ValueError("Page has no Fusion metadata")
+
+        s = (
+            metadata.contents[0]
+            .split("Fusion.globalContent=")[1]
+            .split(";Fusion.globalContentConfig")[0]
+            .replace(":false", ':"False"')
+            .replace(":true", ':"True"')
+        )
+        content = json.loads(s)
+        elements = []
+        for el in content.get("elements", []):
+            if el["type"] == "text":
+                elements.append({"type": "text", "content": el["content"]})
+            elif el["type"] == "image":
+                elements.append(
+                    {
+                        "type": "image",
+                        "src": el["additional_properties"]["originalUrl"],
+                        "caption": el.get("caption", ""),
+                    }
+                )
+
+        return {
+            "url": url,
+            "source": self.name,
+            "id": content.get("_id"),
+            "title": soup.title.get_text() if soup.title else "",
+            "elements": elements,
+        }
+
+
+class Newsroom(Extractor):
+    """
+    Extract Newsroom stories from the article element of their pages, parsing
+    only that element and the title, and skipping the rest of the page.
+    """
+
+    name = "newsroom"
+    domain = "newsroom.co.nz"
+    base_url = "https://www.newsroom.co.nz"
+    rate_limit = 1
+    max_concurrency = 2
+    element_types = ("text", "image")
+    # The tags of the story body that make elements
+    TEXT_TAGS = ["p", "h2", "h3", "h4", "blockquote", "ul", "ol"]
+
+    def extract(self, text: str, url: str) -> dict:
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        soup = BeautifulSoup(
+            text, "html.parser", parse_only=SoupStrainer(["title", "article"])
+        )
+        article = soup.find("article")
+        if article is None:
+            raise ValueError("Page has no article")
+        body = article.find(class_="entry-content") or article
+
+        elements = []
+        for tag in body.find_all(self.TEXT_TAGS + ["figure"]):
+            # Skip the tags within the elements already taken
+            if tag.find_parent(self.TEXT_TAGS + ["figure"]) not in (None, body):
+                continue
+            if tag.name == "figure":
+                img = tag.find("img")
+                src = img and (img.get("data-src") or img.get("src"))
+                caption = tag.find("figcaption")
+                if src:
+                    elements.append(
+                        {
+                            "type": "image",
+                            "src": up.urljoin(self.base_url, src),
+                            "caption": caption.get_text(" ", strip=True)
+                            if caption is not None
+                            else "",
+                        }
+                    )
+            elif tag.get_text(strip=True):
+                elements.append({"type": "text", "content": str(tag)})
+
+        heading = article.find("h1")
+        if heading is not None:
+            title = heading.get_text(" ", strip=True)
+        else:
+            title = soup.title.get_text() if soup.title else ""
+        return {
+            "url": url,
+            "source": self.name,
+            # The WordPress post ID, e.g. "post-12345"
+            "id": article.get("id"),
+            "title": title,
+            "elements": elements,
+        }
+
+
+# The registry of extractors by domain
+extractors = {}
+# The URL router's pattern, which captures the host of a URL, with or without a
+# scheme
+HOST_PATTERN = re.compile(
+    r"\s*(?:[a-z][a-z0-9+.-]*:)?(?://)?([a-z0-9.-]+)(?=[:/?#\s]|$)", re.IGNORECASE
+)
+
+
+def register(extractor: Extractor) -> None:
+    """
+    Add the given extractor to the registry, replacing any of the same domain.
+    Raise a ``ValueError`` if the extractor produces element types that the
+    rendering doesn't support.
+    """
+    unsupported = set(extractor.element_types) - set(ELEMENT_TYPES)
+    if unsupported:
+        raise ValueError(f"Unsupported element types: {sorted(unsupported)}")
+    extractors[extractor.domain] = extractor
+
+
+def get_extractor(url: str, default: Extractor | None = None) -> Extractor | None:
+    """
+    Return the extractor of the site of the given story URL, or the given default
+    if no registered extractor covers the URL's host.
+    """
+    match = HOST_PATTERN.match(url)
+    if match is None:
+        return default
+    # Look up the host and then its parent domains, which costs the same however
+    # many extractors there are
+    host = match.group(1).lower()
+    while host:
+        extractor = extractors.get(host)
+        if extractor is not None:
+            return extractor
+        host = host.partition(".")[2]
+    return default
+
+
+def to_path(url: str) -> str:
+    """
+    Return the path at which the app serves the story at the given normalized URL.
+    """
+    extractor = get_extractor(url, nzherald)
+    return extractor.path_prefix + (up.urlsplit(url).path or "/")
+
+
+def from_path(path: str) -> str:
+    """
+    Return the normalized URL of the story that the app serves at the given path
+    (see :func:`to_path`).
+    """
+    prefix, __, rest = path.lstrip("/").partition("/")
+    extractor = extractors.get(prefix)
+    if extractor is None or extractor is nzherald:
+        return nzherald.normalize_url(path)
+    return extractor.normalize_url(f"/{rest}")
+
+
+nzherald = NZHerald()
+register(nzherald)
+register(Newsroom())
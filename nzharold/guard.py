@@ -0,0 +1,243 @@
+"""
+Guards against bots and clients that fetch too many stories from upstream.
+
+:class:`BotBlocker` is a WSGI middleware that refuses the requests of the AI bots
+listed by https://github.com/ai-robots-txt, as the Apache rules that
+``fab add-apache-bot-blocking`` writes do, so that the app is guarded without
+Apache too.
+:func:`allow_story_fetch` rate limits the upstream story fetches of each client
+IP address and each user by token buckets (:class:`TokenBucketLimiter`), and
+:func:`allow_prefetch` the prefetches of each user by buckets of their own.
+
+The guards count what they do in :data:`counters`, per worker, which the endpoint
+``/_internal/guard`` registered by :func:`init_app` returns.
+"""
+
+import collections
+import functools
+import os
+import re
+import threading
+import time
+
+import flask
+import flask_login as fl
+from loguru import logger
+
+import settings as st
+import stories as sto
+
+counters = collections.Counter()
+
+
+def read_bot_user_agents(path) -> list[str]:
+    """
+    Return the bot user agents in the given file, one per line.
+    Return an empty list if the file doesn't exist.
+    """
+    try:
+        text = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        logger.warning(f"No bot user agents file {path}; not blocking bots")
+        return []
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def make_bot_matcher(user_agents: list[str]):
+    """
+    Return a function that takes a user agent string and returns ``True`` if it
+    contains any of the given bot user agents, case insensitively.
+    The bot user agents are compiled into one regular expression, and the
+    function remembers its results for the most common user agents, since most
+    requests come from a few browsers.
+    """
+    if not user_agents:
+        return lambda user_agent: False
+
+    # Lowercasing beats the IGNORECASE flag, which makes the search over ten
+    # times slower
+    pattern = re.compile("|".join(re.escape(a.lower()) for a in user_agents))
+
+    @functools.lru_cache(maxsize=4096)
+    def is_bot(user_agent: str) -> bool:
+        return pattern.search(user_agent.lower()) is not None
+
+    return is_bot
+
+
+class BotBlocker:
+    """
+    WSGI middleware that answers the requests of bots, as decided by the given
+    function of the user agent, with 403 Forbidden, except for ``/robots.txt``.
+    """
+
+    def __init__(self, app, is_bot):
+        self.app = app
+        self.is_bot = is_bot
+
+    def __call__(self, environ, start_response):
+        counters["requests"] += 1
+        if self.is_bot(environ.get("HTTP_USER_AGENT", "")) and environ.get(
+            "PATH_INFO"
+        ) not in ("/robots.txt", "robots.txt"):
+            counters["bot_requests_blocked"] += 1
+            start_response("403 FORBIDDEN", [("Content-Type", "text/plain")])
+            return [b"Forbidden"]
+        return self.app(environ, start_response)
+
+
+class TokenBucketLimiter:
+    """
+    Rate limit actions per key, e.g. per IP address, by token buckets of the given
+    size, which refill at the given rate of tokens per second; an action costs one
+    token.
+    Remember the buckets of only the ``max_keys`` most recently seen keys, since
+    forgotten buckets are full anyway after ``burst / rate`` seconds.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def tokens(self, key) -> float:
+        """
+        Return the number of tokens in the bucket of the given key, without taking
+        any.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            return min(self.burst, tokens + (now - last) * self.rate)
+
+    def allow(self, key) -> bool:
+        """
+        Take a token from the bucket of the given key and return ``True``, or
+        return ``False`` if the bucket is empty.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+ip_limiter = TokenBucketLimiter(
+    st.config.FETCH_RATE_PER_IP, st.config.FETCH_BURST_PER_IP
+)
+user_limiter = TokenBucketLimiter(
+    st.config.FETCH_RATE_PER_USER, st.config.FETCH_BURST_PER_USER
+)
+prefetch_limiter = TokenBucketLimiter(
+    st.config.FETCH_RATE_PREFETCH, st.config.FETCH_BURST_PREFETCH
+)
+
+
+def get_client_ip() -> str:
+    """
+    Return the IP address of the client of the current request.
+    Gunicorn only listens to the local Apache proxy, so trust the address that
+    Apache appends to ``X-Forwarded-For``, the last one; the ones before it come
+    from the client, which can send any.
+    """
+    forwarded = flask.request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return flask.request.remote_addr or ""
+
+
+def is_local_request() -> bool:
+    """
+    Return ``True`` if the current request comes from this host and not through
+    the Apache proxy, as the requests of ``fab`` tasks and operators do.
+    The internal endpoints under ``/_internal/`` serve only such requests, since
+    they reveal or change the state of the node; the proxy, which forwards every
+    request from outside, adds the header ``X-Forwarded-For``.
+    """
+    return (
+        flask.request.remote_addr in ("127.0.0.1", "::1")
+        and "X-Forwarded-For" not in flask.request.headers
+    )
+
+
+def is_admin() -> bool:
+    """
+    Return ``True`` if the current user is logged in and among ``ADMIN_USERS``,
+    who may see the admin dashboard.
+    """
+    return (
+        fl.current_user.is_authenticated
+        and fl.current_user.username in st.config.ADMIN_USERS
+    )
+
+
+def allow_story_fetch(url: str) -> bool:
+    """
+    Return ``True`` if the story at the given normalized URL is cached or the
+    client of the current request may fetch it from upstream, which costs a token
+    from the bucket of the client's IP address and, if logged in, of the user.
+    No token is taken unless every bucket has one.
+    """
+    if sto.get_cached_story(url) is not None:
+        return True
+
+    buckets = [(ip_limiter, get_client_ip())]
+    if fl.current_user.is_authenticated:
+        buckets.append((user_limiter, fl.current_user.get_id()))
+    allowed = all(limiter.tokens(key) >= 1 for limiter, key in buckets)
+    if allowed:
+        allowed = all([limiter.allow(key) for limiter, key in buckets])
+    counters["story_fetches_allowed" if allowed else "story_fetches_limited"] += 1
+    return allowed
+
+
+def allow_prefetch() -> bool:
+    """
+    Return ``True`` if the logged-in user of the current request may prefetch a
+    story from upstream, which costs a token from the user's prefetch bucket and
+    none from the buckets of :func:`allow_story_fetch`, so that prefetching never
+    limits the user's own fetches.
+    Return ``False`` without taking a token if those buckets are less than half
+    full, since the client is then fetching plenty already.
+    """
+    buckets = [
+        (ip_limiter, get_client_ip()),
+        (user_limiter, fl.current_user.get_id()),
+    ]
+    allowed = all(
+        limiter.tokens(key) >= limiter.burst / 2 for limiter, key in buckets
+    ) and prefetch_limiter.allow(fl.current_user.get_id())
+    counters["prefetches_allowed" if allowed else "prefetches_limited"] += 1
+    return allowed
+
+
+blueprint = flask.Blueprint("guard", __name__)
+
+
+@blueprint.get("/_internal/guard")
+def get_counters():
+    """
+    Return this worker's guard counters as JSON; only local requests can (see
+    :func:`is_local_request`).
+    """
+    if not is_local_request():
+        flask.abort(403)
+    return {"pid": os.getpid(), "counters": dict(counters)}
+
+
+def init_app(server: flask.Flask) -> None:
+    """
+    Wrap the given Flask server's WSGI app in the bot blocker and register the
+    guard counters endpoint.
+    """
+    is_bot = make_bot_matcher(read_bot_user_agents(st.config.BOT_USER_AGENTS_PATH))
+    server.wsgi_app = BotBlocker(server.wsgi_app, is_bot)
+    server.register_blueprint(blueprint)
@@ -1,15 +1,105 @@
-workers = 4
-threads = 4
+import gc
+import os
+import pathlib as pl
+import time
+
+import dotenv as de
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+# Read the settings below from the .env file too, as settings.py does for the app
+de.load_dotenv(ROOT / ".env")
+
+# Worker processes, threads per worker, and worker class, which
+# ``benchmarks/gunicorn_sweep.py`` measures and recommends for the host
+workers = int(os.getenv("GUNICORN_WORKERS", 4))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
 worker_tmp_dir = "/dev/shm"
 
-bind = "127.0.0.1:5020"
+# Addresses to listen on: always this host, to which the Apache proxy and the fab
+# reload tasks connect, and GUNICORN_BIND if set.
+# The nodes of a multi-node story cache call each other directly, so for one, set
+# GUNICORN_BIND to the address of this node's URL in CACHE_PEERS on the nodes'
+# private network, e.g. "10.0.0.1:5020", and firewall that port from elsewhere
+bind = ["127.0.0.1:5020"] + [a for a in [os.getenv("GUNICORN_BIND")] if a]
 umask = 0o007
 reload = False
 forwarded_allow_ips = "*"
 
+# Load the app once in the master and fork the workers from it, so that recycled
+# workers start warm and share the app's memory copy-on-write
+preload_app = True
+
+# Where the master writes its process ID, by which ``fab reload-gunicorn`` signals
+# it; a new master started by USR2 writes to this path plus ".2" until the old one
+# exits
+pidfile = os.getenv("GUNICORN_PIDFILE", str(ROOT / "gunicorn.pid"))
+
 # logging
 accesslog = "-"
 errorlog = "-"
 
-max_requests = 500
-max_requests_jitter = 50
+# Replace workers once their memory grows beyond WORKER_MAX_RSS (see post_request)
+# rather than after a fixed number of requests, which throws away warm workers;
+# keep a high request limit only as a backstop, or 0 for none
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 20000))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    import index
+    import settings
+    import stories
+    from pages import main
+
+    # Import the lazily imported dependencies and build the page layouts once for
+    # all workers
+    stories.import_dependencies()
+    for page in index.PAGES:
+        index.get_layout(page)
+    # Load the stories most likely to be read next into memory for all workers
+    n = main.load_recent_stories(settings.config.WARM_STORIES)
+    server.log.info(f"Loaded {n} recent stories into memory")
+    # Keep the garbage collector from touching, and so copying, the master's objects
+    # in the workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    import settings
+    import stories
+    import user_management as um
+
+    # Don't share database connections with the master
+    um.engine.dispose(close=False)
+    with app.server.app_context():
+        um.db.engine.dispose(close=False)
+    # Start the worker's parsing processes before the first story needs them
+    if settings.config.PARSE_MODE == "process":
+        stories.start_parse_pool()
+
+
+def post_request(worker, req, environ, resp):
+    import memory
+    import settings
+
+    if worker.alive and memory.should_recycle():
+        worker.log.info(
+            f"Worker {worker.pid} exceeded {settings.config.WORKER_MAX_RSS} bytes "
+            "of RSS; replacing it after its current requests"
+        )
+        worker.alive = False
+
+
+def on_exit(server):
+    from gunicorn import systemd
+
+    # On retiring after a USR2 upgrade, hand the systemd service over to the new
+    # master, or else systemd would stop the service, new master and all.
+    # This takes the service type "notify" (see ``fab init-gunicorn``); otherwise
+    # the message goes nowhere
+    if server.reexec_pid:
+        systemd.sd_notify(f"MAINPID={server.reexec_pid}", server.log)
+        # Give systemd time to read the message before it sees this process exit
+        time.sleep(0.5)
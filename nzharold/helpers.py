@@ -0,0 +1,79 @@
+"""
+Helper functions shared by the pages, and the background threads of the modules.
+"""
+
+import json
+import threading
+
+import plotly.io as pio
+
+
+def to_json(components) -> str:
+    """
+    Return the given Dash component tree, or any JSON-serialisable value containing
+    Dash components, as the JSON text that Dash would serialize it to.
+    """
+    return pio.json.to_json_plotly(components)
+
+
+def to_plain(components):
+    """
+    Return the given Dash component tree as the plain lists and dictionaries that
+    Dash would serialize it to.
+    Dash sends plain values as they are, which is faster than walking a component
+    tree, so it's worth converting component trees that are sent repeatedly.
+    """
+    return json.loads(to_json(components))
+
+
+def with_props(tree, new_props: dict):
+    """
+    Return a copy of the given plain component tree (output of :func:`to_plain`)
+    in which the components with IDs in the given dictionary of
+    ID -> dictionary of props have those props.
+    Only the components on the way to those components are copied, so that the
+    given tree stays unchanged and can be memoized.
+    """
+    if isinstance(tree, list):
+        new_tree = [with_props(item, new_props) for item in tree]
+        if all(new is old for new, old in zip(new_tree, tree)):
+            return tree
+        return new_tree
+
+    if not isinstance(tree, dict) or "props" not in tree:
+        return tree
+
+    props = tree["props"]
+    updates = dict(new_props.get(props.get("id"), {}))
+    if "children" not in updates:
+        children = props.get("children")
+        new_children = with_props(children, new_props)
+        if new_children is not children:
+            updates["children"] = new_children
+    if not updates:
+        return tree
+    return tree | {"props": props | updates}
+
+
+class LazyThread:
+    """
+    A daemon thread that runs the given function, started on first use by
+    :meth:`start` rather than on creation.
+    The Gunicorn master preloads the app and forks its workers from it, and a fork
+    copies no threads, so the app's background threads start lazily, in each
+    worker that needs them, and in the master none.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the thread unless it's running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.target, daemon=True)
+                self._thread.start()
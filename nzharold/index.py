@@ -1,3 +1,5 @@
+import functools
+
 import dash
 import dash_bootstrap_components as dbc
 import flask_login as fl
@@ -5,9 +7,13 @@ from dash import dcc
 from dash_extensions import enrich as dee
 from dash_extensions.enrich import html
 
+import extractors as ex
+import guard as gu
+import helpers as hp
+import memory as mem
 import settings as st
 from app import app
-from pages import main, login, logout, error_404
+from pages import admin, main, login, logout, error_404, reading_list, search
 
 # -------
 # Layout
@@ -17,8 +23,20 @@ app.title = "NZ Harold"
 app.layout = html.Div(
     [
         dcc.Location(id="location", refresh=False),
+        # Data about the logged-in user, delivered with each page by display_page
+        dcc.Store(id="session"),
+        # Reference to the story being read, which is kept on the server
+        dcc.Store(id="story-store"),
+        # Reader settings, kept in the browser; see pages/main.py
+        dcc.Store(
+            id="reader-settings",
+            storage_type="local",
+            data=main.DEFAULT_READER_SETTINGS,
+        ),
         dbc.NavbarSimple(
             children=[
+                dbc.NavItem(dbc.NavLink("Reading list", href="/reading-list")),
+                dbc.NavItem(dbc.NavLink("Search", href="/search")),
                 dbc.NavItem(
                     dbc.NavLink(
                         id="logout",
@@ -39,37 +57,86 @@ app.layout = html.Div(
 )
 
 
-@dash.callback(
+# Set the logout link in the browser, sparing a request to the server
+app.clientside_callback(
+    """
+    function(session) {
+        return session ? `Logout ${session.username}` : null;
+    }
+    """,
     dash.Output("logout", "children"),
-    dash.Input("page-content", "children"),
+    dash.Input("session", "data"),
 )
-def set_logout_link(input1):
-    if fl.current_user.is_authenticated:
-        result = f"Logout {fl.current_user.username}"
-    else:
-        result = None
 
-    return result
+# Apply the font size and dark mode reader settings to every page
+app.clientside_callback(
+    dash.ClientsideFunction(namespace="reader", function_name="applyAppearance"),
+    dash.Output("page-content", "className"),
+    dash.Input("reader-settings", "data"),
+)
+
+
+PAGES = {
+    "admin": admin,
+    "error_404": error_404,
+    "login": login,
+    "logout": logout,
+    "main": main,
+    "reading_list": reading_list,
+    "search": search,
+}
 
 
-@dash.callback(
+@functools.cache
+def get_layout(page: str):
+    """
+    Return the layout of the given page (key of ``PAGES``) as plain values,
+    ready for Dash to send (see :func:`helpers.to_plain`).
+    The page layouts are the same for all users, so build them once per worker.
+    """
+    return hp.to_plain(PAGES[page].layout())
+
+
+@app.callback(
     dee.Output("page-content", "children"),
+    dee.Output("session", "data"),
+    dee.Output("story-store", "data"),
     dee.Input("location", "pathname"),
+    dee.State("reader-settings", "data"),
 )
-def display_page(pathname):
+def display_page(pathname, settings):
     """
-    Display the page corresponding to the given URL.
+    Display the page corresponding to the given URL, along with the story at that
+    URL, if any, and the logged-in user's session data, all in one response.
+    Keep the story in the server-side store for follow-up interactions.
     """
+    store = dash.no_update
     if not fl.current_user.is_authenticated or pathname == "/login":
-        result = login.layout()
+        result = get_layout("login")
     elif pathname == "/logout":
         if fl.current_user.is_authenticated:
             fl.logout_user()
-        result = logout.layout()
+        result = get_layout("logout")
+    elif pathname == "/reading-list":
+        result = get_layout("reading_list")
+    elif pathname == "/search":
+        result = get_layout("search")
+    elif pathname == "/admin":
+        result = get_layout("admin" if gu.is_admin() else "error_404")
+    elif pathname == "/":
+        result = get_layout("main")
+    else:
+        with mem.track("display_page"):
+            props, story = main.get_story_view(ex.from_path(pathname), settings)
+        result = hp.with_props(get_layout("main"), props)
+        store = main.to_store(story)
+
+    if fl.current_user.is_authenticated:
+        session = {"username": fl.current_user.username}
     else:
-        result = main.layout()
+        session = None
 
-    return result
+    return result, session, store
 
 
 if __name__ == "__main__":
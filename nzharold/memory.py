@@ -0,0 +1,231 @@
+"""
+Memory diagnostics of a worker, by which to recycle workers only when their memory
+grows too much rather than after a fixed number of requests.
+"""
+
+import collections
+import contextlib
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+import flask
+
+import guard as gu
+import helpers as hp
+import settings as st
+
+# The (time, RSS, traced bytes) samples of the last few hours
+samples = collections.deque(maxlen=720)
+# Memory of the runs of each tracked context, by name
+calls = collections.defaultdict(
+    lambda: {"calls": 0, "rss_growth": 0, "max_rss_growth": 0, "max_peak": 0}
+)
+_snapshots = {"first": None, "previous": None, "latest": None, "taken_at": 0}
+_calls_lock = threading.Lock()
+_in_flight = 0
+
+
+def get_rss() -> int:
+    """
+    Return the resident set size of this process in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as src:
+            return int(src.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not Linux: fall back to the peak RSS, which macOS reports in bytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_peak_rss() -> int:
+    """
+    Return the peak resident set size of this process in bytes (on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    """
+    Return a snapshot of the traced allocations, minus those of importing and of
+    tracemalloc itself.
+    """
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+    )
+
+
+def sample() -> None:
+    """
+    Sample the RSS and the traced memory, and take an allocation snapshot if the
+    last one is older than ``MEMORY_SNAPSHOT_INTERVAL`` seconds.
+    """
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    samples.append((time.time(), get_rss(), traced))
+
+    if not tracemalloc.is_tracing():
+        return
+    if time.time() - _snapshots["taken_at"] >= st.config.MEMORY_SNAPSHOT_INTERVAL:
+        snapshot = take_snapshot()
+        _snapshots["previous"] = _snapshots["latest"]
+        _snapshots["latest"] = snapshot
+        _snapshots["taken_at"] = time.time()
+        if _snapshots["first"] is None:
+            _snapshots["first"] = snapshot
+
+
+def _run_sampler() -> None:
+    while True:
+        sample()
+        time.sleep(st.config.MEMORY_SAMPLE_INTERVAL)
+
+
+sampler = hp.LazyThread(_run_sampler)
+
+
+def start() -> None:
+    """
+    Start tracing allocations, if ``MEMORY_TRACE_FRAMES`` is positive, and the
+    sampler thread (every ``MEMORY_SAMPLE_INTERVAL`` seconds), unless they've
+    started.
+    Like the sampler, tracing starts in the workers only, on first use.
+    """
+    if st.config.MEMORY_TRACE_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(st.config.MEMORY_TRACE_FRAMES)
+    sampler.start()
+
+
+@contextlib.contextmanager
+def track(name: str):
+    """
+    Attribute to the given name the memory of the code run in this context: the
+    growth in RSS over it and, if tracing allocations, the peak of the traced
+    memory during it over that at its start.
+    Both are exact for a worker with one tracked context at a time; with
+    concurrent ones, each one's measurements include the others' allocations.
+    """
+    global _in_flight
+
+    start()
+    tracing = tracemalloc.is_tracing()
+    with _calls_lock:
+        _in_flight += 1
+        # Don't reset the peak of the contexts already in flight
+        if tracing and _in_flight == 1:
+            tracemalloc.reset_peak()
+    traced = tracemalloc.get_traced_memory()[0] if tracing else 0
+    rss = get_rss()
+    try:
+        yield
+    finally:
+        growth = get_rss() - rss
+        peak = tracemalloc.get_traced_memory()[1] - traced if tracing else 0
+        with _calls_lock:
+            _in_flight -= 1
+            stats = calls[name]
+            stats["calls"] += 1
+            stats["rss_growth"] += growth
+            stats["max_rss_growth"] = max(stats["max_rss_growth"], growth)
+            stats["max_peak"] = max(stats["max_peak"], peak)
+
+
+def diff_snapshots(
+    snapshot: tracemalloc.Snapshot, since: tracemalloc.Snapshot, n: int = 10
+) -> list[dict]:
+    """
+    Return the given number of allocation sites whose traced memory grew the most
+    between the two given snapshots, each as a dictionary with the keys ``"site"``
+    (file and line), ``"size"`` and ``"size_diff"`` (bytes), and ``"count"`` and
+    ``"count_diff"`` (blocks).
+    """
+    result = []
+    for stat in snapshot.compare_to(since, "lineno")[:n]:
+        frame = stat.traceback[0]
+        result.append(
+            {
+                "site": f"{frame.filename}:{frame.lineno}",
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+        )
+    return result
+
+
+def should_recycle() -> bool:
+    """
+    Return ``True`` if this worker's RSS exceeds ``WORKER_MAX_RSS``, if set, so
+    that the worker should be replaced by a fresh one.
+    """
+    return 0 < st.config.WORKER_MAX_RSS < get_rss()
+
+
+def get_report(n_sites: int = 10) -> dict:
+    """
+    Return this worker's memory diagnostics as a dictionary with the keys
+
+    - ``"pid"``, ``"rss"``, ``"peak_rss"``, and ``"max_rss"``, the recycling
+      threshold ``WORKER_MAX_RSS`` (0 if none)
+    - ``"samples"``: list of (time, RSS, traced bytes) samples, oldest first
+    - ``"calls"``: the memory of the tracked contexts by name (see :func:`track`),
+      with the bytes of RSS growth summed and at most, and the bytes of peak
+      traced memory at most
+    - ``"tracing"``: whether allocations are traced, and, if so, ``"traced"`` and
+      ``"traced_peak"`` in bytes, and ``"growth_since_first"`` and
+      ``"growth_since_previous"``: the given number of allocation sites that grew
+      the most since the first and the previous snapshots (see
+      :func:`diff_snapshots`)
+
+    """
+    start()
+    with _calls_lock:
+        call_stats = {name: dict(stats) for name, stats in calls.items()}
+    report = {
+        "pid": os.getpid(),
+        "rss": get_rss(),
+        "peak_rss": get_peak_rss(),
+        "max_rss": st.config.WORKER_MAX_RSS,
+        "samples": list(samples),
+        "calls": call_stats,
+        "tracing": tracemalloc.is_tracing(),
+    }
+    if report["tracing"]:
+        report["traced"], report["traced_peak"] = tracemalloc.get_traced_memory()
+        latest = _snapshots["latest"]
+        for key in ["first", "previous"]:
+            since = _snapshots[key]
+            report[f"growth_since_{key}"] = (
+                diff_snapshots(latest, since, n_sites)
+                if since is not None and since is not latest
+                else []
+            )
+    return report
+
+
+blueprint = flask.Blueprint("memory", __name__)
+
+
+@blueprint.get("/_internal/memory")
+def get_memory():
+    """
+    Return this worker's memory diagnostics (see :func:`get_report`) as JSON, with
+    the number of allocation sites in the query parameter ``n``.
+    Only local requests can (see :func:`guard.is_local_request`).
+    """
+    if not gu.is_local_request():
+        flask.abort(403)
+    return get_report(flask.request.args.get("n", 10, type=int))
+
+
+def init_app(server: flask.Flask) -> None:
+    """
+    Register the memory diagnostics endpoint on the given Flask server.
+    """
+    server.register_blueprint(blueprint)
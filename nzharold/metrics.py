@@ -0,0 +1,385 @@
+"""
+Runtime metrics of the app for the admin dashboard (see ``pages/admin.py``), which
+each worker publishes to ``METRICS_DIR`` and :func:`read_metrics` sums.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+import flask
+from loguru import logger
+
+import helpers as hp
+import settings as st
+
+# Cache hits and misses by (tier, "hits" or "misses")
+counters = collections.Counter()
+# Story views by story key, with the URL and title of each story
+views = collections.Counter()
+view_urls = {}
+view_titles = {}
+# The (host, seconds, success) of the last upstream fetches
+upstream = collections.deque(maxlen=1000)
+started_at = None
+_previous_counters = collections.Counter()
+# Guards the counters above, which the request threads update while the publisher
+# thread copies them
+_lock = threading.Lock()
+_read = {"at": 0.0, "result": None}
+
+
+def record_cache(tier: str, hit: bool) -> None:
+    """
+    Count a hit or a miss of the given cache tier.
+    """
+    with _lock:
+        counters[tier, "hits" if hit else "misses"] += 1
+
+
+def record_view(key: str, url: str, title: str = "") -> None:
+    """
+    Count a view of the story of the given story key, URL, and title, if known.
+    """
+    with _lock:
+        if len(views) > 10_000:
+            # Keep the most viewed stories only
+            kept = dict(views.most_common(1000))
+            views.clear()
+            views.update(kept)
+            for names in [view_urls, view_titles]:
+                for k in [k for k in names if k not in kept]:
+                    del names[k]
+        views[key] += 1
+        view_urls[key] = url
+        if title:
+            view_titles[key] = title
+
+
+def record_upstream(host: str, seconds: float, ok: bool) -> None:
+    """
+    Keep the time and outcome of an upstream fetch from the given host.
+    """
+    with _lock:
+        upstream.append((host, seconds, ok))
+
+
+def get_snapshot(n_stories: int = 100) -> dict:
+    """
+    Return this worker's metrics as a dictionary with the keys
+
+    - ``"pid"``, ``"time"``, and ``"started_at"``
+    - ``"cache"``: the hits and misses by tier since the worker started, and
+      ``"cache_recent"``: those since the previous snapshot
+    - ``"memory_items"``: the number of values in the worker's memory tier
+    - ``"views"``: the given number of most viewed stories as (key, URL, title,
+      views) lists
+    - ``"upstream"``: the last upstream fetches as (host, seconds, success) lists
+    - ``"scheduler"``: the upstream fetch scheduler's stats (see
+      :meth:`scheduler.Scheduler.get_stats`), and ``"breakers"``: the states of
+      the circuit breakers by host
+    - ``"rss"``, ``"peak_rss"``, and ``"max_rss"``: the worker's memory in bytes
+      (see :func:`memory.get_report`)
+
+    """
+    # Imported here, since the cache and the stories record their metrics here
+    import cache as ca
+    import memory as mem
+    import scheduler as sch
+    import stories as sto
+
+    global _previous_counters
+
+    with _lock:
+        current = counters.copy()
+        top_views = [
+            [key, view_urls.get(key, key), view_titles.get(key, ""), n]
+            for key, n in views.most_common(n_stories)
+        ]
+        last_upstream = list(upstream)
+    recent = current - _previous_counters
+    _previous_counters = current
+    return {
+        "pid": os.getpid(),
+        "time": time.time(),
+        "started_at": started_at,
+        "cache": _by_tier(current),
+        "cache_recent": _by_tier(recent),
+        "memory_items": len(ca.local_cache._memory),
+        "views": top_views,
+        "upstream": last_upstream,
+        "scheduler": sch.scheduler.get_stats(),
+        "breakers": {host: b.state for host, b in list(sto.breakers.items())},
+        "rss": mem.get_rss(),
+        "peak_rss": mem.get_peak_rss(),
+        "max_rss": st.config.WORKER_MAX_RSS,
+    }
+
+
+def _by_tier(counts: collections.Counter) -> dict:
+    result = collections.defaultdict(lambda: {"hits": 0, "misses": 0})
+    for (tier, kind), n in counts.items():
+        result[tier][kind] = n
+    return dict(result)
+
+
+def _write_json(path, value) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(value), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def get_tier_sizes() -> dict:
+    """
+    Return the sizes of this node's cache tiers on disk, by tier, as dictionaries
+    with the keys ``"items"`` (number of values or files) and ``"bytes"``.
+    This walks the cache folders, so it takes a while for a large cache.
+    """
+    import archive as ar
+    import cache as ca
+
+    __, n_files, n_bytes = ca.local_cache.size()
+    n_renders, render_bytes = ca.render_files.size()
+    n_stored, stored_bytes = ca.story_store.size()
+    search_bytes = 0
+    for suffix in ["", "-wal"]:
+        path = st.config.SEARCH_DB_PATH.with_name(st.config.SEARCH_DB_PATH.name + suffix)
+        if path.exists():
+            search_bytes += path.stat().st_size
+    archive_paths = ar.archive.paths()
+    return {
+        "disk": {"items": n_files, "bytes": n_bytes},
+        "render_files": {"items": n_renders, "bytes": render_bytes},
+        "story_store": {"items": n_stored, "bytes": stored_bytes},
+        "search_index": {"items": None, "bytes": search_bytes},
+        "archive": {
+            "items": len(archive_paths),
+            "bytes": sum(p.stat().st_size for p in archive_paths if p.exists()),
+        },
+    }
+
+
+def update_tier_sizes(force: bool = False) -> None:
+    """
+    Measure the sizes of the cache tiers into ``METRICS_DIR/tiers.json`` if the
+    last measurement is older than ``METRICS_SIZES_INTERVAL`` seconds or ``force``.
+    """
+    path = st.config.METRICS_DIR / "tiers.json"
+    try:
+        age = time.time() - path.stat().st_mtime
+    except FileNotFoundError:
+        age = float("inf")
+        _write_json(path, {})
+    if not force and age < st.config.METRICS_SIZES_INTERVAL:
+        return
+
+    # Claim the measurement, so that the other workers skip it
+    path.touch()
+    _write_json(path, get_tier_sizes() | {"measured_at": time.time()})
+
+
+def publish() -> None:
+    """
+    Write this worker's snapshot (see :func:`get_snapshot`), drop from its memory
+    the cache values that the node's other workers deleted, and measure the sizes
+    of the cache tiers if they are due.
+    """
+    import cache as ca
+
+    _write_json(st.config.METRICS_DIR / f"{os.getpid()}.json", get_snapshot())
+    ca.local_cache.sync_deletes()
+    update_tier_sizes()
+
+
+def _run_publisher() -> None:
+    global started_at
+
+    started_at = started_at or time.time()
+    while True:
+        try:
+            publish()
+        except Exception as e:
+            logger.error(f"Failed to publish metrics: {e}")
+        time.sleep(st.config.METRICS_INTERVAL)
+
+
+publisher = hp.LazyThread(_run_publisher)
+
+
+def start() -> None:
+    """
+    Start the publisher thread, unless it has started.
+    """
+    publisher.start()
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Return the given percentile (0 to 100) of the given sorted values, or 0 if
+    there are none.
+    """
+    if not values:
+        return 0
+    return values[round(p / 100 * (len(values) - 1))]
+
+
+def aggregate(snapshots: list[dict], n_stories: int = 20) -> dict:
+    """
+    Return the node's metrics summed over the given worker snapshots (see
+    :func:`get_snapshot`), as a dictionary with the keys
+
+    - ``"workers"``: per worker, its ``"pid"``, ``"started_at"``, ``"rss"``,
+      ``"peak_rss"``, ``"max_rss"``, and ``"memory_items"``
+    - ``"cache"``: per tier, the ``"hits"`` and ``"misses"``, and the
+      ``"hit_rate"`` since the workers started and the ``"recent_hit_rate"`` over
+      the last snapshots (``None`` without lookups)
+    - ``"stories"``: the given number of most viewed stories as dictionaries with
+      the keys ``"key"``, ``"url"``, ``"title"``, and ``"views"``
+    - ``"upstream"``: the ``"fetches"`` and ``"failures"`` of the last fetches,
+      and their ``"p50"``, ``"p95"``, ``"p99"``, and ``"max"`` times in seconds
+    - ``"breakers"``: the states of the circuit breakers by host, ``"open"`` if
+      any worker's is
+    - ``"fetches"``: per priority class of upstream fetches, the fetches
+      ``"queued"``, and those of all classes ``"in_flight"``
+
+    """
+    workers = []
+    cache = collections.defaultdict(collections.Counter)
+    stories = {}
+    times = []
+    failures = 0
+    breakers = {}
+    fetches = {"in_flight": 0, "classes": collections.Counter()}
+    for snapshot in snapshots:
+        workers.append(
+            {
+                key: snapshot[key]
+                for key in [
+                    "pid",
+                    "started_at",
+                    "rss",
+                    "peak_rss",
+                    "max_rss",
+                    "memory_items",
+                ]
+            }
+        )
+        for source, prefix in [("cache", ""), ("cache_recent", "recent_")]:
+            for tier, counts in snapshot[source].items():
+                for kind, n in counts.items():
+                    cache[tier][prefix + kind] += n
+        for key, url, title, n in snapshot["views"]:
+            story = stories.setdefault(
+                key, {"key": key, "url": url, "title": title, "views": 0}
+            )
+            story["title"] = story["title"] or title
+            story["views"] += n
+        for __, seconds, ok in snapshot["upstream"]:
+            times.append(seconds)
+            failures += not ok
+        for host, state in snapshot["breakers"].items():
+            if breakers.get(host) != "open":
+                breakers[host] = state
+        fetches["in_flight"] += sum(snapshot["scheduler"]["in_flight"].values())
+        for priority, stats in snapshot["scheduler"]["classes"].items():
+            fetches["classes"][priority] += stats["queued"]
+
+    for counts in cache.values():
+        for prefix in ["", "recent_"]:
+            n = counts[f"{prefix}hits"] + counts[f"{prefix}misses"]
+            counts[f"{prefix}hit_rate"] = counts[f"{prefix}hits"] / n if n else None
+    times.sort()
+    return {
+        "workers": sorted(workers, key=lambda w: w["pid"]),
+        "cache": {tier: dict(counts) for tier, counts in sorted(cache.items())},
+        "stories": sorted(stories.values(), key=lambda s: -s["views"])[:n_stories],
+        "upstream": {
+            "fetches": len(times),
+            "failures": failures,
+            "p50": percentile(times, 50),
+            "p95": percentile(times, 95),
+            "p99": percentile(times, 99),
+            "max": times[-1] if times else 0,
+        },
+        "breakers": breakers,
+        "fetches": {
+            "in_flight": fetches["in_flight"],
+            "queued": dict(fetches["classes"]),
+        },
+    }
+
+
+def read_metrics() -> dict:
+    """
+    Return the node's metrics (see :func:`aggregate`) from the snapshots of its
+    live workers, those written in the last three intervals, with the sizes of the
+    cache tiers under the key ``"sizes"`` and the time they were measured under
+    ``"sizes_measured_at"``.
+    Delete the snapshots of workers gone for an hour.
+    The result is reused for ``METRICS_INTERVAL`` seconds, within which the
+    snapshots don't change.
+    """
+    now = time.time()
+    if _read["result"] is not None and now - _read["at"] < st.config.METRICS_INTERVAL:
+        return _read["result"]
+
+    snapshots = []
+    for path in st.config.METRICS_DIR.glob("[0-9]*.json"):
+        try:
+            age = now - path.stat().st_mtime
+            if age > 3600:
+                path.unlink()
+            elif age <= 3 * st.config.METRICS_INTERVAL:
+                snapshots.append(json.loads(path.read_text(encoding="utf-8")))
+        except (FileNotFoundError, ValueError):
+            continue
+
+    result = aggregate(snapshots)
+    try:
+        sizes = json.loads(
+            (st.config.METRICS_DIR / "tiers.json").read_text(encoding="utf-8")
+        )
+    except (FileNotFoundError, ValueError):
+        sizes = {}
+    result["sizes_measured_at"] = sizes.pop("measured_at", None)
+    result["sizes"] = sizes
+    _read.update(at=now, result=result)
+    return result
+
+
+def clear_read() -> None:
+    """
+    Make the next :func:`read_metrics` read the snapshots afresh.
+    """
+    _read["result"] = None
+
+
+blueprint = flask.Blueprint("metrics", __name__)
+
+
+@blueprint.before_app_request
+def start_publisher():
+    start()
+
+
+@blueprint.get("/_internal/metrics")
+def get_metrics():
+    """
+    Return this node's metrics (see :func:`read_metrics`) as JSON.
+    Only local requests can (see :func:`guard.is_local_request`).
+    """
+    import guard as gu
+
+    if not gu.is_local_request():
+        flask.abort(403)
+    return read_metrics()
+
+
+def init_app(server: flask.Flask) -> None:
+    """
+    Register the metrics publisher and endpoint on the given Flask server.
+    """
+    server.register_blueprint(blueprint)
@@ -0,0 +1,289 @@
+import time
+
+import dash
+from dash import dcc, html
+import dash_bootstrap_components as dbc
+from dash_extensions import enrich as dee
+
+import cache as ca
+import extractors as ex
+import guard as gu
+import metrics as mt
+import scheduler as sch
+import settings as st
+import stories as sto
+from app import app
+from pages import reading_list
+
+TIER_NAMES = {
+    "memory": "Worker memory",
+    "disk": "Node disk",
+    "peer": "Peer nodes",
+    "render_files": "Render files",
+    "story_store": "Story store",
+    "search_index": "Search index",
+    "archive": "Upstream archive",
+}
+
+
+def layout():
+    return dbc.Container(
+        [
+            dcc.Interval(
+                id="admin-interval", interval=st.config.METRICS_INTERVAL * 1000
+            ),
+            dbc.Row(dbc.Col(id="admin-stats"), class_name="mb-4"),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            html.H5("Purge a story"),
+                            dbc.Input(
+                                id="admin-purge-url",
+                                placeholder="Story URL",
+                                class_name="mb-2",
+                            ),
+                            dbc.Button("Purge", id="admin-purge", color="danger"),
+                            html.Div(id="admin-purge-result", className="mt-2"),
+                        ],
+                        md=4,
+                    ),
+                    dbc.Col(
+                        [
+                            html.H5("Warm stories"),
+                            dbc.Textarea(
+                                id="admin-warm-urls",
+                                placeholder="Story URLs, one per line",
+                                rows=3,
+                                class_name="mb-2",
+                            ),
+                            dbc.Button("Warm", id="admin-warm", color="primary"),
+                            dbc.Spinner(
+                                html.Div(id="admin-warm-result", className="mt-2")
+                            ),
+                        ],
+                        md=4,
+                    ),
+                    dbc.Col(
+                        [
+                            html.H5("Compact the cache"),
+                            html.P(
+                                "Delete the expired files of this node's caches.",
+                                className="text-muted",
+                            ),
+                            dbc.Button("Compact", id="admin-compact", color="secondary"),
+                            dbc.Spinner(
+                                html.Div(id="admin-compact-result", className="mt-2")
+                            ),
+                        ],
+                        md=4,
+                    ),
+                ],
+                class_name="mb-4",
+            ),
+        ],
+        class_name="mt-4 mx-5",
+    )
+
+
+def format_bytes(n: int) -> str:
+    return f"{n / 2**20:,.1f} MiB"
+
+
+def format_rate(rate: float | None) -> str:
+    return "–" if rate is None else f"{rate:.1%}"
+
+
+def make_table(header: list[str], rows: list[list]):
+    return dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th(h) for h in header])),
+            html.Tbody([html.Tr([html.Td(cell) for cell in row]) for row in rows]),
+        ],
+        hover=True,
+        size="sm",
+    )
+
+
+def render_stats(metrics: dict) -> list:
+    """
+    Return the dashboard's tables of the given node metrics (see
+    :func:`metrics.read_metrics`).
+    """
+    now = time.time()
+    cache = make_table(
+        ["Tier", "Hits", "Misses", "Hit rate", "Recent hit rate"],
+        [
+            [
+                TIER_NAMES.get(tier, tier),
+                f"{counts['hits']:,}",
+                f"{counts['misses']:,}",
+                format_rate(counts["hit_rate"]),
+                format_rate(counts["recent_hit_rate"]),
+            ]
+            for tier, counts in metrics["cache"].items()
+        ],
+    )
+    n_memory = sum(worker["memory_items"] for worker in metrics["workers"])
+    sizes = make_table(
+        ["Tier", "Items", "Size"],
+        [[TIER_NAMES["memory"], f"{n_memory:,}", "–"]]
+        + [
+            [
+                TIER_NAMES.get(tier, tier),
+                "–" if size["items"] is None else f"{size['items']:,}",
+                format_bytes(size["bytes"]),
+            ]
+            for tier, size in metrics["sizes"].items()
+        ],
+    )
+    u = metrics["upstream"]
+    upstream = make_table(
+        ["Fetches", "Failures", "p50", "p95", "p99", "Max"],
+        [
+            [f"{u['fetches']:,}", f"{u['failures']:,}"]
+            + [f"{u[key] * 1000:,.0f} ms" for key in ["p50", "p95", "p99", "max"]]
+        ],
+    )
+    fetches = make_table(
+        ["In flight"] + [f"Queued ({p})" for p in sch.PRIORITIES],
+        [
+            [metrics["fetches"]["in_flight"]]
+            + [metrics["fetches"]["queued"].get(p, 0) for p in sch.PRIORITIES]
+        ],
+    )
+    workers = make_table(
+        ["Worker", "Up", "RSS", "Peak RSS", "Recycled at"],
+        [
+            [
+                worker["pid"],
+                f"{(now - worker['started_at']) / 3600:.1f} h",
+                format_bytes(worker["rss"]),
+                format_bytes(worker["peak_rss"]),
+                format_bytes(worker["max_rss"]) if worker["max_rss"] else "–",
+            ]
+            for worker in metrics["workers"]
+        ],
+    )
+    stories = make_table(
+        ["Story", "Views"],
+        [
+            [dcc.Link(s["title"] or s["url"], href=ex.to_path(s["url"])), s["views"]]
+            for s in metrics["stories"]
+        ],
+    )
+    open_breakers = [
+        host for host, state in metrics["breakers"].items() if state == "open"
+    ]
+    measured_at = metrics["sizes_measured_at"]
+
+    return [
+        dbc.Alert(
+            f"Circuit breakers open for {', '.join(open_breakers)}", color="warning"
+        )
+        if open_breakers
+        else None,
+        dbc.Row(
+            [
+                dbc.Col([html.H5("Cache hit rates"), cache], lg=6),
+                dbc.Col(
+                    [
+                        html.H5("Cache sizes"),
+                        sizes,
+                        html.P(
+                            f"Measured {(now - measured_at) / 60:.0f} min ago"
+                            if measured_at
+                            else "Not measured yet",
+                            className="text-muted small",
+                        ),
+                    ],
+                    lg=6,
+                ),
+            ]
+        ),
+        dbc.Row(
+            [
+                dbc.Col([html.H5("Upstream latency"), upstream], lg=6),
+                dbc.Col([html.H5("Upstream fetches"), fetches], lg=6),
+            ]
+        ),
+        dbc.Row(
+            [
+                dbc.Col([html.H5("Workers"), workers], lg=6),
+                dbc.Col([html.H5("Most viewed stories"), stories], lg=6),
+            ]
+        ),
+    ]
+
+
+@app.callback(
+    dee.Output("admin-stats", "children"),
+    dee.Input("admin-interval", "n_intervals"),
+)
+def update_stats(n_intervals):
+    if not gu.is_admin():
+        raise dash.exceptions.PreventUpdate
+    return render_stats(mt.read_metrics())
+
+
+@app.callback(
+    dee.Output("admin-purge-result", "children"),
+    dee.Input("admin-purge", "n_clicks"),
+    dee.State("admin-purge-url", "value"),
+    prevent_initial_call=True,
+)
+def purge(n_clicks, url):
+    if not gu.is_admin() or not url:
+        raise dash.exceptions.PreventUpdate
+    if ex.get_extractor(url) is None:
+        return dbc.Alert("Not a story URL of a registered source", color="warning")
+
+    url = sto.normalize_url(url)
+    if sto.purge_story(url):
+        return dbc.Alert(f"Purged {url}", color="success")
+    return dbc.Alert(f"{url} wasn't cached", color="info")
+
+
+@app.callback(
+    dee.Output("admin-warm-result", "children"),
+    dee.Input("admin-warm", "n_clicks"),
+    dee.State("admin-warm-urls", "value"),
+    prevent_initial_call=True,
+)
+def warm(n_clicks, text):
+    if not gu.is_admin():
+        raise dash.exceptions.PreventUpdate
+    urls = reading_list.parse_urls(text or "")
+    if not urls:
+        raise dash.exceptions.PreventUpdate
+
+    # Warm in the background class, so that readers' fetches go first
+    with sch.work("revalidation"):
+        reports = sto.get_stories(urls)
+    n_cached = sum(report["cached"] for report in reports)
+    n_fetched = sum(report["story"] is not None for report in reports) - n_cached
+    failed = [report for report in reports if report["story"] is None]
+    return dbc.Alert(
+        [html.P(f"Fetched {n_fetched}, already cached {n_cached}, failed {len(failed)}")]
+        + [html.P(f"{r['url']}: {r['error']}", className="small mb-0") for r in failed],
+        color="warning" if failed else "success",
+    )
+
+
+@app.callback(
+    dee.Output("admin-compact-result", "children"),
+    dee.Input("admin-compact", "n_clicks"),
+    prevent_initial_call=True,
+)
+def compact(n_clicks):
+    if not gu.is_admin():
+        raise dash.exceptions.PreventUpdate
+    deleted = ca.compact()
+    # Show the sizes after compaction on the next update
+    mt.update_tier_sizes(force=True)
+    mt.clear_read()
+    return dbc.Alert(
+        "Deleted "
+        + ", ".join(f"{n:,} {TIER_NAMES[tier]} files" for tier, n in deleted.items()),
+        color="success",
+    )
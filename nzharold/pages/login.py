@@ -64,6 +64,7 @@ def layout():
     dd.Input("password", "n_submit"),
     dd.State("username", "value"),
     dd.State("password", "value"),
+    prevent_initial_call=True,
 )
 def check_login(n_clicks, n_submit_username, n_submit_password, username, password):
     result = None, False
@@ -97,6 +98,7 @@ def check_login(n_clicks, n_submit_username, n_submit_password, username, passwo
 @dash.callback(
     dd.Output("login-url", "href"),
     dd.Input("is-authenticated", "data"),
+    prevent_initial_call=True,
 )
 def redirect_home(is_authenticated):
     if is_authenticated:
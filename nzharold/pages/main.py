@@ -1,24 +1,95 @@
-import json
-import re
+import concurrent.futures as cf
+import difflib
+import math
+import os
+import urllib.parse as up
 
 import dash
+import flask
+import flask_login as fl
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 from dash_extensions import enrich as dee
-import requests
-from bs4 import BeautifulSoup
-from markdownify import markdownify as md
 
+import cache as ca
+import extractors as ex
+import guard as gu
+import helpers as hp
+import memory as mem
+import metrics as mt
+import rendering as rn
+import scheduler as sch
+import search_index as si
+import settings as st
+import stories as sto
 from app import app
 
+# Threads that prefetch stories in the background; they start on first use
+prefetch_pool = cf.ThreadPoolExecutor(
+    max_workers=st.config.PREFETCH_THREADS, thread_name_prefix="prefetch"
+)
+
+
+# Reader settings, which the browser keeps and applies (see assets/reader.js)
+DEFAULT_READER_SETTINGS = {
+    "images": True,
+    "image_quality": "high",
+    "font_size": "medium",
+    "dark": False,
+}
+# Image widths in pixels of the image quality settings below "high", which uses the
+# original images
+IMAGE_WIDTHS = {"low": 480, "medium": 960}
+
+
+def get_image_src(src: str, quality: str) -> str:
+    """
+    Return the URL of the image at the given URL in the given image quality
+    (``"low"``, ``"medium"``, or ``"high"``), served by the image resizer, if any.
+    """
+    if quality not in IMAGE_WIDTHS or not st.config.IMAGE_RESIZER_URL:
+        return src
+    return st.config.IMAGE_RESIZER_URL.format(
+        url=up.quote(src, safe=""), width=IMAGE_WIDTHS[quality]
+    )
 
-def html_to_markdown(text: str):
-    # Replace all story href URLs with local URLs
-    return dcc.Markdown(md(text.replace('href="https://www.nzherald.co.nz/', 'href="/')))
 
+def apply_reader_settings(content: list, settings: dict | None) -> list:
+    """
+    Return the given rendered story elements, as plain values (see
+    :func:`helpers.to_plain`), with their images dropped or at the image quality of
+    the given reader settings.
+    Dropping the images, but not their captions, shrinks the response and spares
+    the reader the image downloads.
+    Mirrors ``applyToContent`` in ``assets/reader.js``, which applies changed
+    settings in the browser.
+    """
+    settings = DEFAULT_READER_SETTINGS | (settings or {})
+    if settings["images"] and settings["image_quality"] == "high":
+        return content
 
-def html_to_caption(text: str):
-    return dcc.Markdown("_" + text.strip() + "_")
+    result = []
+    for item in content:
+        props = item.get("props", {}) if isinstance(item, dict) else {}
+        if props.get("className") == "story-image":
+            caption = props["children"][-1]
+            if settings["images"]:
+                img = {
+                    "type": "Img",
+                    "namespace": "dash_html_components",
+                    "props": {
+                        "src": get_image_src(
+                            props["data-src"], settings["image_quality"]
+                        ),
+                        "width": "100%",
+                    },
+                }
+                children = [img, caption]
+            else:
+                children = [caption]
+            item = item | {"props": props | {"children": children}}
+        result.append(item)
+    return result
 
 
 def layout():
@@ -28,61 +99,555 @@ def layout():
                 dbc.Col(
                     [
                         html.P(
-                            "Paste any New Zealand Herald URL below to fetch its content:"
+                            "Paste any New Zealand Herald or Newsroom URL below "
+                            "to fetch its content:"
                         ),
                         dbc.Input(id="query-url", type="url"),
                     ]
                 ),
+                class_name="mb-2",
+            ),
+            dbc.Row(
+                dbc.Col(
+                    [
+                        dbc.Switch(
+                            id="live-mode",
+                            label="Live updates, for live blogs and developing stories",
+                            value=False,
+                        ),
+                        dcc.Interval(
+                            id="live-interval",
+                            interval=st.config.LIVE_INTERVAL * 1000,
+                            disabled=True,
+                        ),
+                        # The URL and element hashes of the story being shown
+                        dcc.Store(id="story-version"),
+                    ]
+                ),
+                class_name="mb-2",
+            ),
+            dbc.Row(
+                dbc.Col(
+                    # The controls remember their values in the browser, as does
+                    # the reader-settings store that they set
+                    html.Details(
+                        [
+                            html.Summary("Reader settings"),
+                            dbc.Stack(
+                                [
+                                    dbc.Switch(
+                                        id="reader-images",
+                                        label="Images",
+                                        value=True,
+                                        persistence=True,
+                                        persistence_type="local",
+                                        class_name="mb-0",
+                                    ),
+                                    dbc.Select(
+                                        id="reader-image-quality",
+                                        options=[
+                                            {
+                                                "label": "Low quality images",
+                                                "value": "low",
+                                            },
+                                            {
+                                                "label": "Medium quality images",
+                                                "value": "medium",
+                                            },
+                                            {
+                                                "label": "High quality images",
+                                                "value": "high",
+                                            },
+                                        ],
+                                        value="high",
+                                        disabled=not st.config.IMAGE_RESIZER_URL,
+                                        persistence=True,
+                                        persistence_type="local",
+                                        size="sm",
+                                        style={"width": "auto"},
+                                    ),
+                                    dbc.Select(
+                                        id="reader-font-size",
+                                        options=[
+                                            {"label": "Small text", "value": "small"},
+                                            {"label": "Medium text", "value": "medium"},
+                                            {"label": "Large text", "value": "large"},
+                                        ],
+                                        value="medium",
+                                        persistence=True,
+                                        persistence_type="local",
+                                        size="sm",
+                                        style={"width": "auto"},
+                                    ),
+                                    dbc.Switch(
+                                        id="reader-dark",
+                                        label="Dark mode",
+                                        value=False,
+                                        persistence=True,
+                                        persistence_type="local",
+                                        class_name="mb-0",
+                                    ),
+                                ],
+                                direction="horizontal",
+                                gap=3,
+                                class_name="flex-wrap mt-2",
+                            ),
+                            dcc.Store(
+                                id="image-resizer",
+                                data={
+                                    "url": st.config.IMAGE_RESIZER_URL,
+                                    "widths": IMAGE_WIDTHS,
+                                },
+                            ),
+                        ]
+                    )
+                ),
                 class_name="mb-4",
             ),
             dbc.Row(
-                dbc.Spinner(dbc.Col(id="story-content"), spinner_class_name="mt-5"),
+                dbc.Col(
+                    [
+                        # Spin while a story loads, but not during live updates
+                        dbc.Spinner(
+                            html.Div(id="story-loading"), spinner_class_name="mt-5"
+                        ),
+                        html.Div(id="story-content"),
+                        dbc.Pagination(
+                            id="story-page",
+                            max_value=1,
+                            active_page=1,
+                            fully_expanded=False,
+                            class_name="d-none",
+                        ),
+                    ]
+                ),
             ),
         ],
         class_name="mt-4 mx-5",
     )
 
 
+def get_rendered_story(url: str) -> tuple[dict | None, dict | None]:
+    """
+    Return the pair (story, rendered story) for the story at the given normalized
+    URL, where the story is the output of :func:`stories.get_story`, and the
+    rendered story is the output of :func:`rendering.render`.
+
+    Return ``(None, None)`` if the story can't be fetched or parsed.
+    """
+    story = sto.get_story(url)
+    if story is None:
+        return None, None
+
+    # Stories fetched from upstream come rendered (see stories.fetch_story), but
+    # the rendering can be missing from the cache
+    rendered = sto.get_cached_render(story)
+    if rendered is None:
+        rendered = rn.render(story)
+        sto.cache_render(story, rendered)
+
+    return story, rendered
+
+
+def view_story(
+    url: str,
+    content: list,
+    hashes: list[str],
+    page: int,
+    n_pages: int,
+    settings: dict | None = None,
+) -> dict:
+    """
+    Return the props, keyed by component ID, that show a page of a story on the
+    main page (see :func:`helpers.with_props`), given the story's normalized URL,
+    the rendered title and elements of the page as plain values, the hashes of
+    those elements, the page number, the story's number of pages, and the reader
+    settings.
+    """
+    return {
+        "story-content": {"children": apply_reader_settings(content, settings)},
+        "story-version": {
+            "data": {
+                "url": url,
+                "start": (page - 1) * st.config.STORY_PAGE_SIZE,
+                "hashes": hashes,
+            }
+        },
+        "story-page": {
+            "max_value": n_pages,
+            "active_page": page,
+            "class_name": "mt-3" if n_pages > 1 else "d-none",
+        },
+    }
+
+
+def count_pages(story: dict) -> int:
+    return max(1, math.ceil(len(story["elements"]) / st.config.STORY_PAGE_SIZE))
+
+
+def get_story_view(
+    query_url: str, settings: dict | None = None
+) -> tuple[dict, dict | None]:
+    """
+    Return the pair (props, story), where the props show the first page of the
+    story at the given URL on the main page with the given reader settings (see
+    :func:`view_story`) and the story is the output of :func:`stories.get_story`.
+    If the URL is of no registered source (see :mod:`extractors`) or can't be
+    parsed, the client has fetched too many stories lately, or upstream is
+    unavailable, then the props show a message and the story is ``None``.
+    """
+    message = "Sorry, can't parse that URL"
+    extractor = ex.get_extractor(query_url)
+    if extractor is not None:
+        url = extractor.normalize_url(query_url)
+        story = None
+        if not gu.allow_story_fetch(url):
+            message = "You've fetched many stories lately; please try again shortly"
+        else:
+            try:
+                story, rendered = get_rendered_story(url)
+            except sto.UpstreamUnavailable:
+                message = (
+                    "The news site is slow to respond right now; "
+                    "please try again shortly"
+                )
+        if story is not None:
+            mt.record_view(sto.make_story_key(story), url, story["title"])
+            size = st.config.STORY_PAGE_SIZE
+            props = view_story(
+                url,
+                rendered["content"][: size + 1],
+                rendered["hashes"][:size],
+                1,
+                count_pages(story),
+                settings,
+            )
+            return props, story
+
+    props = {
+        "story-content": {"children": html.P(message)},
+        "story-version": {"data": None},
+        "story-page": {"max_value": 1, "active_page": 1, "class_name": "d-none"},
+    }
+    return props, None
+
+
+def to_store(story: dict | None):
+    """
+    Return the given story wrapped to be kept in the server-side store, under a
+    key per story, so that the browser holds only that key.
+    """
+    if story is None:
+        return None
+    return dee.Serverside(story, key=sto.get_store_key(story["url"]))
+
+
+# The outputs that show a page of a story, in the order of the props of view_story()
+VIEW_OUTPUTS = [
+    ("story-content", "children"),
+    ("story-version", "data"),
+    ("story-page", "max_value"),
+    ("story-page", "active_page"),
+    ("story-page", "class_name"),
+]
+
+
+def unpack_view(props: dict) -> tuple:
+    return tuple(props[id_][prop] for id_, prop in VIEW_OUTPUTS)
+
+
 @app.callback(
-    dee.Output("story-content", "children"),
+    *[dee.Output(id_, prop) for id_, prop in VIEW_OUTPUTS],
+    dee.Output("story-store", "data", allow_duplicate=True),
+    dee.Output("story-loading", "children"),
     dee.Input("query-url", "value"),
-    dee.State("location", "pathname"),
+    dee.State("reader-settings", "data"),
+    prevent_initial_call=True,
 )
-def update_story(query_url, pathname):
+def update_story(query_url, settings):
+    # The story at the page's path comes with the page, via index.display_page
     if not query_url:
-        if pathname == "/":
+        raise dash.exceptions.PreventUpdate
+
+    with mem.track("update_story"):
+        props, story = get_story_view(query_url, settings)
+        return *unpack_view(props), to_store(story), None
+
+
+@app.callback(
+    *[dee.Output(id_, prop, allow_duplicate=True) for id_, prop in VIEW_OUTPUTS],
+    dee.Input("story-page", "active_page"),
+    dee.State("story-store", "data"),
+    dee.State("story-version", "data"),
+    dee.State("reader-settings", "data"),
+    prevent_initial_call=True,
+)
+def change_story_page(page, story, version, settings):
+    """
+    Show the given page of the story, rendered from the server-side store.
+    """
+    if story is None:
+        if not version:
             raise dash.exceptions.PreventUpdate
-        else:
-            # Build query URL from pathname
-            query_url = f"https://nzherald.co.nz{pathname}"
-
-    content = html.P("Sorry, can't parse that URL")
-    if "nzherald.co.nz" in query_url:
-        r = requests.get(query_url)
-
-        if r.status_code == 200:
-            soup = BeautifulSoup(r.text, "html.parser")
-            s = (
-                soup.find(id="fusion-metadata")
-                .contents[0]
-                .split("Fusion.globalContent=")[1]
-                .split(";Fusion.globalContentConfig")[0]
-                .replace(":false", ':"False"')
-                .replace(":true", ':"True"')
-            )
-            content = [html.H3(soup.title.contents)]
-            story = json.loads(s)
-            if "elements" in story:
-                for el in story["elements"]:
-                    if el["type"] == "text":
-                        content.append(html_to_markdown(el["content"]))
-                    elif el["type"] == "image":
-                        content.append(
-                            html.Img(
-                                src=el["additional_properties"]["originalUrl"],
-                                width="100%",
-                            )
-                        )
-                        content.append(html_to_caption(el["caption"]))
-
-    return content
+        # The stored story expired
+        try:
+            story = sto.get_story(version["url"])
+        except sto.UpstreamUnavailable:
+            story = None
+        if story is None:
+            raise dash.exceptions.PreventUpdate
+
+    size = st.config.STORY_PAGE_SIZE
+    elements = story["elements"][(page - 1) * size : page * size]
+    content = [html.H3(story["title"])] + [rn.render_element(el) for el in elements]
+    props = view_story(
+        story["url"],
+        hp.to_plain(content),
+        rn.hash_elements({"elements": elements}),
+        page,
+        count_pages(story),
+        settings,
+    )
+    return unpack_view(props)
+
+
+# Apply the reader settings in the browser, sparing requests to the server
+app.clientside_callback(
+    """
+    function(images, imageQuality, fontSize, dark) {
+        return {
+            images: images,
+            image_quality: imageQuality,
+            font_size: fontSize,
+            dark: dark,
+        };
+    }
+    """,
+    dee.Output("reader-settings", "data"),
+    dee.Input("reader-images", "value"),
+    dee.Input("reader-image-quality", "value"),
+    dee.Input("reader-font-size", "value"),
+    dee.Input("reader-dark", "value"),
+    prevent_initial_call=True,
+)
+
+app.clientside_callback(
+    dash.ClientsideFunction(namespace="reader", function_name="applyToContent"),
+    dee.Output("story-content", "children", allow_duplicate=True),
+    dee.Input("reader-settings", "data"),
+    dee.State("story-content", "children"),
+    dee.State("image-resizer", "data"),
+    prevent_initial_call=True,
+)
+
+app.clientside_callback(
+    """
+    function(live) {
+        return !live;
+    }
+    """,
+    dee.Output("live-interval", "disabled"),
+    dee.Input("live-mode", "value"),
+)
+
+
+@app.callback(
+    dee.Output("story-content", "children", allow_duplicate=True),
+    dee.Output("story-version", "data", allow_duplicate=True),
+    dee.Output("story-store", "data", allow_duplicate=True),
+    dee.Input("live-interval", "n_intervals"),
+    dee.State("story-version", "data"),
+    dee.State("reader-settings", "data"),
+    prevent_initial_call=True,
+)
+def update_live_story(n_intervals, version, settings):
+    """
+    Refresh the story being shown, fetching it from upstream at most once per live
+    interval, and patch in only the elements of the page being shown that changed
+    since the given version.
+    """
+    if not version:
+        raise dash.exceptions.PreventUpdate
+
+    with mem.track("update_live_story"), sch.work("revalidation"):
+        story = sto.refresh_story(version["url"], max_age=st.config.LIVE_INTERVAL)
+    if story is None:
+        raise dash.exceptions.PreventUpdate
+
+    start = version["start"]
+    elements = story["elements"][start : start + st.config.STORY_PAGE_SIZE]
+    hashes = rn.hash_elements({"elements": elements})
+    if hashes == version["hashes"]:
+        raise dash.exceptions.PreventUpdate
+
+    patch = dash.Patch()
+    matcher = difflib.SequenceMatcher(a=version["hashes"], b=hashes, autojunk=False)
+    # Edit from the end, so that the indices of the earlier edits still hold, and
+    # offset the indices by one for the title
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            continue
+        for i in reversed(range(i1, i2)):
+            del patch[i + 1]
+        for j in reversed(range(j1, j2)):
+            content = [hp.to_plain(rn.render_element(elements[j]))]
+            patch.insert(i1 + 1, apply_reader_settings(content, settings)[0])
+
+    return patch, version | {"hashes": hashes}, to_store(story)
+
+
+def prefetch(url: str, user: str) -> None:
+    """
+    Fetch and render the story at the given normalized URL, in the prefetch class
+    of upstream fetches on behalf of the given user (see :mod:`scheduler`), unless
+    a reader's fetch of the story cancels it.
+    """
+    with sch.work("prefetch", user):
+        try:
+            get_rendered_story(url)
+        except sto.UpstreamUnavailable:
+            pass
+
+
+@app.server.route("/_prefetch", methods=["POST"])
+def prefetch_story():
+    """
+    Fetch and render the story at the app path in the query parameter ``path`` (see
+    :func:`extractors.to_path`) in the background, so that it's cached by the time
+    the reader follows their link to it.
+    Only logged-in readers can prefetch, within a budget apart from their own
+    fetches (see :func:`guard.allow_prefetch`).
+    """
+    if not fl.current_user.is_authenticated:
+        flask.abort(401)
+
+    path = flask.request.args.get("path", "")
+    if not path.startswith("/") or path.startswith("//"):
+        flask.abort(400)
+
+    query_url = ex.from_path(path)
+    if sto.get_cached_story(query_url) is None and gu.allow_prefetch():
+        prefetch_pool.submit(prefetch, query_url, sch.get_requester())
+
+    return "", 202
+
+
+@app.server.get("/story/<path:path>.json")
+def get_story_json(path: str):
+    """
+    Return the rendered story (see :func:`rendering.render`) at the given NZ Herald
+    path, minus its trailing slash, as JSON, e.g. ``/story/nz/a-story/ABC123.json``
+    for the story ``/nz/a-story/ABC123/``.
+    Send it from this node's render files in the content coding that the client
+    accepts best, with no serialisation or compression per request; under Gunicorn,
+    the file goes to the socket by ``sendfile``.
+    Only logged-in readers can fetch stories.
+    """
+    if not fl.current_user.is_authenticated:
+        flask.abort(401)
+
+    url = sto.normalize_url(f"https://nzherald.co.nz/{path}/")
+    key = sto.get_story_key(url)
+    mt.record_view(key, url)
+    accept_encodings = flask.request.accept_encodings
+    found = ca.render_files.find(key, accept_encodings)
+    if found is None:
+        if not gu.allow_story_fetch(url):
+            flask.abort(429)
+        try:
+            story, rendered = get_rendered_story(url)
+        except sto.UpstreamUnavailable:
+            flask.abort(503)
+        if story is None:
+            flask.abort(404)
+        # The rendering can come from the cache of a peer node or from before this
+        # node wrote render files
+        found = ca.render_files.find(key, accept_encodings)
+        if found is None:
+            ca.render_files.set(key, rendered)
+            found = ca.render_files.find(key, accept_encodings)
+
+    file_path, encoding = found
+    response = flask.send_file(file_path, mimetype="application/json", max_age=0)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def load_recent_stories(n: int) -> int:
+    """
+    Load the given number of most recently fetched stories and their renders from
+    this node's cache into memory and return the number of stories loaded.
+    A preloading Gunicorn master calls this before forking its workers, so that
+    they start with the stories most likely to be read next in memory.
+    Only read the local cache, since the master mustn't open connections that its
+    workers would share.
+    """
+    n_loaded = 0
+    for url in si.recent_urls(n):
+        key = sto.get_story_key(url, cache=ca.local_cache)
+        story = ca.local_cache.get(f"article:{key}")
+        if story is not None:
+            ca.local_cache.get(f"render:{sto.get_content_hash(story)}")
+            n_loaded += 1
+    return n_loaded
+
+
+def warm_stories(n: int) -> int:
+    """
+    Fetch from upstream those of the given number of most recently fetched stories
+    that aren't freshly cached, in the revalidation class of upstream fetches (see
+    :mod:`scheduler`), render those not rendered, and return the number of stories
+    now cached.
+    """
+    n_warm = 0
+    with sch.work("revalidation"):
+        for url in si.recent_urls(n):
+            try:
+                story, __ = get_rendered_story(url)
+            except sto.FetchCancelled:
+                # A reader is fetching it
+                continue
+            except sto.UpstreamUnavailable:
+                break
+            n_warm += story is not None
+    return n_warm
+
+
+@app.server.get("/_internal/health")
+def get_health():
+    """
+    Return this worker's process ID and its Gunicorn master's as JSON, by which
+    ``fab reload-gunicorn`` tells when the workers of a new master are serving.
+    """
+    return {"pid": os.getpid(), "master": os.getppid()}
+
+
+@app.server.post("/_internal/warm")
+def warm():
+    """
+    Warm the cache with the most recently fetched stories (see
+    :func:`warm_stories`) and return the number of stories cached as JSON.
+    Only local requests can (see :func:`guard.is_local_request`).
+    """
+    if not gu.is_local_request():
+        flask.abort(403)
+    n = flask.request.args.get("n", st.config.WARM_STORIES, type=int)
+    return {"warmed": warm_stories(n)}
+
+
+@app.server.get("/_internal/upstream")
+def get_upstream_stats():
+    """
+    Return this worker's upstream fetch scheduler stats (see
+    :meth:`scheduler.Scheduler.get_stats`) and the states of its circuit breakers
+    by host as JSON.
+    Only local requests can (see :func:`guard.is_local_request`).
+    """
+    if not gu.is_local_request():
+        flask.abort(403)
+    return sch.scheduler.get_stats() | {
+        "pid": os.getpid(),
+        "breakers": {host: b.state for host, b in sto.breakers.items()},
+    }
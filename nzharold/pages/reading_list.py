@@ -0,0 +1,133 @@
+import base64
+import time
+
+import dash
+from dash import dcc, html
+import dash_bootstrap_components as dbc
+from dash_extensions import enrich as dee
+
+import extractors as ex
+import guard as gu
+import stories as sto
+from app import app
+
+
+def layout():
+    return dbc.Container(
+        [
+            dbc.Row(
+                dbc.Col(
+                    [
+                        html.P(
+                            "Paste New Zealand Herald or Newsroom URLs below, one "
+                            "per line, or upload a text file of them, to fetch them "
+                            "all at once:"
+                        ),
+                        dbc.Textarea(id="reading-list-urls", rows=6, class_name="mb-2"),
+                        dcc.Upload(
+                            dbc.Button("Upload URLs", color="secondary", outline=True),
+                            id="reading-list-upload",
+                            accept=".txt,.csv,text/plain",
+                            className="d-inline-block me-2",
+                        ),
+                        dbc.Button("Fetch", id="reading-list-fetch", color="primary"),
+                    ]
+                ),
+                class_name="mb-4",
+            ),
+            dbc.Row(
+                dbc.Spinner(
+                    dbc.Col(id="reading-list-content"), spinner_class_name="mt-5"
+                ),
+            ),
+        ],
+        class_name="mt-4 mx-5",
+    )
+
+
+def parse_urls(text: str) -> list[str]:
+    """
+    Return the story URLs of the registered sources (see :mod:`extractors`) in the
+    given text, one per line or comma-separated.
+    """
+    return [
+        token
+        for token in text.replace(",", "\n").split()
+        if ex.get_extractor(token) is not None
+    ]
+
+
+def render_report(report: dict):
+    story = report["story"]
+    if story is not None:
+        title = dcc.Link(story["title"], href=ex.to_path(report["url"]))
+        status = "cached" if report["cached"] else "fetched"
+    else:
+        title = report["url"]
+        status = report["error"]
+
+    return html.Tr(
+        [
+            html.Td(title),
+            html.Td(status),
+            html.Td(f"{report['time']:.2f} s", className="text-end"),
+        ]
+    )
+
+
+@app.callback(
+    dee.Output("reading-list-urls", "value"),
+    dee.Input("reading-list-upload", "contents"),
+    dee.State("reading-list-urls", "value"),
+    prevent_initial_call=True,
+)
+def add_uploaded_urls(contents, text):
+    # Contents are a data URL of the form "data:<type>;base64,<data>"
+    data = base64.b64decode(contents.split(",", 1)[1]).decode("utf-8", "replace")
+    return "\n".join(parse_urls((text or "") + "\n" + data))
+
+
+@app.callback(
+    dee.Output("reading-list-content", "children"),
+    dee.Input("reading-list-fetch", "n_clicks"),
+    dee.State("reading-list-urls", "value"),
+    prevent_initial_call=True,
+)
+def fetch_reading_list(n_clicks, text):
+    urls = parse_urls(text or "")
+    if not urls:
+        raise dash.exceptions.PreventUpdate
+
+    # Fetch only the stories that the rate limits allow
+    urls = list(dict.fromkeys(sto.normalize_url(url) for url in urls))
+    t = time.perf_counter()
+    allowed = [url for url in urls if gu.allow_story_fetch(url)]
+    reports = {report["url"]: report for report in sto.get_stories(allowed)}
+    reports = [
+        reports.get(url)
+        or {
+            "url": url,
+            "story": None,
+            "error": "Fetched too many stories lately; try again shortly",
+            "cached": False,
+            "time": 0,
+        }
+        for url in urls
+    ]
+    t = time.perf_counter() - t
+    n_ok = sum(report["story"] is not None for report in reports)
+
+    return [
+        html.P(
+            f"Got {n_ok} of {len(reports)} stories in {t:.2f} s",
+            className="text-muted",
+        ),
+        dbc.Table(
+            [
+                html.Thead(html.Tr([html.Th("Story"), html.Th("Status"), html.Th()])),
+                html.Tbody([render_report(report) for report in reports]),
+            ],
+            hover=True,
+            size="sm",
+        ),
+    ]
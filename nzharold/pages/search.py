@@ -0,0 +1,79 @@
+import math
+
+import dash
+from dash import dcc, html
+import dash_bootstrap_components as dbc
+from dash_extensions import enrich as dee
+
+import search_index as si
+from app import app
+
+PER_PAGE = 10
+
+
+def layout():
+    return dbc.Container(
+        [
+            dbc.Row(
+                dbc.Col(
+                    [
+                        html.P("Search the stories you've read:"),
+                        dbc.Input(id="search-query", type="search", debounce=True),
+                    ]
+                ),
+                class_name="mb-4",
+            ),
+            dbc.Row(dbc.Col(id="search-results")),
+            dbc.Row(
+                dbc.Col(
+                    dbc.Pagination(
+                        id="search-page",
+                        max_value=1,
+                        active_page=1,
+                        fully_expanded=False,
+                        class_name="d-none",
+                    )
+                ),
+            ),
+        ],
+        class_name="mt-4 mx-5",
+    )
+
+
+def render_result(result: dict):
+    return html.Div(
+        [
+            html.H5(dcc.Link(result["title"], href=result["path"])),
+            dcc.Markdown(result["snippet"]),
+        ],
+        className="mb-3",
+    )
+
+
+@app.callback(
+    dee.Output("search-results", "children"),
+    dee.Output("search-page", "max_value"),
+    dee.Output("search-page", "class_name"),
+    dee.Output("search-page", "active_page"),
+    dee.Input("search-query", "value"),
+    dee.Input("search-page", "active_page"),
+    prevent_initial_call=True,
+)
+def update_search_results(query, page):
+    if not query:
+        raise dash.exceptions.PreventUpdate
+
+    # Start from the first page whenever the query changes
+    if dash.ctx.triggered_id == "search-query":
+        page = 1
+
+    page = page or 1
+    results, total = si.search(query, page=page, per_page=PER_PAGE)
+    if not results:
+        return html.P("No stories found"), 1, "d-none", 1
+
+    n_pages = math.ceil(total / PER_PAGE)
+    content = [html.P(f"{total} stories found", className="text-muted")]
+    content.extend(render_result(r) for r in results)
+
+    return content, n_pages, "" if n_pages > 1 else "d-none", page
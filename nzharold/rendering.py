@@ -0,0 +1,72 @@
+"""
+Functions to render parsed stories (output of :func:`stories.parse_story`) as Dash
+components.
+
+They don't depend on the app, so that the story parsing processes can render
+stories too (see :func:`stories.parse_and_render`).
+"""
+
+import json
+
+from dash import dcc, html
+
+import cache as ca
+import helpers as hp
+
+
+def html_to_markdown(text: str):
+    from markdownify import markdownify as md
+
+    # Replace all story href URLs with local URLs
+    return dcc.Markdown(md(text.replace('href="https://www.nzherald.co.nz/', 'href="/')))
+
+
+def html_to_caption(text: str):
+    return dcc.Markdown("_" + text.strip() + "_")
+
+
+def render_element(el: dict):
+    """
+    Render the given element of a parsed story as one Dash component.
+    """
+    if el["type"] == "text":
+        return html_to_markdown(el["content"])
+    else:
+        # Keep the original image URL, from which to apply the reader settings
+        return html.Div(
+            [html.Img(src=el["src"], width="100%"), html_to_caption(el["caption"])],
+            className="story-image",
+            **{"data-src": el["src"]},
+        )
+
+
+def render_story(story: dict) -> list:
+    """
+    Render the given parsed story as a list of Dash components: its title followed
+    by one component per element.
+    """
+    return [html.H3(story["title"])] + [render_element(el) for el in story["elements"]]
+
+
+def hash_elements(story: dict) -> list[str]:
+    """
+    Return short hashes of the elements of the given parsed story, by which to tell
+    which elements changed when the story changes.
+    """
+    return [ca.hash_key(json.dumps(el, sort_keys=True))[:12] for el in story["elements"]]
+
+
+def render(story: dict) -> dict:
+    """
+    Return the rendered story of the given parsed story, which is a dictionary
+    with the keys
+
+    - ``"content"``: the output of :func:`render_story` as plain values (see
+      :func:`helpers.to_plain`)
+    - ``"hashes"``: the output of :func:`hash_elements`
+
+    """
+    return {
+        "content": hp.to_plain(render_story(story)),
+        "hashes": hash_elements(story),
+    }
@@ -0,0 +1,250 @@
+"""
+A scheduler of a worker's upstream fetches, by which readers waiting on a story
+go ahead of background work.
+
+Each fetch belongs to a priority class, in order: ``"interactive"``, the fetches
+that readers wait on, ``"revalidation"``, the refreshes of live stories and
+warming of the cache, and ``"prefetch"``, the fetches of stories that readers may
+read next.
+Code run in a :func:`work` context fetches in that context's class, and other code
+in the interactive class.
+
+Each upstream host has a budget of concurrent fetches, shared by the classes,
+of which background classes may use all but ``UPSTREAM_INTERACTIVE_RESERVE``.
+A fetch over budget queues, and when a slot frees up, the queued fetch of the
+highest class goes next, taking turns between the users who queued fetches of
+that class, so that one reader's reading list doesn't hold up the others.
+An interactive fetch of a story cancels the queued background fetches of it.
+
+:meth:`Scheduler.get_stats` returns the queue depths and wait times per class.
+"""
+
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+import settings as st
+
+PRIORITIES = ("interactive", "revalidation", "prefetch")
+
+
+class QueueTimeout(Exception):
+    """
+    Raised when a fetch waited for a slot longer than it may.
+    """
+
+
+class Cancelled(Exception):
+    """
+    Raised when a queued background fetch is cancelled by an interactive fetch of
+    the same story.
+    """
+
+
+class Ticket:
+    """
+    A fetch's place in the queue of its host.
+    """
+
+    def __init__(self, url: str, host: str, priority: str, user: str):
+        self.url = url
+        self.host = host
+        self.priority = priority
+        self.user = user
+        self.queued_at = time.monotonic()
+        self.state = "queued"
+
+
+class Scheduler:
+    """
+    Admit fetches to each host up to the host's budget of concurrent fetches, in
+    order of priority class and, within a class, taking turns between users, and
+    keep ``reserve`` slots of each host for interactive fetches.
+    Keep the last ``window`` waits per class for their percentiles.
+    """
+
+    def __init__(self, reserve: int = 1, window: int = 1000):
+        self.reserve = reserve
+        self._cond = threading.Condition()
+        # Host -> priority -> user -> queued tickets, with users in turn order
+        self._queues = collections.defaultdict(
+            lambda: {p: collections.OrderedDict() for p in PRIORITIES}
+        )
+        self._in_flight = collections.Counter()
+        self._stats = {
+            p: {
+                "admitted": 0,
+                "timed_out": 0,
+                "cancelled": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+                "waits": collections.deque(maxlen=window),
+            }
+            for p in PRIORITIES
+        }
+
+    def _head(self, host: str) -> Ticket | None:
+        """
+        Return the next ticket to admit to the given host, if any.
+        """
+        for priority in PRIORITIES:
+            users = self._queues[host][priority]
+            if users:
+                return next(iter(users.values()))[0]
+        return None
+
+    def _remove(self, ticket: Ticket) -> None:
+        users = self._queues[ticket.host][ticket.priority]
+        tickets = users[ticket.user]
+        tickets.remove(ticket)
+        if not tickets:
+            del users[ticket.user]
+
+    def _cancel_background(self, host: str, url: str) -> None:
+        for priority in PRIORITIES[1:]:
+            for tickets in list(self._queues[host][priority].values()):
+                for ticket in [t for t in tickets if t.url == url]:
+                    self._remove(ticket)
+                    ticket.state = "cancelled"
+                    self._stats[priority]["cancelled"] += 1
+
+    def acquire(
+        self, url: str, host: str, priority: str, user: str, budget: int, wait: float
+    ) -> Ticket:
+        """
+        Wait for a slot for a fetch of the given story URL from the given host, in
+        the given priority class, on behalf of the given user, given the host's
+        budget, and return its ticket, which must be released.
+        Raise a :class:`QueueTimeout` if no slot comes up in ``wait`` seconds, or
+        a :class:`Cancelled` if the fetch is cancelled meanwhile.
+        """
+        ticket = Ticket(url, host, priority, user)
+        limit = budget if priority == "interactive" else max(1, budget - self.reserve)
+        deadline = ticket.queued_at + wait
+        with self._cond:
+            if priority == "interactive":
+                self._cancel_background(host, url)
+                self._cond.notify_all()
+            self._queues[host][priority].setdefault(user, collections.deque())
+            self._queues[host][priority][user].append(ticket)
+
+            while True:
+                if ticket.state == "cancelled":
+                    raise Cancelled(f"Fetch of {url} cancelled by a reader's fetch")
+                if self._head(host) is ticket and self._in_flight[host] < limit:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self._stats[priority]["timed_out"] += 1
+                    # The next ticket may go now
+                    self._cond.notify_all()
+                    raise QueueTimeout(f"No upstream slot for {host} in {wait} s")
+                self._cond.wait(remaining)
+
+            self._remove(ticket)
+            users = self._queues[host][priority]
+            if user in users:
+                # The user's next fetch goes after the other users' fetches
+                users.move_to_end(user)
+            self._in_flight[host] += 1
+            ticket.state = "admitted"
+            waited = time.monotonic() - ticket.queued_at
+            stats = self._stats[priority]
+            stats["admitted"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            stats["waits"].append(waited)
+            # The ticket behind this one may fit in the budget too
+            self._cond.notify_all()
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Free the slot of the given admitted ticket.
+        """
+        with self._cond:
+            self._in_flight[ticket.host] -= 1
+            ticket.state = "done"
+            self._cond.notify_all()
+
+    def get_stats(self) -> dict:
+        """
+        Return the scheduler's state as a dictionary with the keys
+
+        - ``"in_flight"``: the number of fetches in flight by host
+        - ``"classes"``: per priority class, a dictionary with the current
+          ``"queued"`` fetches, the numbers of fetches ``"admitted"``,
+          ``"timed_out"``, and ``"cancelled"``, and the ``"wait_mean"``,
+          ``"wait_p50"``, ``"wait_p95"``, and ``"wait_max"`` in seconds, the
+          percentiles over the last waits
+
+        """
+        with self._cond:
+            result = {"in_flight": dict(self._in_flight), "classes": {}}
+            for priority, stats in self._stats.items():
+                waits = sorted(stats["waits"])
+                queued = sum(
+                    len(tickets)
+                    for queues in self._queues.values()
+                    for tickets in queues[priority].values()
+                )
+                result["classes"][priority] = {
+                    "queued": queued,
+                    "admitted": stats["admitted"],
+                    "timed_out": stats["timed_out"],
+                    "cancelled": stats["cancelled"],
+                    "wait_mean": stats["wait_total"] / max(stats["admitted"], 1),
+                    "wait_p50": waits[len(waits) // 2] if waits else 0,
+                    "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0,
+                    "wait_max": stats["wait_max"],
+                }
+        return result
+
+
+scheduler = Scheduler(reserve=st.config.UPSTREAM_INTERACTIVE_RESERVE)
+# The priority class and user of the upstream fetches of the current context
+_work = contextvars.ContextVar("upstream_work", default=("interactive", None))
+
+
+def get_requester() -> str:
+    """
+    Return the ID of the user of the current request, if logged in, or else the
+    client IP address, or an empty string outside requests.
+    """
+    import flask
+    import flask_login as fl
+
+    import guard as gu
+
+    if not flask.has_request_context():
+        return ""
+    if fl.current_user.is_authenticated:
+        return f"user:{fl.current_user.get_id()}"
+    return f"ip:{gu.get_client_ip()}"
+
+
+@contextlib.contextmanager
+def work(priority: str, user: str | None = None):
+    """
+    Make the upstream fetches in this context fetches of the given priority class
+    on behalf of the given user, by default the current request's.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority class {priority!r}")
+    token = _work.set((priority, get_requester() if user is None else user))
+    try:
+        yield
+    finally:
+        _work.reset(token)
+
+
+def get_work() -> tuple[str, str]:
+    """
+    Return the pair (priority class, user) of the upstream fetches of the current
+    context.
+    """
+    priority, user = _work.get()
+    return priority, get_requester() if user is None else user
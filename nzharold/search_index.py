@@ -0,0 +1,267 @@
+"""
+A full-text search index of the stories that readers have fetched, stored in a
+SQLite database with an FTS5 table over story titles and bodies.
+
+Stories are added by :func:`index_story`, which only queues them, so that
+a background thread does the indexing off the request thread.
+"""
+
+import html
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+import click
+from loguru import logger
+
+import cache as ca
+import extractors as ex
+import helpers as hp
+import settings as st
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS story (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS story_fts USING fts5(
+    title, body, content='story', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS story_ai AFTER INSERT ON story BEGIN
+    INSERT INTO story_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS story_ad AFTER DELETE ON story BEGIN
+    INSERT INTO story_fts(story_fts, rowid, title, body)
+    VALUES ('delete', old.id, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS story_au AFTER UPDATE ON story BEGIN
+    INSERT INTO story_fts(story_fts, rowid, title, body)
+    VALUES ('delete', old.id, old.title, old.body);
+    INSERT INTO story_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+"""
+
+_local = threading.local()
+_queue = queue.Queue()
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Return this thread's connection to the search index, creating the index if
+    necessary.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        st.config.SEARCH_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(st.config.SEARCH_DB_PATH, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def html_to_text(text: str) -> str:
+    """
+    Strip the tags from the given HTML text and unescape its entities.
+    """
+    return html.unescape(re.sub(r"<[^>]+>", " ", text))
+
+
+def story_to_row(story: dict) -> tuple[str, str, str, float]:
+    """
+    Return the (URL, title, body, indexed at) row of the search index for the
+    given parsed story (output of :func:`stories.parse_story`).
+    """
+    body = "\n".join(
+        html_to_text(el["content"]) if el["type"] == "text" else el["caption"]
+        for el in story["elements"]
+    )
+    return story["url"], story["title"], body, time.time()
+
+
+def write_stories(stories: list[dict]) -> None:
+    """
+    Add or update the given parsed stories in the search index in one transaction.
+    """
+    conn = connect()
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO story (url, title, body, indexed_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                title = excluded.title,
+                body = excluded.body,
+                indexed_at = excluded.indexed_at
+            """,
+            [story_to_row(story) for story in stories],
+        )
+
+
+def _run_indexer() -> None:
+    while True:
+        stories = [_queue.get()]
+        # Index whatever else has queued up in the same transaction
+        while len(stories) < 100:
+            try:
+                stories.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            write_stories(stories)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to index {len(stories)} stories: {e}")
+        finally:
+            for __ in stories:
+                _queue.task_done()
+
+
+indexer = hp.LazyThread(_run_indexer)
+
+
+def index_story(story: dict) -> None:
+    """
+    Queue the given parsed story for indexing by the background indexer thread,
+    starting that thread if necessary.
+    """
+    indexer.start()
+    _queue.put(story)
+
+
+def to_fts_query(query: str) -> str:
+    """
+    Return the FTS5 query matching all the words in the given free-text query,
+    quoted so that FTS5 syntax in the query is searched for literally, and
+    matching the last word as a prefix.
+    """
+    words = query.split()
+    result = " ".join('"' + w.replace('"', '""') + '"' for w in words)
+    if words:
+        result += "*"
+    return result
+
+
+def search(query: str, page: int = 1, per_page: int = 10) -> tuple[list[dict], int]:
+    """
+    Search the index for the given free-text query and return the pair
+    (results, total number of results), where results is the given page of
+    results in order of decreasing relevance.
+    Each result is a dictionary with the keys ``"url"``, ``"path"`` (the app path
+    of the story, see :func:`extractors.to_path`), ``"title"``, and ``"snippet"``
+    (an excerpt of the story with the matching words between ``**``).
+    """
+    fts_query = to_fts_query(query)
+    if not fts_query:
+        return [], 0
+
+    conn = connect()
+    try:
+        total = conn.execute(
+            "SELECT count(*) FROM story_fts WHERE story_fts MATCH ?", (fts_query,)
+        ).fetchone()[0]
+        rows = conn.execute(
+            """
+            SELECT story.url, story.title,
+                snippet(story_fts, 1, '**', '**', '…', 24)
+            FROM story_fts JOIN story ON story.id = story_fts.rowid
+            WHERE story_fts MATCH ?
+            ORDER BY bm25(story_fts, 10.0, 1.0)
+            LIMIT ? OFFSET ?
+            """,
+            (fts_query, per_page, (page - 1) * per_page),
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Search for {query!r} failed: {e}")
+        return [], 0
+
+    results = [
+        {"url": url, "path": ex.to_path(url), "title": title, "snippet": snippet}
+        for url, title, snippet in rows
+    ]
+    return results, total
+
+
+def recent_urls(n: int) -> list[str]:
+    """
+    Return the URLs of the given number of most recently indexed stories, most
+    recent first, which are the stories that readers fetched most recently.
+    Return an empty list if there is no index yet.
+    """
+    # Use a connection of its own rather than this thread's, since a Gunicorn
+    # master calls this before forking workers, which mustn't share a connection
+    try:
+        conn = sqlite3.connect(
+            f"file:{st.config.SEARCH_DB_PATH}?mode=ro", uri=True, timeout=10
+        )
+    except sqlite3.OperationalError:
+        return []
+    try:
+        rows = conn.execute(
+            "SELECT url FROM story ORDER BY indexed_at DESC LIMIT ?", (n,)
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Failed to read the recent stories: {e}")
+        return []
+    finally:
+        conn.close()
+    return [url for (url,) in rows]
+
+
+def reindex(batch_size: int = 500) -> int:
+    """
+    Index all the parsed stories in this node's story cache in batches of the
+    given size and return the number of stories indexed.
+    """
+    n = 0
+    batch = []
+    for key, story in ca.local_cache.items(prefix="article:"):
+        batch.append(story)
+        if len(batch) == batch_size:
+            write_stories(batch)
+            n += len(batch)
+            batch = []
+    if batch:
+        write_stories(batch)
+        n += len(batch)
+
+    return n
+
+
+# Add a command line interface
+@click.group()
+def cli():
+    """
+    A basic set of commands for managing the story search index.
+    """
+    pass
+
+
+@cli.command("reindex")
+def reindex_command() -> None:
+    """
+    Index all the stories in the story cache.
+    """
+    t = time.perf_counter()
+    n = reindex()
+    click.echo(f"Indexed {n} stories in {time.perf_counter() - t:.2f} s")
+
+
+@cli.command("search")
+@click.argument("query")
+def search_command(query: str) -> None:
+    """
+    Print the first page of search results for the given query.
+    """
+    results, total = search(query)
+    click.echo(f"{total} results")
+    for result in results:
+        click.echo(f"{result['title']} ({result['url']})")
+
+
+if __name__ == "__main__":
+    cli()
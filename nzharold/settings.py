@@ -15,10 +15,16 @@ de.load_dotenv(dotenv_path=ROOT / ".env")
 
 class BaseConfig(object):
     ROOT = pl.Path(os.path.abspath(__file__)).parent.parent
-    APP_DIR = ROOT / "nzherald"
+    APP_DIR = ROOT / "nzharold"
     DATA_DIR = ROOT / "data"
     ASSETS_DIR = APP_DIR / "assets"
-    CACHE_DIR = ROOT / "cache"
+    # Style sheets and fonts vendored from their CDN (see static_assets.py)
+    VENDOR_DIR = APP_DIR / "vendor"
+    # Build of the fingerprinted and compressed static assets, and the URL path at
+    # which they are served
+    STATIC_DIR = pl.Path(os.getenv("STATIC_DIR", ROOT / "static"))
+    STATIC_URL_PATH = "/_static"
+    CACHE_DIR = pl.Path(os.getenv("CACHE_DIR", ROOT / "cache"))
 
     SECRET_KEY = os.getenv("SECRET_KEY")
     BCRYPT_LOG_ROUNDS = 13
@@ -27,6 +33,158 @@ class BaseConfig(object):
     CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{ROOT / 'users.sqlite'}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Options of the user database engines of both the app (via Flask-SQLAlchemy)
+    # and the command line interface (see user_management.py).
+    # Pool one connection per thread of a Gunicorn worker, with some overflow, and
+    # wait up to 15 seconds for another connection's write lock
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 4)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 4)),
+        "connect_args": {"timeout": 15},
+    }
+    # Pragmas set on each new SQLite connection: write-ahead logging, so that
+    # writes don't block reads, syncing less often, which is safe with write-ahead
+    # logging, a 16 MiB page cache, and 64 MiB of memory-mapped I/O
+    SQLITE_PRAGMAS = {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -16 * 1024,
+        "mmap_size": 64 * 2**20,
+    }
+
+    # Story cache.
+    # Number of values each worker keeps in memory in front of the files in CACHE_DIR
+    CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", 256))
+    # Seconds after which a cached story is fetched again
+    CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))
+    # For a multi-node cache, set CACHE_PEERS to the comma-separated base URLs of all
+    # the nodes, e.g. "http://10.0.0.1:5020,http://10.0.0.2:5020", CACHE_NODE to
+    # the base URL of this node, GUNICORN_BIND to the address of that URL, on which
+    # Gunicorn listens besides 127.0.0.1 (see gunicorn_config.py), and
+    # CACHE_PEER_TOKEN to a secret shared by the nodes, by which they authenticate
+    # to each other; it goes over the nodes' private network in plain HTTP, so don't
+    # reuse SECRET_KEY
+    CACHE_NODE = os.getenv("CACHE_NODE")
+    CACHE_PEERS = [p for p in os.getenv("CACHE_PEERS", "").split(",") if p]
+    CACHE_PEER_TOKEN = os.getenv("CACHE_PEER_TOKEN")
+    CACHE_PEER_TIMEOUT = float(os.getenv("CACHE_PEER_TIMEOUT", 0.5))
+    # Number of nodes that store a copy of each value
+    CACHE_COPIES = int(os.getenv("CACHE_COPIES", 1))
+    # Rendered stories as JSON files, gzipped, and brotli-compressed if the brotli
+    # package is installed, which the story JSON endpoint sends as they are
+    RENDER_FILES_DIR = CACHE_DIR / "renders"
+    # Seconds past CACHE_TTL for which compacting the cache keeps stale stories,
+    # which are served when upstream is unavailable
+    CACHE_KEEP_STALE = int(os.getenv("CACHE_KEEP_STALE", 7 * 24 * 3600))
+
+    # Dash server-side store of the stories being read, limited in number of files,
+    # seconds that the files last, and total bytes
+    STORE_DIR = CACHE_DIR / "store"
+    STORE_MAX_ITEMS = int(os.getenv("STORE_MAX_ITEMS", 2000))
+    STORE_TTL = int(os.getenv("STORE_TTL", 24 * 3600))
+    STORE_MAX_BYTES = int(os.getenv("STORE_MAX_BYTES", 200 * 2**20))
+
+    # Upstream fetching.
+    # Seconds to wait for an upstream response
+    UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 10))
+    # Maximum number of upstream requests to start per second per host
+    UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", 5))
+    # Maximum number of upstream fetches in flight per worker and host, beyond
+    # which fetches queue (see scheduler.py) and, after waiting their class's time,
+    # are turned away, so that a slow upstream can't tie up all the worker's
+    # threads; background fetches may use all but UPSTREAM_INTERACTIVE_RESERVE
+    UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 4))
+    UPSTREAM_INTERACTIVE_RESERVE = int(os.getenv("UPSTREAM_INTERACTIVE_RESERVE", 1))
+    # Seconds that a reader's fetch and a background fetch may wait for a slot
+    UPSTREAM_QUEUE_WAIT = float(os.getenv("UPSTREAM_QUEUE_WAIT", 1))
+    UPSTREAM_BACKGROUND_WAIT = float(os.getenv("UPSTREAM_BACKGROUND_WAIT", 30))
+    # Circuit breaker per upstream host: stop fetching for UPSTREAM_COOLDOWN seconds
+    # when at least UPSTREAM_FAILURE_RATE of the recent fetches failed or took
+    # longer than UPSTREAM_SLOW_CALL seconds
+    UPSTREAM_FAILURE_RATE = float(os.getenv("UPSTREAM_FAILURE_RATE", 0.5))
+    UPSTREAM_SLOW_CALL = float(os.getenv("UPSTREAM_SLOW_CALL", 5))
+    UPSTREAM_COOLDOWN = float(os.getenv("UPSTREAM_COOLDOWN", 30))
+    # Archive of upstream fetches in rolling WARC files (see archive.py): "record"
+    # to record each fetch, "replay" to fetch from the archive instead of upstream,
+    # or empty for neither
+    ARCHIVE_MODE = os.getenv("ARCHIVE_MODE", "")
+    ARCHIVE_DIR = pl.Path(os.getenv("ARCHIVE_DIR", DATA_DIR / "archive"))
+    # Size at which a process starts a new archive file, and total size beyond
+    # which the oldest files are deleted
+    ARCHIVE_FILE_BYTES = int(os.getenv("ARCHIVE_FILE_BYTES", 64 * 2**20))
+    ARCHIVE_MAX_BYTES = int(os.getenv("ARCHIVE_MAX_BYTES", 2 * 2**30))
+    # Whether to serve a fetch from the archive, if it has the story, when upstream
+    # fails or the fetch is turned away
+    ARCHIVE_FAILOVER = os.getenv("ARCHIVE_FAILOVER", "false").lower() == "true"
+    # Factor of the recorded fetch times to wait when replaying, e.g. 1 to replay
+    # upstream's latency, or 0 to not wait
+    ARCHIVE_REPLAY_DELAY = float(os.getenv("ARCHIVE_REPLAY_DELAY", 0))
+    # Base URL to fetch story paths from instead of https://www.nzherald.co.nz,
+    # e.g. that of the stand-in server benchmarks/standin.py
+    UPSTREAM_BASE_URL = os.getenv("UPSTREAM_BASE_URL")
+    # Number of threads fetching and processes parsing a reading list
+    BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 8))
+    PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", 2))
+    # Where to parse and render the stories fetched for readers: "thread", in the
+    # request's thread, or "process", in the PARSE_PROCESSES parsing processes of
+    # each worker, which spares the worker's threads from contending for the GIL
+    # but takes a core per parsing process to pay off
+    PARSE_MODE = os.getenv("PARSE_MODE", "thread")
+    # Number of threads per worker prefetching stories linked from the one being read
+    PREFETCH_THREADS = int(os.getenv("PREFETCH_THREADS", 2))
+    # Seconds between upstream fetches of a story in live mode
+    LIVE_INTERVAL = int(os.getenv("LIVE_INTERVAL", 60))
+    # Number of story elements per page of a story
+    STORY_PAGE_SIZE = int(os.getenv("STORY_PAGE_SIZE", 40))
+    # URL template of an image resizing service by which to serve story images at
+    # the lower image quality reader settings, with the fields {url} and {width},
+    # e.g. "https://images.weserv.nl/?url={url}&w={width}"; if empty, story images
+    # come only at their original quality
+    IMAGE_RESIZER_URL = os.getenv("IMAGE_RESIZER_URL", "")
+
+    # Request guards (see guard.py).
+    # File of the user agents of the AI bots to refuse, one per line, as updated by
+    # ``fab update-bot-user-agents``
+    BOT_USER_AGENTS_PATH = DATA_DIR / "bot_user_agents.txt"
+    # Upstream story fetches allowed per client IP address and per user: bursts of
+    # up to FETCH_BURST_* fetches, refilled at FETCH_RATE_* fetches per second
+    FETCH_RATE_PER_IP = float(os.getenv("FETCH_RATE_PER_IP", 0.5))
+    FETCH_BURST_PER_IP = int(os.getenv("FETCH_BURST_PER_IP", 30))
+    FETCH_RATE_PER_USER = float(os.getenv("FETCH_RATE_PER_USER", 0.5))
+    FETCH_BURST_PER_USER = int(os.getenv("FETCH_BURST_PER_USER", 30))
+    # Speculative prefetches of linked stories allowed per user, likewise, apart
+    # from the fetches above
+    FETCH_RATE_PREFETCH = float(os.getenv("FETCH_RATE_PREFETCH", 0.2))
+    FETCH_BURST_PREFETCH = int(os.getenv("FETCH_BURST_PREFETCH", 10))
+
+    # Full-text search index of fetched stories
+    SEARCH_DB_PATH = pl.Path(os.getenv("SEARCH_DB_PATH", DATA_DIR / "search.sqlite"))
+
+    # Memory diagnostics (see memory.py).
+    # Seconds between samples of each worker's memory
+    MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", 10))
+    # Number of stack frames by which to trace each worker's allocations, which
+    # slows the worker, or 0 to not trace them, and seconds between snapshots of the
+    # traced allocations
+    MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", 0))
+    MEMORY_SNAPSHOT_INTERVAL = float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", 300))
+    # RSS in bytes beyond which a Gunicorn worker is replaced after its current
+    # requests, or 0 to never replace workers for their memory
+    WORKER_MAX_RSS = int(os.getenv("WORKER_MAX_RSS", 768 * 2**20))
+
+    # Number of most recently fetched stories that a Gunicorn master loads from the
+    # cache into memory before forking its workers, and that ``fab reload-gunicorn``
+    # refreshes before new workers take over
+    WARM_STORIES = int(os.getenv("WARM_STORIES", 50))
+
+    # Runtime metrics for the admin dashboard (see metrics.py).
+    # Folder of the workers' metrics snapshots, seconds between a worker's
+    # snapshots, and seconds between measurements of the cache sizes on disk
+    METRICS_DIR = CACHE_DIR / "metrics"
+    METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 10))
+    METRICS_SIZES_INTERVAL = float(os.getenv("METRICS_SIZES_INTERVAL", 300))
+    # Comma-separated usernames of the users who may see the admin dashboard
+    ADMIN_USERS = [u for u in os.getenv("ADMIN_USERS", "").split(",") if u]
 
 
 class DevConfig(BaseConfig):
@@ -0,0 +1,455 @@
+"""
+The build of the app's static assets, by which browsers load them once and then
+never ask for them again.
+
+The build takes the Bootstrap style sheets and icon fonts, which are vendored from
+their CDN into ``VENDOR_DIR`` (see :func:`vendor`), and the app's own
+``assets/``, and writes each file to ``STATIC_DIR`` under a name fingerprinted by
+its content hash, compressed ahead of time in gzip and, if the optional brotli
+package is installed, brotli.
+Style sheets refer to the fingerprinted names of the files that they load.
+It also compresses the scripts of the Dash component libraries that the app uses.
+A manifest in ``STATIC_DIR`` lists the files built.
+
+Pages then link the fingerprinted files, served at ``STATIC_URL_PATH`` in the
+content coding that the client accepts best, with an immutable ``Cache-Control``
+header, since a changed file gets a new name, and Dash's fingerprinted component
+scripts are served likewise.
+Pages leave out the scripts of the component libraries in ``UNUSED_LIBRARIES``.
+Without a build, e.g. in development, pages link the CDN and Dash serves
+``assets/`` as usual.
+
+Vendor the CDN files via ``uv run python nzharold/static_assets.py vendor``, e.g.
+after upgrading Dash Bootstrap Components, which pins their versions, and build
+via ``uv run python nzharold/static_assets.py build``.
+"""
+
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib as pl
+import posixpath
+import re
+import sys
+import urllib.parse as up
+
+import click
+import dash_bootstrap_components as dbc
+import flask
+import werkzeug.security as ws
+
+import cache as ca
+import settings as st
+
+# The files to vendor from their CDN by name in VENDOR_DIR
+VENDOR_URLS = {
+    "bootstrap.min.css": dbc.themes.BOOTSTRAP,
+    "bootstrap-icons.css": dbc.icons.BOOTSTRAP,
+}
+# The component libraries whose components the app doesn't use, and whose scripts
+# pages therefore leave out, by their paths under /_dash-component-suites/
+UNUSED_LIBRARIES = ("dash/dash_table", "dash_extensions")
+# The suffixes of the files worth compressing; images and fonts are compressed
+# already
+COMPRESSIBLE = {".css", ".js", ".map", ".json", ".svg", ".ico", ".txt"}
+MANIFEST = "manifest.json"
+SUITES_PATH = "/_dash-component-suites/"
+
+# The url() references of style sheets, with the URL as the second group
+CSS_URL_PATTERN = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+UNUSED_SCRIPTS_PATTERN = re.compile(
+    r'<script src="[^"]*{}(?:{})/[^"]*"></script>\s*'.format(
+        re.escape(SUITES_PATH), "|".join(re.escape(lib) for lib in UNUSED_LIBRARIES)
+    )
+)
+
+
+def get_css_references(css: str) -> list[str]:
+    """
+    Return the relative URLs that the given style sheet loads, without their query
+    strings and fragments, skipping data URIs and absolute URLs.
+    """
+    result = []
+    for __, url in CSS_URL_PATTERN.findall(css):
+        if url.startswith(("data:", "#", "/")) or "//" in url:
+            continue
+        path = up.urlsplit(url).path
+        if path not in result:
+            result.append(path)
+    return result
+
+
+def vendor(vendor_dir: pl.Path = st.config.VENDOR_DIR) -> list[str]:
+    """
+    Download the files of ``VENDOR_URLS`` and the fonts and images that they load
+    into the given directory and return the names of the files written.
+    """
+    import requests
+
+    written = []
+    for name, url in VENDOR_URLS.items():
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        files = {name: r.content}
+        for ref in get_css_references(r.text):
+            ref_name = posixpath.normpath(posixpath.join(posixpath.dirname(name), ref))
+            if ref_name.startswith(".."):
+                raise click.ClickException(f"{url} loads {ref} outside its folder")
+            s = requests.get(up.urljoin(url, ref), timeout=30)
+            s.raise_for_status()
+            files[ref_name] = s.content
+
+        for file_name, content in files.items():
+            path = vendor_dir / file_name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+            written.append(file_name)
+    return written
+
+
+def get_missing_vendored(vendor_dir: pl.Path = st.config.VENDOR_DIR) -> list[str]:
+    """
+    Return the names of the files of ``VENDOR_URLS`` that aren't in the given
+    directory.
+    """
+    return [name for name in VENDOR_URLS if not (vendor_dir / name).is_file()]
+
+
+def get_fingerprinted_name(name: str, content: bytes) -> str:
+    """
+    Return the given file name with the hash of the given content of the file
+    before its suffix, e.g. ``reader.3b5d5c3712f9.css`` for ``reader.css``.
+    """
+    path = pl.PurePosixPath(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def write_encoded(path: pl.Path, content: bytes) -> None:
+    """
+    Write the given content to the given path and, if the path's suffix is in
+    ``COMPRESSIBLE``, compressed in gzip and brotli beside it, unless compressing
+    doesn't make it smaller.
+    """
+    encoded = {}
+    if path.suffix in COMPRESSIBLE:
+        encoded[".gz"] = gzip.compress(content, compresslevel=9, mtime=0)
+        brotli = ca.get_brotli()
+        if brotli is not None:
+            # Compressed once per build, so take the best compression
+            encoded[".br"] = brotli.compress(content, quality=11)
+    encoded[""] = content
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for suffix, data in encoded.items():
+        if suffix and len(data) >= len(content):
+            continue
+        target = path.with_name(path.name + suffix)
+        tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, target)
+
+
+def build_files(sources: dict[str, pl.Path], static_dir: pl.Path) -> dict[str, str]:
+    """
+    Write the given source files by name to the given directory under their
+    fingerprinted names (see :func:`get_fingerprinted_name`) and compressed (see
+    :func:`write_encoded`), pointing the references of style sheets to the
+    fingerprinted names, and return the fingerprinted names by name.
+    """
+    result = {}
+    # Style sheets go last, when the files that they load have their names
+    for name in sorted(sources, key=lambda name: (name.endswith(".css"), name)):
+        content = sources[name].read_bytes()
+        if name.endswith(".css"):
+            css = content.decode("utf-8")
+
+            def replace(match: re.Match) -> str:
+                ref = up.urlsplit(match.group(2)).path
+                ref_name = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(name), ref)
+                )
+                # Leave data URIs, absolute URLs, and files not built
+                if ref_name not in result:
+                    return match.group(0)
+                built = posixpath.relpath(result[ref_name], posixpath.dirname(name))
+                return f'url("{built}")'
+
+            content = CSS_URL_PATTERN.sub(replace, css).encode("utf-8")
+
+        result[name] = get_fingerprinted_name(name, content)
+        write_encoded(static_dir / result[name], content)
+    return result
+
+
+def get_suite_sources(app) -> dict[str, pl.Path]:
+    """
+    Return the script files of the component libraries that pages of the given
+    Dash app load, including those loaded on demand, by their paths under
+    ``/_dash-component-suites/``, e.g. ``dash/dcc/async-markdown.js``.
+    """
+    # Rendering the index registers the scripts
+    app.server.test_client().get(app.config.requests_pathname_prefix)
+    result = {}
+    for package, paths in app.registered_paths.items():
+        package_dir = pl.Path(sys.modules[package].__file__).parent
+        for path in paths:
+            name = f"{package}/{path}"
+            # Libraries register source maps that they may not ship
+            if not name.startswith(UNUSED_LIBRARIES) and (package_dir / path).exists():
+                result[name] = package_dir / path
+    return result
+
+
+def build(static_dir: pl.Path = st.config.STATIC_DIR) -> dict:
+    """
+    Build the static assets into the given directory and return the manifest that
+    it writes there, a dictionary with the keys
+
+    - ``"files"``: the fingerprinted names of the vendored files and of the app's
+      assets by name, e.g. ``"vendor/bootstrap.min.css"`` and ``"reader.css"``
+    - ``"suites"``: per component script, by its path under
+      ``/_dash-component-suites/``, a dictionary with the path ``"file"`` of its
+      compressed copy in the build and the path ``"source"`` and ``"mtime"`` of its
+      source, by which to tell if the copy is stale
+
+    Vendored files that are missing are linked on their CDN instead.
+    Files of earlier builds are kept for the pages that browsers loaded before, and
+    the manifest is replaced last, so that a running app keeps serving the earlier
+    build until it restarts.
+    """
+    import index
+
+    sources = {
+        f"vendor/{path.relative_to(st.config.VENDOR_DIR).as_posix()}": path
+        for path in sorted(st.config.VENDOR_DIR.rglob("*"))
+        if path.is_file()
+    }
+    sources |= {
+        path.relative_to(st.config.ASSETS_DIR).as_posix(): path
+        for path in sorted(st.config.ASSETS_DIR.rglob("*"))
+        if path.is_file()
+    }
+    manifest = {"files": build_files(sources, static_dir), "suites": {}}
+
+    for name, path in get_suite_sources(index.app).items():
+        target = f"_dash-component-suites/{name}"
+        write_encoded(static_dir / target, path.read_bytes())
+        manifest["suites"][name] = {
+            "file": target,
+            "source": str(path),
+            "mtime": path.stat().st_mtime,
+        }
+
+    tmp_path = static_dir / f"{MANIFEST}.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp_path, static_dir / MANIFEST)
+    return manifest
+
+
+@functools.cache
+def get_manifest() -> dict | None:
+    """
+    Return the manifest of the build in ``STATIC_DIR`` (see :func:`build`), without
+    the component scripts whose sources changed since, or ``None`` if there is no
+    build.
+    Read it once per process, checking the sources by the paths in the manifest, so
+    that the result doesn't depend on which component libraries are imported yet.
+    """
+    try:
+        manifest = json.loads((st.config.STATIC_DIR / MANIFEST).read_text())
+    except FileNotFoundError:
+        return None
+
+    suites = {}
+    for name, entry in manifest["suites"].items():
+        try:
+            mtime = pl.Path(entry["source"]).stat().st_mtime
+        except (KeyError, FileNotFoundError):
+            continue
+        if mtime == entry["mtime"]:
+            suites[name] = entry["file"]
+    manifest["suites"] = suites
+    return manifest
+
+
+def get_url(name: str) -> str:
+    """
+    Return the URL of the built file of the given name.
+    """
+    return f"{st.config.STATIC_URL_PATH}/{get_manifest()['files'][name]}"
+
+
+def get_stylesheets() -> list[str]:
+    """
+    Return the URLs of the style sheets for pages to link besides Dash's: the built
+    Bootstrap style sheets, or those on their CDN if they weren't vendored, and the
+    built assets if there is a build, or else the Bootstrap style sheets on their
+    CDN, leaving Dash to link the assets.
+    """
+    manifest = get_manifest()
+    if manifest is None:
+        return list(VENDOR_URLS.values())
+    return [
+        get_url(f"vendor/{name}") if f"vendor/{name}" in manifest["files"] else url
+        for name, url in VENDOR_URLS.items()
+    ] + [
+        get_url(name)
+        for name in sorted(manifest["files"])
+        if name.endswith(".css") and not name.startswith("vendor/")
+    ]
+
+
+def get_scripts() -> list[str]:
+    """
+    Return the URLs of the built asset scripts for pages to link, if there is a
+    build.
+    """
+    manifest = get_manifest()
+    if manifest is None:
+        return []
+    return [
+        get_url(name)
+        for name in sorted(manifest["files"])
+        if name.endswith(".js") and not name.startswith("vendor/")
+    ]
+
+
+def get_favicon_html() -> str | None:
+    """
+    Return the link of the built favicon for pages to include, or ``None`` if there
+    is no build.
+    """
+    manifest = get_manifest()
+    if manifest is None or "favicon.ico" not in manifest["files"]:
+        return None
+    return f'<link rel="icon" type="image/x-icon" href="{get_url("favicon.ico")}">'
+
+
+def trim_scripts(scripts: str) -> str:
+    """
+    Return the given script tags of a page without those of ``UNUSED_LIBRARIES``.
+    """
+    return UNUSED_SCRIPTS_PATTERN.sub("", scripts)
+
+
+def send_encoded(path: pl.Path, mimetype: str | None = None) -> flask.Response:
+    """
+    Return a response that sends the given built file, in the content coding that
+    the client accepts best, with a ``Cache-Control`` header by which the client
+    keeps it for a year without revalidating it.
+    """
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    accept_encodings = flask.request.accept_encodings
+    encoding = "identity"
+    for candidate, suffix in [("br", ".br"), ("gzip", ".gz")]:
+        encoded_path = path.with_name(path.name + suffix)
+        if accept_encodings[candidate] and encoded_path.exists():
+            encoding, path = candidate, encoded_path
+            break
+
+    response = flask.send_file(path, mimetype=mimetype, max_age=31536000)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+blueprint = flask.Blueprint("static_assets", __name__)
+
+
+@blueprint.route(f"{st.config.STATIC_URL_PATH}/<path:filename>")
+def serve_static(filename: str):
+    """
+    Send the built file at the given path in ``STATIC_DIR``.
+    """
+    path = ws.safe_join(str(st.config.STATIC_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        flask.abort(404)
+    return send_encoded(pl.Path(path))
+
+
+@blueprint.before_app_request
+def serve_component_suite():
+    """
+    Send the compressed copy of a fingerprinted component script that a request
+    asks for, if the build has it, or else leave the request to Dash.
+    """
+    path = flask.request.path
+    if not path.startswith(SUITES_PATH):
+        return None
+    manifest = get_manifest()
+    if manifest is None:
+        return None
+    from dash.fingerprint import check_fingerprint
+
+    name, has_fingerprint = check_fingerprint(path.removeprefix(SUITES_PATH))
+    if not has_fingerprint or name not in manifest["suites"]:
+        return None
+    return send_encoded(st.config.STATIC_DIR / manifest["suites"][name])
+
+
+def init_app(server: flask.Flask) -> None:
+    """
+    Register the endpoint of the built static assets on the given Flask server.
+    """
+    server.register_blueprint(blueprint)
+
+
+@click.group()
+def cli():
+    """
+    Vendor and build the static assets.
+    """
+
+
+@cli.command("vendor")
+def vendor_command() -> None:
+    """
+    Download the Bootstrap style sheets and fonts into the vendor folder.
+    """
+    for name in vendor():
+        click.echo(f"Vendored {name}")
+
+
+@cli.command("build")
+@click.option(
+    "--vendor-missing",
+    is_flag=True,
+    help="Vendor the Bootstrap files first if they aren't vendored",
+)
+@click.option(
+    "--require-vendored",
+    is_flag=True,
+    help="Fail if the Bootstrap files aren't vendored, rather than link their CDN",
+)
+def build_command(vendor_missing: bool, require_vendored: bool) -> None:
+    """
+    Build the static assets into the static folder.
+    """
+    missing = get_missing_vendored(st.config.VENDOR_DIR)
+    if vendor_missing and missing:
+        for name in vendor():
+            click.echo(f"Vendored {name}")
+        missing = get_missing_vendored(st.config.VENDOR_DIR)
+    if require_vendored and missing:
+        raise click.ClickException(
+            f"{', '.join(missing)} not vendored into {st.config.VENDOR_DIR}; "
+            "vendor them via 'static_assets.py vendor' and push them"
+        )
+    manifest = build()
+    for name, built in manifest["files"].items():
+        click.echo(f"Built {name} as {built}")
+    for name in missing:
+        click.echo(f"Linking {name} on its CDN, since it isn't vendored")
+    click.echo(f"Compressed {len(manifest['suites'])} component scripts")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,800 @@
+"""
+Functions to fetch and parse stories from NZ Herald and the other sources of
+:mod:`extractors`.
+"""
+
+import collections
+import concurrent.futures as cf
+import json
+import multiprocessing as mp
+import threading
+import time
+import urllib.parse as up
+
+import click
+from loguru import logger
+
+import archive as ar
+import cache as ca
+import extractors as ex
+import helpers as hp
+import metrics as mt
+import rendering as rn
+import scheduler as sch
+import search_index as si
+import settings as st
+
+
+class HostRateLimiter:
+    """
+    Space out requests to each host so that at most ``rate`` requests per second
+    start per host, or the host's own rate, if given.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str, rate: float | None = None) -> None:
+        """
+        Block until a request to the given host may start, given the host's rate,
+        if any.
+        """
+        interval = self.interval if rate is None else 1 / rate
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + interval
+        time.sleep(start - now)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised when an upstream fetch is turned away without trying upstream, because
+    upstream is failing or too many fetches are in flight.
+    """
+
+
+class FetchCancelled(UpstreamUnavailable):
+    """
+    Raised when a background upstream fetch is cancelled while queued, because a
+    reader fetches the same story (see :mod:`scheduler`).
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing or slow service.
+    The breaker starts closed, letting calls through.
+    Once at least ``min_calls`` of the last ``window`` calls have finished and at
+    least the fraction ``failure_rate`` of them failed or took longer than
+    ``slow_call`` seconds, the breaker opens, refusing calls, for ``cooldown``
+    seconds.
+    Then it's half-open: it lets through one probe call at a time, and closes
+    again after ``probes`` successful probes in a row or opens again on a failed
+    one.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call: float = 5,
+        cooldown: float = 30,
+        window: int = 20,
+        min_calls: int = 10,
+        probes: int = 2,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.min_calls = min_calls
+        self.probes = probes
+        self.state = "closed"
+        self._calls = collections.deque(maxlen=window)
+        self._opened_at = 0
+        self._probing = False
+        self._n_probes_ok = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Return ``True`` if a call may go ahead, in which case the caller must
+        report its outcome via :meth:`record`.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = "half-open"
+                self._n_probes_ok = 0
+            if self.state == "half-open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, ok: bool, duration: float) -> None:
+        """
+        Record the outcome of an allowed call: whether it succeeded and how many
+        seconds it took.
+        """
+        ok = ok and duration <= self.slow_call
+        with self._lock:
+            if self.state == "half-open":
+                self._probing = False
+                if not ok:
+                    self._open()
+                else:
+                    self._n_probes_ok += 1
+                    if self._n_probes_ok >= self.probes:
+                        self.state = "closed"
+                        self._calls.clear()
+                return
+
+            self._calls.append(ok)
+            n_bad = self._calls.count(False)
+            if len(self._calls) >= self.min_calls and n_bad >= self.failure_rate * len(
+                self._calls
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        logger.warning("Upstream circuit breaker opened")
+
+
+rate_limiter = HostRateLimiter(st.config.UPSTREAM_RATE_LIMIT)
+breakers = collections.defaultdict(
+    lambda: CircuitBreaker(
+        failure_rate=st.config.UPSTREAM_FAILURE_RATE,
+        slow_call=st.config.UPSTREAM_SLOW_CALL,
+        cooldown=st.config.UPSTREAM_COOLDOWN,
+    )
+)
+# Locks that serialise the refreshes of a story, striped over a fixed number so
+# that they don't grow with the stories refreshed; refreshes of stories that share
+# a stripe merely wait for each other
+_refresh_locks = [threading.Lock() for __ in range(64)]
+# The URL aliases that this process has recorded, so as to record each once
+_known_aliases = set()
+_session = None
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def import_dependencies() -> None:
+    """
+    Import the fetching, parsing, and rendering dependencies, which are otherwise
+    imported on first use to keep app startup fast.
+    Call this in a preloading Gunicorn master so that its workers inherit them.
+    """
+    import bs4
+    import markdownify
+    import requests
+
+
+def get_session():
+    """
+    Return the HTTP session for upstream requests, creating it if necessary, with a
+    connection pool per source of the source's size.
+    """
+    global _session
+
+    if _session is None:
+        import requests
+
+        session = requests.Session()
+        session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_maxsize=st.config.BATCH_MAX_WORKERS),
+        )
+        for extractor in ex.extractors.values():
+            session.mount(
+                f"{extractor.base_url}/",
+                requests.adapters.HTTPAdapter(pool_maxsize=extractor.max_connections),
+            )
+        _session = session
+    return _session
+
+
+def normalize_url(url: str) -> str:
+    """
+    Return the given story URL normalized by its source's extractor (see
+    :meth:`extractors.Extractor.normalize_url`), e.g. an NZ Herald URL in the form
+    ``https://www.nzherald.co.nz<path>``.
+    URLs of no registered source are taken for NZ Herald ones.
+    """
+    return ex.get_extractor(url, ex.nzherald).normalize_url(url)
+
+
+def fetch_upstream(url: str, wait: float | None = None):
+    """
+    Get the page of the story at the given normalized URL from upstream, in the
+    priority class of the current context (see :func:`scheduler.work`), once the
+    worker's scheduler admits the fetch, respecting the per-host rate limit and
+    the upstream timeout.
+
+    Raise an :class:`UpstreamUnavailable` if the host's circuit breaker is open or
+    if the scheduler doesn't admit the fetch within ``wait`` seconds, by default
+    ``UPSTREAM_QUEUE_WAIT`` for interactive fetches and
+    ``UPSTREAM_BACKGROUND_WAIT`` for the others, or a :class:`FetchCancelled` if a
+    reader's fetch of the same story cancels it meanwhile.
+    Connection errors, timeouts, and server errors count as failures towards
+    opening the breaker.
+    """
+    import requests
+
+    extractor = ex.get_extractor(url, ex.nzherald)
+    key = get_story_key(url)
+    if st.config.UPSTREAM_BASE_URL:
+        url = st.config.UPSTREAM_BASE_URL + up.urlparse(url).path
+    host = up.urlparse(url).netloc
+
+    priority, user = sch.get_work()
+    if wait is None:
+        if priority == "interactive":
+            wait = st.config.UPSTREAM_QUEUE_WAIT
+        else:
+            wait = st.config.UPSTREAM_BACKGROUND_WAIT
+    budget = extractor.max_concurrency or st.config.UPSTREAM_MAX_CONCURRENCY
+    try:
+        ticket = sch.scheduler.acquire(key, host, priority, user, budget, wait)
+    except sch.Cancelled as e:
+        raise FetchCancelled(str(e))
+    except sch.QueueTimeout:
+        raise UpstreamUnavailable("Too many upstream fetches in flight")
+    breaker = breakers[host]
+    if not breaker.allow():
+        sch.scheduler.release(ticket)
+        raise UpstreamUnavailable(f"Circuit breaker for {host} is open")
+
+    t = time.perf_counter()
+    ok = False
+    try:
+        rate_limiter.wait(host, extractor.rate_limit)
+        r = get_session().get(url, timeout=st.config.UPSTREAM_TIMEOUT)
+        ok = r.status_code < 500
+        return r
+    finally:
+        sch.scheduler.release(ticket)
+        seconds = time.perf_counter() - t
+        breaker.record(ok, seconds)
+        mt.record_upstream(host, seconds, ok)
+
+
+def fetch_page(url: str, wait: float | None = None):
+    """
+    Get the page of the story at the given normalized URL from upstream (see
+    :func:`fetch_upstream`) or from the archive of upstream fetches, depending on
+    the ``ARCHIVE_*`` settings:
+
+    - in ``"replay"`` mode, only from the archive, raising an
+      :class:`UpstreamUnavailable` if the story isn't archived
+    - in ``"record"`` mode, from upstream, archiving responses other than server
+      errors
+    - with ``ARCHIVE_FAILOVER``, from the archive if upstream fails or the fetch is
+      turned away, but not cancelled, if the story is archived
+
+    """
+    import requests
+
+    if st.config.ARCHIVE_MODE == "replay":
+        r = ar.replay(url, delay=st.config.ARCHIVE_REPLAY_DELAY)
+        if r is None:
+            raise UpstreamUnavailable(f"{url} isn't archived")
+        return r
+
+    try:
+        r = fetch_upstream(url, wait)
+    except FetchCancelled:
+        raise
+    except (UpstreamUnavailable, requests.RequestException) as e:
+        r = ar.replay(url) if st.config.ARCHIVE_FAILOVER else None
+        if r is None:
+            raise
+        logger.warning(f"Serving {url} from the archive: {e}")
+        return r
+
+    if r.status_code >= 500 and st.config.ARCHIVE_FAILOVER:
+        archived = ar.replay(url)
+        if archived is not None:
+            logger.warning(f"Serving {url} from the archive: status {r.status_code}")
+            return archived
+    elif r.status_code < 500 and st.config.ARCHIVE_MODE == "record":
+        ar.record(url, r)
+    return r
+
+
+def parse_story(text: str, url: str) -> dict:
+    """
+    Parse the given HTML text of the story page at the given normalized URL with
+    the extractor of its source and return a dictionary with the keys
+
+    - ``"url"``: the given URL
+    - ``"source"``: the name of the source, e.g. ``"nzherald"``
+    - ``"title"``: the story's title
+    - ``"elements"``: list of the story's text and image elements as dictionaries,
+      each with a ``"type"`` key equal to ``"text"`` or ``"image"``;
+      text elements have the HTML key ``"content"``, and image elements have
+      the keys ``"src"`` and ``"caption"``.
+
+    Raise a ``ValueError`` if the page has no story or the URL is of no registered
+    source.
+    """
+    extractor = ex.get_extractor(url)
+    if extractor is None:
+        raise ValueError(f"No extractor for {url}")
+    return extractor.extract(text, url)
+
+
+def parse_and_render(page: bytes, encoding: str, url: str) -> str:
+    """
+    Parse the given page of the story at the given URL, in the given
+    encoding, render the story, and return the JSON text of a dictionary with the
+    keys
+
+    - ``"story"``: the output of :func:`parse_story`
+    - ``"rendered"``: the output of :func:`rendering.render`
+
+    JSON text is the cheapest result to send back from a parsing process, and the
+    rendered components go straight to it.
+    """
+    story = parse_story(page.decode(encoding, errors="replace"), url)
+    return hp.to_json(
+        {
+            "story": story,
+            "rendered": {
+                "content": rn.render_story(story),
+                "hashes": rn.hash_elements(story),
+            },
+        }
+    )
+
+
+def parse_page(
+    page: bytes, encoding: str, url: str, pooled: bool | None = None
+) -> tuple[dict, dict]:
+    """
+    Return the pair (story, rendered story) of the given page of the story at the
+    given URL (see :func:`parse_and_render`).
+    Parse in this process's parsing processes if ``pooled``, or, if ``pooled``
+    is ``None``, if the setting ``PARSE_MODE`` is ``"process"``; otherwise parse in
+    this thread.
+    Raise a ``ValueError``, ``IndexError``, or ``KeyError`` if the page can't be
+    parsed.
+    """
+    global _parse_pool
+
+    if pooled is None:
+        pooled = st.config.PARSE_MODE == "process"
+    text = None
+    if pooled:
+        pool = get_parse_pool()
+        try:
+            text = pool.submit(parse_and_render, page, encoding, url).result()
+        except cf.process.BrokenProcessPool:
+            # A parsing process died; start afresh next time and parse here now
+            logger.warning("The story parsing pool broke; restarting it")
+            with _parse_pool_lock:
+                if _parse_pool is pool:
+                    _parse_pool = None
+    if text is None:
+        text = parse_and_render(page, encoding, url)
+
+    result = json.loads(text)
+    return result["story"], result["rendered"]
+
+
+def get_story_key(url: str, cache=None) -> str:
+    """
+    Return the key under which the story at the given normalized URL is cached:
+    ``<source>:<story ID>`` if the URL has the story's ID, like the NZ Herald's
+    trailing slugs, or else the key to which the alias index in the given cache,
+    by default the story cache, maps the URL, or else the URL itself.
+    So all the URLs of a story, whatever their section path, share its cache
+    entries.
+    """
+    extractor = ex.get_extractor(url, ex.nzherald)
+    story_id = extractor.get_story_id(url)
+    if story_id is not None:
+        return f"{extractor.name}:{story_id}"
+    cache = ca.cache if cache is None else cache
+    return cache.get(f"alias:{url}") or url
+
+
+def make_story_key(story: dict) -> str:
+    """
+    Return the key under which to cache the given parsed story, from the story ID
+    in its URL or, failing that, on its page.
+    """
+    url = story["url"]
+    extractor = ex.get_extractor(url, ex.nzherald)
+    story_id = extractor.get_story_id(url) or story.get("id")
+    return f"{extractor.name}:{story_id}" if story_id else url
+
+
+def hash_content(story: dict) -> str:
+    """
+    Return the hash of the title and elements of the given parsed story.
+    """
+    return ca.hash_key(json.dumps([story["title"], story["elements"]], sort_keys=True))
+
+
+def get_content_hash(story: dict) -> str:
+    """
+    Return the content hash of the given parsed story (see :func:`hash_content`),
+    under which its rendering is cached, so that stories of the same content share
+    one.
+    """
+    return story.get("content_hash") or hash_content(story)
+
+
+def record_alias(url: str, key: str) -> None:
+    """
+    Map the given normalized URL to the given story key in the alias index, unless
+    this process has already.
+    """
+    if url in _known_aliases:
+        return
+    if len(_known_aliases) >= 100_000:
+        _known_aliases.clear()
+    ca.cache.set(f"alias:{url}", key)
+    _known_aliases.add(url)
+
+
+def get_cached_story(url: str, stale: bool = False) -> dict | None:
+    """
+    Return the cached parsed story at the given normalized URL, or ``None`` if
+    there is no fresh one (see :meth:`cache.LocalCache.get`).
+    """
+    return ca.cache.get(f"article:{get_story_key(url)}", stale=stale)
+
+
+def get_cached_render(story: dict) -> dict | None:
+    """
+    Return the cached rendering of the given parsed story, or ``None`` if there is
+    none.
+    """
+    return ca.cache.get(f"render:{get_content_hash(story)}")
+
+
+def cache_render(story: dict, rendered: dict) -> None:
+    """
+    Cache the given rendering of the given parsed story and write it to this
+    node's render files.
+    """
+    ca.cache.set(f"render:{get_content_hash(story)}", rendered)
+    ca.render_files.set(make_story_key(story), rendered)
+
+
+def cache_story(story: dict, rendered: dict | None = None) -> None:
+    """
+    Cache the given parsed story under its story key (see :func:`make_story_key`),
+    with its content hash in the key ``"content_hash"``, and map its URL to it in
+    the alias index if the URL doesn't have the story's ID.
+    Cache the given rendered story with it (see :func:`cache_render`), or, if none
+    is given, drop the render files of the story's previous version.
+    """
+    url = story["url"]
+    key = make_story_key(story)
+    story["content_hash"] = hash_content(story)
+    ca.cache.set(f"article:{key}", story)
+    if key != url and ex.get_extractor(url, ex.nzherald).get_story_id(url) is None:
+        record_alias(url, key)
+    if rendered is None:
+        ca.render_files.delete(key)
+    else:
+        cache_render(story, rendered)
+
+
+def get_store_key(url: str) -> str:
+    """
+    Return the key under which the Dash server-side store keeps the story at the
+    given URL, as its ``"url"`` has it, while it's read.
+    """
+    return f"story-{ca.hash_key(url)}"
+
+
+def purge_story(url: str) -> bool:
+    """
+    Delete the story at the given normalized URL, its rendering, and its alias
+    from the caches of all nodes, along with its render files and story store
+    entries, so that its next read fetches it afresh.
+    Return ``True`` if the story was cached.
+    """
+    key = get_story_key(url)
+    story = ca.cache.get(f"article:{key}", stale=True)
+    ca.cache.delete(f"article:{key}")
+    ca.delete_on_nodes("render_files", key)
+    store_urls = {url}
+    if story is not None:
+        ca.cache.delete(f"render:{get_content_hash(story)}")
+        # Stored under the URL it was fetched by, which may be another alias
+        store_urls.add(story["url"])
+    for store_url in store_urls:
+        ca.delete_on_nodes("story_store", get_store_key(store_url))
+    ca.cache.delete(f"alias:{url}")
+    _known_aliases.discard(url)
+    return story is not None
+
+
+def store_story(story: dict, rendered: dict | None = None) -> None:
+    """
+    Stamp the given parsed story with the time in the key ``"fetched_at"``,
+    then cache (see :func:`cache_story`) and index it.
+    """
+    story["fetched_at"] = time.time()
+    cache_story(story, rendered)
+    si.index_story(story)
+
+
+def fetch_story(url: str) -> dict | None:
+    """
+    Fetch, parse, render, and store the story at the given normalized URL from
+    upstream and return it, or return ``None`` if the story can't be fetched or
+    parsed.
+    Raise an :class:`UpstreamUnavailable` if the fetch is turned away (see
+    :func:`fetch_page`).
+    """
+    import requests
+
+    try:
+        r = fetch_page(url)
+    except requests.RequestException as e:
+        logger.warning(f"Failed to fetch {url}: {e}")
+        return None
+
+    if r.status_code != 200:
+        return None
+
+    try:
+        story, rendered = parse_page(r.content, r.encoding or "utf-8", url)
+    except (IndexError, KeyError, ValueError) as e:
+        logger.warning(f"Failed to parse {url}: {e}")
+        return None
+
+    store_story(story, rendered)
+    return story
+
+
+def get_story(url: str) -> dict | None:
+    """
+    Return the parsed story (output of :func:`parse_story`) at the given URL,
+    from the cache if possible, otherwise from upstream.
+    Return ``None`` if the story can't be fetched or parsed.
+    If the upstream fetch is turned away, then return the stale cached story, if
+    any, or else raise an :class:`UpstreamUnavailable`.
+    """
+    url = normalize_url(url)
+    key = get_story_key(url)
+    story = ca.cache.get(f"article:{key}")
+    if story is None:
+        try:
+            story = fetch_story(url)
+        except UpstreamUnavailable:
+            story = ca.cache.get(f"article:{key}", stale=True)
+            if story is None:
+                raise
+    elif story["url"] != url:
+        # Another URL of the story, which the dedup report counts
+        record_alias(url, key)
+    return story
+
+
+def refresh_story(url: str, max_age: float) -> dict | None:
+    """
+    Return the story at the given URL like :func:`get_story`, but fetch it again
+    from upstream if it was fetched more than ``max_age`` seconds ago.
+    Concurrent refreshes of a story in this process share one upstream fetch.
+    If the upstream fetch is turned away, then return the stale cached story, if
+    any.
+    """
+    url = normalize_url(url)
+    key = get_story_key(url)
+    with _refresh_locks[hash(key) % len(_refresh_locks)]:
+        story = ca.cache.get(f"article:{key}")
+        if story is None or time.time() - story.get("fetched_at", 0) > max_age:
+            try:
+                story = fetch_story(url)
+            except UpstreamUnavailable:
+                story = ca.cache.get(f"article:{key}", stale=True)
+    return story
+
+
+def get_parse_pool() -> cf.ProcessPoolExecutor:
+    """
+    Return this process's pool of story parsing processes, creating it if
+    necessary.
+    The processes persist, and they start with the parsing and rendering
+    dependencies imported.
+    """
+    global _parse_pool
+
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Don't fork the threads of a Gunicorn worker, but fork the parsing
+            # processes from a server that imports the dependencies once
+            context = mp.get_context("forkserver")
+            context.set_forkserver_preload(
+                ["bs4", "markdownify", "requests", "extractors", "rendering", "stories"]
+            )
+            _parse_pool = cf.ProcessPoolExecutor(
+                max_workers=st.config.PARSE_PROCESSES, mp_context=context
+            )
+    return _parse_pool
+
+
+def start_parse_pool() -> None:
+    """
+    Start this process's parsing processes now rather than on first use, without
+    waiting for them.
+    Call this in each Gunicorn worker if ``PARSE_MODE`` is ``"process"``.
+    """
+    pool = get_parse_pool()
+    for __ in range(st.config.PARSE_PROCESSES):
+        pool.submit(import_dependencies)
+
+
+def _fetch_for_batch(url: str, work: tuple[str, str]) -> dict:
+    """
+    Get the story at the given URL for :func:`get_stories`, fetching it in the
+    given priority class on behalf of the given user (see :func:`scheduler.work`),
+    and return its report.
+    """
+    import requests
+
+    report = {"url": url, "story": None, "error": None, "cached": False}
+    t = time.perf_counter()
+    story = get_cached_story(url)
+    if story is not None:
+        report |= {"story": story, "cached": True}
+    else:
+        try:
+            # Wait for a fetch slot, since the batch is bounded anyway
+            with sch.work(*work):
+                r = fetch_page(url, wait=st.config.UPSTREAM_TIMEOUT)
+            r.raise_for_status()
+            report["fetch_time"] = time.perf_counter() - t
+            story, rendered = parse_page(
+                r.content, r.encoding or "utf-8", url, pooled=True
+            )
+        except UpstreamUnavailable as e:
+            story = get_cached_story(url, stale=True)
+            if story is not None:
+                report |= {"story": story, "cached": True}
+            else:
+                report["error"] = f"Upstream unavailable: {e}"
+        except requests.RequestException as e:
+            report["error"] = f"Fetch failed: {e}"
+        except (IndexError, KeyError, ValueError) as e:
+            report["error"] = f"Parse failed: {e}"
+        else:
+            store_story(story, rendered)
+            report["story"] = story
+
+    report["time"] = time.perf_counter() - t
+    return report
+
+
+def get_stories(urls: list[str]) -> list[dict]:
+    """
+    Get the stories at the given URLs concurrently, fetching the uncached ones
+    from upstream in a bounded thread pool and parsing and rendering them in the
+    parsing processes.
+    Return a list of reports in the order of the (normalized and deduplicated)
+    URLs, each a dictionary with the keys
+
+    - ``"url"``: the normalized URL
+    - ``"story"``: the parsed story or ``None`` if it failed
+    - ``"error"``: ``None`` or a message explaining the failure
+    - ``"cached"``: ``True`` if the story came from the cache
+    - ``"time"``: seconds taken to get the story
+    - ``"fetch_time"`` (uncached stories only): seconds taken to fetch the page
+
+    A story that fails or times out doesn't hold up the others.
+    """
+    urls = list(dict.fromkeys(normalize_url(url) for url in urls))
+    # The pool's threads don't share this thread's context
+    work = sch.get_work()
+    with cf.ThreadPoolExecutor(max_workers=st.config.BATCH_MAX_WORKERS) as executor:
+        return list(executor.map(_fetch_for_batch, urls, [work] * len(urls)))
+
+
+def get_dedup_report() -> dict:
+    """
+    Return how much keying stories by ID and renderings by content hash
+    deduplicates this node's story cache, as a dictionary with the keys
+
+    - ``"stories"``: the number of cached stories
+    - ``"urls"``: the number of URLs of those stories seen, each story's own and
+      its aliases (see :func:`record_alias`)
+    - ``"contents"``: the number of distinct contents of those stories, whose
+      renderings are each cached once
+    - ``"images"`` and ``"distinct_images"``: the number of image elements of the
+      stories and of distinct image URLs among them, which the stories link to
+      rather than store, so that browsers and the image resizer fetch shared
+      images once
+    - ``"bytes"``: the size of the cached stories and renderings
+    - ``"bytes_saved"``: the size that caching each URL's story and rendering
+      apart would have added
+    - ``"url_ratio"``, ``"content_ratio"``, and ``"image_ratio"``: the ratios of
+      URLs to stories, of stories to contents, and of images to distinct images
+
+    """
+    stories = {}
+    aliases = collections.defaultdict(set)
+    render_bytes = {}
+    for key, value in ca.local_cache.items():
+        kind, __, rest = key.partition(":")
+        if kind == "article":
+            stories[rest] = value
+        elif kind == "alias":
+            aliases[value].add(rest)
+        elif kind == "render":
+            render_bytes[rest] = len(json.dumps(value))
+
+    contents = collections.Counter(get_content_hash(story) for story in stories.values())
+    images = [
+        el["src"]
+        for story in stories.values()
+        for el in story["elements"]
+        if el["type"] == "image"
+    ]
+    n_bytes = saved = n_urls = 0
+    for key, story in stories.items():
+        n = len(aliases[key] - {story["url"]})
+        n_urls += 1 + n
+        size = len(json.dumps(story))
+        n_bytes += size
+        saved += n * (size + render_bytes.get(get_content_hash(story), 0))
+    for content_hash, n in contents.items():
+        n_bytes += render_bytes.get(content_hash, 0)
+        saved += (n - 1) * render_bytes.get(content_hash, 0)
+
+    report = {
+        "stories": len(stories),
+        "urls": n_urls,
+        "contents": len(contents),
+        "images": len(images),
+        "distinct_images": len(set(images)),
+        "bytes": n_bytes,
+        "bytes_saved": saved,
+    }
+    report["url_ratio"] = report["urls"] / max(report["stories"], 1)
+    report["content_ratio"] = report["stories"] / max(report["contents"], 1)
+    report["image_ratio"] = report["images"] / max(report["distinct_images"], 1)
+    return report
+
+
+# Add a command line interface
+@click.group()
+def cli():
+    """
+    A basic set of commands for inspecting the story cache.
+    """
+    pass
+
+
+@cli.command("dedup-report")
+def dedup_report_command() -> None:
+    """
+    Print how much this node's story cache is deduplicated across story URLs,
+    contents, and images.
+    """
+    r = get_dedup_report()
+    click.echo(
+        f"{r['urls']} URLs -> {r['stories']} stories ({r['url_ratio']:.2f}:1)\n"
+        f"{r['stories']} stories -> {r['contents']} renderings "
+        f"({r['content_ratio']:.2f}:1)\n"
+        f"{r['images']} images -> {r['distinct_images']} distinct "
+        f"({r['image_ratio']:.2f}:1)\n"
+        f"{r['bytes'] / 2**20:.1f} MiB cached, {r['bytes_saved'] / 2**20:.1f} MiB "
+        "saved against caching by URL"
+    )
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,16 +1,46 @@
+import concurrent.futures as cf
+import csv
+import itertools as it
+import json
+import pathlib as pl
+import sqlite3
+import time
+from typing import Iterator
+
 import click
 import flask_sqlalchemy as fsa
 import sqlalchemy as sa
+import sqlalchemy.dialects.sqlite as sads
 import sqlalchemy.sql as sas
 import werkzeug.security as ws
 
 import settings as st
 
-engine = sa.create_engine(st.config.SQLALCHEMY_DATABASE_URI)
+
+@sa.event.listens_for(sa.engine.Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Set the ``SQLITE_PRAGMAS`` setting on each new SQLite connection of any engine,
+    so that the app's engine and the command line interface's engine share them.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for name, value in st.config.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+# The app's engine, which Flask-SQLAlchemy creates, has the same options
+engine = sa.create_engine(
+    st.config.SQLALCHEMY_DATABASE_URI, **st.config.SQLALCHEMY_ENGINE_OPTIONS
+)
 db = fsa.SQLAlchemy()
 
 
 class User(db.Model):
+    # Users are looked up by ID (on every request) and by username (on login and
+    # removal), both of which are indexed, as are email addresses via their unique
+    # constraint; see benchmarks/user_db.py
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True)
     email = db.Column(db.String(50), unique=True)
@@ -22,6 +52,75 @@ class User(db.Model):
 
 user_table = sa.Table("user", User.metadata)
 
+# Columns of the files of users that the import and export commands read and write
+USER_FIELDS = ["username", "email", "password", "password_hash"]
+
+
+def get_file_format(file, file_format: str | None) -> str:
+    """
+    Return the given file format (``"csv"`` or ``"jsonl"``) or, if that's ``None``,
+    the format of the given file by its suffix.
+    """
+    if file_format is None:
+        file_format = "jsonl" if pl.Path(file.name).suffix == ".jsonl" else "csv"
+    return file_format
+
+
+def read_users(file, file_format: str) -> Iterator[dict]:
+    """
+    Yield the users of the given CSV or JSON Lines file one at a time, as
+    dictionaries with the keys of ``USER_FIELDS``, the missing ones set to ``None``.
+    """
+    if file_format == "csv":
+        rows = csv.DictReader(file)
+    else:
+        rows = (json.loads(line) for line in file if line.strip())
+    for row in rows:
+        yield {field: row.get(field) or None for field in USER_FIELDS}
+
+
+def hash_passwords(batch: list[dict], pool: cf.ProcessPoolExecutor) -> Iterator[str]:
+    """
+    Start hashing the passwords of the given users in the given process pool and
+    return an iterator of their password hashes.
+    Users given with a password hash keep it.
+    """
+    passwords = [u["password"] for u in batch if u["password_hash"] is None]
+    # Hashing a password takes tens of milliseconds, which dwarfs the overhead of
+    # a task
+    hashes = pool.map(ws.generate_password_hash, passwords, chunksize=8)
+    return (
+        next(hashes) if u["password_hash"] is None else u["password_hash"] for u in batch
+    )
+
+
+def upsert_users(conn, rows: list[dict]) -> int:
+    """
+    Insert the given user rows, updating the email addresses and passwords of the
+    existing users with the same usernames, and return the number of rows written.
+    If a row conflicts with another user's email address, then write the others
+    and skip it.
+    """
+    insert = sads.insert(user_table)
+    upsert = insert.on_conflict_do_update(
+        index_elements=["username"],
+        set_={"email": insert.excluded.email, "password": insert.excluded.password},
+    )
+    try:
+        with conn.begin_nested():
+            conn.execute(upsert, rows)
+        return len(rows)
+    except sa.exc.IntegrityError:
+        n = 0
+        for row in rows:
+            try:
+                with conn.begin_nested():
+                    conn.execute(upsert, row)
+                n += 1
+            except sa.exc.IntegrityError:
+                click.echo(f"Skipped user {row['username']}: email address taken")
+        return n
+
 
 # Add a command line interface
 @click.group()
@@ -71,6 +170,105 @@ def remove_user(username: str) -> None:
     click.echo(f"Removed user {username}")
 
 
+@cli.command()
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format; by default, taken from the file suffix",
+)
+@click.option("--batch-size", default=500, help="Users written per transaction")
+@click.option("--processes", type=int, help="Password hashing processes")
+def import_users(file, file_format: str, batch_size: int, processes: int) -> None:
+    """
+    Add or update the users in the given CSV or JSON Lines file (or ``-`` for
+    standard input), which has the fields username, email, and password or
+    password_hash (as written by ``export-users --hashes``).
+    Hash the passwords in a process pool, while writing the previous batch of
+    users to the database in one transaction.
+    """
+    file_format = get_file_format(file, file_format)
+    users = read_users(file, file_format)
+    n_read = n_written = 0
+    t = time.perf_counter()
+    with cf.ProcessPoolExecutor(processes) as pool, engine.connect() as conn:
+        previous = None
+        while True:
+            batch = []
+            for user in it.islice(users, batch_size):
+                n_read += 1
+                if user["username"] and (user["password"] or user["password_hash"]):
+                    batch.append(user)
+                else:
+                    click.echo(f"Skipped line {n_read}: missing username or password")
+            current = (batch, hash_passwords(batch, pool)) if batch else None
+
+            if previous is not None:
+                rows = [
+                    {"username": u["username"], "email": u["email"], "password": h}
+                    for u, h in zip(*previous)
+                ]
+                n_written += upsert_users(conn, rows)
+                conn.commit()
+                click.echo(f"Wrote {n_written} users", err=True)
+
+            if current is None:
+                break
+            previous = current
+
+    t = time.perf_counter() - t
+    click.echo(
+        f"Imported {n_written} of {n_read} users in {t:.1f} s "
+        f"({n_written / t:.0f} users/s)"
+    )
+
+
+@cli.command()
+@click.argument("file", type=click.File("w", encoding="utf-8"))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="File format; by default, taken from the file suffix",
+)
+@click.option("--hashes", is_flag=True, help="Include the password hashes")
+def export_users(file, file_format: str, hashes: bool) -> None:
+    """
+    Write the users (username, email address, and optionally password hash) in the
+    database to the given CSV or JSON Lines file (or ``-`` for standard output),
+    streaming them from the database.
+    """
+    file_format = get_file_format(file, file_format)
+    columns = [user_table.c.username, user_table.c.email]
+    fields = ["username", "email"]
+    if hashes:
+        columns.append(user_table.c.password)
+        fields.append("password_hash")
+
+    if file_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(fields)
+        write = writer.writerow
+    else:
+
+        def write(row):
+            file.write(json.dumps(dict(zip(fields, row))) + "\n")
+
+    n = 0
+    t = time.perf_counter()
+    with engine.connect() as conn:
+        rows = conn.execution_options(yield_per=1000).execute(
+            sas.select(*columns).order_by(user_table.c.id)
+        )
+        for row in rows:
+            write(row)
+            n += 1
+
+    t = time.perf_counter() - t
+    click.echo(f"Exported {n} users in {t:.1f} s ({n / t:.0f} users/s)", err=True)
+
+
 @cli.command()
 def list_users() -> str:
     """
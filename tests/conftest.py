@@ -0,0 +1,64 @@
+import collections
+import sys
+
+import flask_login as fl
+import pytest
+
+from .context import ROOT, settings
+import cache as ca
+import stories as sto
+
+# Append, since some benchmarks share their names with app modules
+sys.path.append(f"{ROOT}/benchmarks")
+import standin
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """
+    Give the app an empty story cache, render files, and story store of its own.
+    """
+    local = ca.LocalCache(tmp_path / "cache", max_items=16, ttl=3600)
+    monkeypatch.setattr(ca, "cache", local)
+    monkeypatch.setattr(ca, "local_cache", local)
+    monkeypatch.setattr(
+        ca, "render_files", ca.EncodedFiles(tmp_path / "renders", ttl=3600)
+    )
+    monkeypatch.setattr(
+        ca,
+        "story_store",
+        ca.StoryStore(tmp_path / "store", max_bytes=2**20, threshold=100),
+    )
+    monkeypatch.setattr(sto, "_known_aliases", set())
+    return local
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Point the app at a stand-in NZ Herald (see ``benchmarks/standin.py``), with no
+    rate limit and fresh circuit breakers, and return the stand-in server.
+    """
+    server = standin.start()
+    monkeypatch.setattr(settings.config, "UPSTREAM_BASE_URL", server.base_url)
+    monkeypatch.setattr(sto, "rate_limiter", sto.HostRateLimiter(10_000))
+    monkeypatch.setattr(
+        sto, "breakers", collections.defaultdict(sto.breakers.default_factory)
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def reader():
+    """
+    Run the test in a request to the app by a logged-in reader, and return the
+    reader.
+    """
+    import app as ap
+
+    user = ap.User(id=1, username="reader")
+    with ap.app.server.test_request_context("/"):
+        fl.login_user(user)
+        yield user
@@ -1,11 +1,21 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-sys.path.insert(0, ROOT)
+# The app's modules import each other by their plain names
+sys.path.insert(0, os.path.join(ROOT, "nzharold"))
 
-import nzherald
+# Keep the caches, search index, and archive of the tests out of the project
+TMP_DIR = Path(tempfile.mkdtemp(prefix="nzharold-tests-"))
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ["CACHE_DIR"] = str(TMP_DIR / "cache")
+os.environ["SEARCH_DB_PATH"] = str(TMP_DIR / "search.sqlite")
+os.environ["ARCHIVE_DIR"] = str(TMP_DIR / "archive")
+os.environ["STATIC_DIR"] = str(TMP_DIR / "static")
+
+import settings
 
 
 TEST_DATA_DIR = Path(ROOT) / "tests" / "data"
@@ -0,0 +1,123 @@
+import datetime as dt
+import types
+
+import pytest
+
+from .context import settings
+import archive as ar
+import stories as sto
+
+URL = "https://www.nzherald.co.nz/nz/a-story/ABCDEFGHIJKLMNOPQRSTUVWXYZ/"
+
+
+def make_response(content: bytes, status_code: int = 200, url: str = URL):
+    return types.SimpleNamespace(
+        url=url,
+        status_code=status_code,
+        reason="OK",
+        headers={
+            "Content-Type": "text/html; charset=utf-8",
+            "Content-Encoding": "gzip",
+        },
+        content=content,
+        request=types.SimpleNamespace(headers={"User-Agent": "nzharold"}),
+        elapsed=dt.timedelta(seconds=0.25),
+    )
+
+
+def test_write_and_find(tmp_path):
+    archive = ar.Archive(tmp_path)
+    assert archive.find(URL) is None
+
+    archive.write(URL, {"User-Agent": "nzharold"}, make_response(b"<p>One</p>"), 0.5)
+    archive.write(URL, {}, make_response(b"<p>Two</p>", 404), 0.25)
+    found = archive.find(URL)
+    # The latest response, with the body decoded
+    assert found["status"] == 404
+    assert found["content"] == b"<p>Two</p>"
+    assert found["fetch_time"] == 0.25
+    assert found["headers"] == {
+        "content-type": "text/html; charset=utf-8",
+        "content-length": "10",
+    }
+    assert archive.find(URL.replace("nz/", "world/")) is None
+
+    # Request and response records per fetch
+    [path] = archive.paths()
+    records = [fields for __, fields, __, __ in archive.iter_records(path)]
+    assert [r["warc-type"] for r in records] == ["request", "response"] * 2
+    assert records[0]["warc-concurrent-to"] == records[1]["warc-record-id"]
+
+
+def test_find_skips_incomplete_records(tmp_path):
+    archive = ar.Archive(tmp_path)
+    archive.write(URL, {}, make_response(b"<p>One</p>"), 0.5)
+    [path] = archive.paths()
+    # A record still being written by another process
+    record = ar.make_record("response", URL, b"HTTP/1.1 200 OK\r\n\r\nTwo")
+    with path.open("ab") as tgt:
+        tgt.write(record[:-10])
+
+    assert ar.Archive(tmp_path).find(URL)["content"] == b"<p>One</p>"
+
+
+def test_new_files_and_pruning(tmp_path, monkeypatch):
+    # A new file name per second
+    stamps = iter(f"2026010100000{i}" for i in range(10))
+    strftime = ar.time.strftime
+    monkeypatch.setattr(
+        ar.time,
+        "strftime",
+        lambda format, *args: strftime(format, *args) if args else next(stamps),
+    )
+    archive = ar.Archive(tmp_path, file_bytes=1, max_bytes=2000)
+    for i in range(5):
+        archive.write(f"{URL}{i}", {}, make_response(b"x" * 500), 0.1)
+
+    # A file per fetch, and the oldest files go
+    paths = archive.paths()
+    assert 1 < len(paths) < 5
+    assert paths[-1].name.startswith("upstream-20260101000004-")
+    # Pruned on starting the newest file
+    assert sum(p.stat().st_size for p in paths[:-1]) <= 2000
+    assert archive.find(f"{URL}0") is None
+    assert archive.find(f"{URL}4") is not None
+
+
+def test_record_and_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(ar, "archive", ar.Archive(tmp_path))
+    assert ar.replay(URL) is None
+
+    ar.record(URL, make_response("<p>Kia ora</p>".encode()))
+    ar._queue.join()
+    r = ar.replay(URL)
+    assert r.status_code == 200
+    assert r.encoding == "utf-8"
+    assert r.text == "<p>Kia ora</p>"
+    assert r.elapsed == dt.timedelta(seconds=0.25)
+    assert "Content-Encoding" not in r.headers
+
+
+def test_fetch_page_replays(cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(ar, "archive", ar.Archive(tmp_path))
+    monkeypatch.setattr(settings.config, "ARCHIVE_MODE", "replay")
+    with pytest.raises(sto.UpstreamUnavailable):
+        sto.fetch_page(URL)
+
+    ar.archive.write(URL, {}, make_response(b"<p>Archived</p>"), 0.1)
+    assert sto.fetch_page(URL).content == b"<p>Archived</p>"
+
+
+def test_fetch_page_records_and_fails_over(cache, upstream, tmp_path, monkeypatch):
+    monkeypatch.setattr(ar, "archive", ar.Archive(tmp_path))
+    monkeypatch.setattr(settings.config, "ARCHIVE_MODE", "record")
+    monkeypatch.setattr(settings.config, "ARCHIVE_FAILOVER", True)
+    content = sto.fetch_page(URL).content
+    ar._queue.join()
+    assert ar.archive.find(URL)["content"] == content
+
+    upstream.failure_rate = 1
+    r = sto.fetch_page(URL)
+    assert r.status_code == 200
+    assert r.content == content
+    assert upstream.n_requests == 2
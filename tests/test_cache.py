@@ -0,0 +1,332 @@
+import gzip
+import json
+import os
+import time
+import types
+
+import flask
+import pytest
+import werkzeug.http
+
+from .context import settings
+import cache as ca
+
+
+NODES = ["http://a", "http://b", "http://c"]
+KEYS = [f"article:{i}" for i in range(3000)]
+
+
+class FakePeers:
+    """
+    The local caches of a cluster of nodes, which the nodes' sharded caches reach
+    in place of HTTP requests, with the nodes in ``down`` failing to respond.
+    """
+
+    def __init__(self, tmp_path, nodes):
+        self.locals = {
+            node: ca.LocalCache(tmp_path / node.split("//")[1], ttl=60) for node in nodes
+        }
+        self.down = set()
+        self.requests = []
+
+    def make_cache(self, node, peers, **kwargs):
+        cache = ca.ShardedCache(self.locals[node], node, peers, token="t", **kwargs)
+
+        def request(method, peer, key, value=None, **params):
+            self.requests.append((method, peer, key))
+            if peer in self.down:
+                cache._mark_down(peer, OSError("down"))
+                return None
+            cache._down.pop(peer, None)
+            local = self.locals[peer]
+            if method == "GET":
+                value = local.get(key, stale=bool(params.get("stale")))
+                return types.SimpleNamespace(
+                    status_code=204 if value is None else 200, json=lambda: value
+                )
+            if method == "PUT":
+                local.set(key, value)
+            else:
+                local.delete(key)
+            return types.SimpleNamespace(status_code=204)
+
+        cache._request = request
+        return cache
+
+
+def test_local_cache_syncs_deletes(tmp_path):
+    # Two processes, as it were
+    first = ca.LocalCache(tmp_path, ttl=60)
+    second = ca.LocalCache(tmp_path, ttl=60)
+    first.set("a", 1)
+    first.set("b", 2)
+    assert second.get("a") == 1
+    assert second.get("b") == 2
+
+    first.delete("a")
+    assert "a" in second._memory
+    assert second.sync_deletes() == 1
+    assert "a" not in second._memory
+    assert second.get("a") is None
+    assert second.get("b") == 2
+    # Each deletion is read once
+    assert second.sync_deletes() == 0
+    # New processes start at the end of the log, having nothing in memory
+    assert ca.LocalCache(tmp_path, ttl=60).sync_deletes() == 0
+
+
+def test_local_cache_rotates_delete_log(tmp_path):
+    first = ca.LocalCache(tmp_path, ttl=60)
+    second = ca.LocalCache(tmp_path, ttl=60)
+    for key in ["a", "b", "c"]:
+        first.set(key, key)
+        second.get(key)
+
+    first.delete("a")
+    first.compact()
+    assert first._delete_log.read_text() == ""
+    # The rest of the old log is read after the rotation
+    first.delete("b")
+    assert second.sync_deletes() == 2
+    assert list(second._memory) == ["c"]
+
+    first.delete("c")
+    first.compact()
+    assert first._old_delete_log.read_text() == '"b"\n"c"\n'
+    assert second.sync_deletes() == 1
+    assert not second._memory
+
+
+def test_local_cache_compact(tmp_path):
+    cache = ca.LocalCache(tmp_path, ttl=60)
+    for key in ["old", "stale", "new"]:
+        cache.set(key, key)
+    for key, age in [("old", 3600), ("stale", 120)]:
+        path = cache._path(key)
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    assert cache.compact(keep_stale=600) == 1
+    assert cache.get("stale", stale=True) == "stale"
+    assert cache.compact() == 1
+    assert cache.get("new") == "new"
+    assert ca.LocalCache(tmp_path).compact() == 0
+
+
+def test_hash_ring_get_nodes():
+    ring = ca.HashRing(NODES)
+    for key in KEYS[:100]:
+        nodes = ring.get_nodes(key, 3)
+        assert sorted(nodes) == NODES
+        # Placement is deterministic
+        assert ca.HashRing(reversed(NODES)).get_nodes(key, 3) == nodes
+        assert ring.get_nodes(key) == nodes[:1]
+        assert ring.get_nodes(key, 3, exclude=[nodes[0]]) == nodes[1:]
+
+    assert ca.HashRing().get_nodes("key") == []
+
+
+def test_hash_ring_spreads_keys():
+    ring = ca.HashRing(NODES)
+    owners = [ring.get_nodes(key)[0] for key in KEYS]
+    for node in NODES:
+        assert owners.count(node) > 0.2 * len(KEYS)
+
+
+def test_hash_ring_add_moves_keys_to_new_node_only():
+    ring = ca.HashRing(NODES)
+    before = {key: ring.get_nodes(key)[0] for key in KEYS}
+    ring.add("http://d")
+    after = {key: ring.get_nodes(key)[0] for key in KEYS}
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "http://d" for key in moved)
+    # About a quarter of the keys move
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+    # The new node takes over keys from their next node on the ring
+    assert all(ring.get_nodes(key, 2)[1] == before[key] for key in moved)
+
+
+def test_hash_ring_remove_moves_keys_of_removed_node_only():
+    ring = ca.HashRing(NODES)
+    before = {key: ring.get_nodes(key, 2) for key in KEYS}
+    ring.remove("http://b")
+    assert ring.nodes == ["http://a", "http://c"]
+
+    for key in KEYS:
+        owner, successor = before[key]
+        expected = successor if owner == "http://b" else owner
+        assert ring.get_nodes(key)[0] == expected
+
+
+def test_sharded_cache_stores_on_owner(tmp_path):
+    peers = FakePeers(tmp_path, NODES)
+    cache = peers.make_cache("http://a", NODES)
+    for key in KEYS[:30]:
+        cache.set(key, {"key": key})
+        owner = cache.ring.get_nodes(key)[0]
+        for node, local in peers.locals.items():
+            assert (local.get(key) is not None) == (node == owner)
+        assert cache.get(key) == {"key": key}
+
+    cache.delete(KEYS[0])
+    assert cache.get(KEYS[0]) is None
+
+
+def test_sharded_cache_marks_down_and_fails_over(tmp_path):
+    peers = FakePeers(tmp_path, NODES)
+    cache = peers.make_cache("http://a", NODES, retry_after=30)
+    key = next(k for k in KEYS if cache.ring.get_nodes(k)[0] == "http://b")
+    peers.down.add("http://b")
+
+    # The value falls back to this node
+    cache.set(key, 1)
+    assert "http://b" in cache._down
+    assert peers.locals["http://a"].get(key) == 1
+
+    # While down, the peer gets no requests
+    peers.requests.clear()
+    assert cache.get(key) == 1
+    assert all(peer != "http://b" for __, peer, __ in peers.requests)
+
+    # After the retry period, the peer is asked again
+    peers.down.clear()
+    cache._down["http://b"] = 0
+    cache.set(key, 2)
+    assert "http://b" not in cache._down
+    assert peers.locals["http://b"].get(key) == 2
+
+
+def test_sharded_cache_hands_off_to_joining_node(tmp_path):
+    peers = FakePeers(tmp_path, NODES + ["http://d"])
+    old = peers.make_cache("http://a", NODES)
+    for key in KEYS[:200]:
+        old.set(key, key)
+
+    new = peers.make_cache("http://a", NODES + ["http://d"])
+    moved = [k for k in KEYS[:200] if new.ring.get_nodes(k)[0] == "http://d"]
+    assert moved
+    for key in moved:
+        assert peers.locals["http://d"].get(key) is None
+        assert new.get(key) == key
+        # The value was handed off to its new owner
+        assert peers.locals["http://d"].get(key) == key
+
+
+def test_sharded_cache_deletes_node_tiers_everywhere(tmp_path, monkeypatch):
+    render_files = ca.EncodedFiles(tmp_path / "renders", ttl=60)
+    monkeypatch.setattr(ca, "render_files", render_files)
+    cache = ca.ShardedCache(ca.LocalCache(tmp_path / "a"), NODES[0], NODES, token="t")
+    requests = []
+    cache._request = lambda method, peer, key, **params: requests.append(
+        (method, peer, key, params)
+    )
+    render_files.set("k", 1)
+    monkeypatch.setattr(ca, "cache", cache)
+
+    ca.delete_on_nodes("render_files", "k")
+    assert render_files.size()[0] == 0
+    assert requests == [
+        ("DELETE", peer, "k", {"tier": "render_files"}) for peer in NODES[1:]
+    ]
+
+
+def test_make_cache_requires_peer_settings(tmp_path):
+    def make_config(**kwargs):
+        return type("Config", (settings.config,), {"CACHE_DIR": tmp_path} | kwargs)
+
+    assert isinstance(ca.make_cache(make_config(CACHE_PEERS=[])), ca.LocalCache)
+
+    with pytest.raises(ValueError, match="CACHE_PEER_TOKEN"):
+        ca.make_cache(
+            make_config(CACHE_PEERS=NODES, CACHE_NODE=NODES[0], CACHE_PEER_TOKEN=None)
+        )
+    with pytest.raises(ValueError, match="CACHE_NODE"):
+        ca.make_cache(
+            make_config(CACHE_PEERS=NODES, CACHE_NODE=None, CACHE_PEER_TOKEN="t")
+        )
+
+    cache = ca.make_cache(
+        make_config(CACHE_PEERS=NODES, CACHE_NODE=NODES[0], CACHE_PEER_TOKEN="t")
+    )
+    assert isinstance(cache, ca.ShardedCache)
+    assert cache.ring.nodes == NODES
+
+
+def test_peer_endpoint_requires_token(tmp_path, monkeypatch):
+    server = flask.Flask(__name__)
+    ca.init_app(server)
+    client = server.test_client()
+    url = "/_internal/cache?key=k"
+
+    # Without a token set, peers are refused whatever they send
+    monkeypatch.setattr(settings.config, "CACHE_PEER_TOKEN", None)
+    assert client.get(url, headers={"X-Cache-Token": ""}).status_code == 403
+
+    monkeypatch.setattr(settings.config, "CACHE_PEER_TOKEN", "t")
+    assert client.get(url, headers={"X-Cache-Token": "wrong"}).status_code == 403
+    assert client.get(url, headers={"X-Cache-Token": "t"}).status_code == 204
+
+    # Deletes from the other tiers of the node
+    monkeypatch.setattr(ca, "render_files", ca.EncodedFiles(tmp_path, ttl=60))
+    headers = {"X-Cache-Token": "t"}
+    url = "/_internal/cache?key=k&tier=render_files"
+    assert client.delete(url, headers=headers).status_code == 204
+    url = "/_internal/cache?key=k&tier=other"
+    assert client.delete(url, headers=headers).status_code == 400
+
+
+def accept(header: str):
+    return werkzeug.http.parse_accept_header(header)
+
+
+def test_encoded_files(tmp_path, monkeypatch):
+    files = ca.EncodedFiles(tmp_path, ttl=60)
+    value = {"content": ["Kiwi"] * 100}
+    files.set("k", value)
+
+    # Brotli is optional
+    brotli = ca.get_brotli()
+    path, encoding = files.find("k", accept("gzip, deflate, br"))
+    if brotli is None:
+        assert encoding == "gzip"
+    else:
+        assert encoding == "br"
+        assert json.loads(brotli.decompress(path.read_bytes())) == value
+    path, encoding = files.find("k", accept("gzip;q=1.0, br;q=0.5"))
+    assert encoding == "gzip"
+    assert json.loads(gzip.decompress(path.read_bytes())) == value
+    path, encoding = files.find("k", accept(""))
+    assert encoding == "identity"
+    assert json.loads(path.read_bytes()) == value
+
+    # Without brotli, there's gzip
+    monkeypatch.setattr(ca, "get_brotli", lambda: None)
+    files.set("k2", value)
+    assert files.find("k2", accept("br, gzip"))[1] == "gzip"
+    assert files.find("k2", accept("br"))[1] == "identity"
+
+    assert files.size()[0] == 2
+    assert files.find("missing", accept("gzip")) is None
+    files.delete("k")
+    assert files.find("k", accept("gzip")) is None
+    assert list(tmp_path.glob("*/*")) == list(tmp_path.glob("*/*.json*"))
+    assert len(list(tmp_path.glob("*/*"))) == 2
+
+
+def test_encoded_files_expire(tmp_path):
+    files = ca.EncodedFiles(tmp_path, ttl=60)
+    files.set("old", 1)
+    files.set("new", 2)
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / "abc.json.1.2.tmp").write_bytes(b"")
+    old = time.time() - 3601
+    for path in tmp_path.glob("*/*"):
+        if path.name.startswith(ca.hash_key("old")) or path.suffix == ".tmp":
+            os.utime(path, (old, old))
+
+    assert files.find("old", accept("gzip")) is None
+    assert files.find("new", accept("gzip")) is not None
+    # The old value's files and the temporary file
+    assert files.compact() == (4 if ca.get_brotli() else 3)
+    assert files.size()[0] == 1
+    assert files.find("new", accept("gzip")) is not None
@@ -0,0 +1,149 @@
+import pytest
+
+from .context import settings
+from .conftest import standin
+import extractors as ex
+
+
+@pytest.mark.parametrize(
+    "url, name",
+    [
+        ("https://www.nzherald.co.nz/nz/a-story/", "nzherald"),
+        ("http://NZHERALD.co.nz/nz/a-story/", "nzherald"),
+        ("www.nzherald.co.nz/nz/a-story/", "nzherald"),
+        ("  nzherald.co.nz", "nzherald"),
+        ("https://www.nzherald.co.nz:443/nz/", "nzherald"),
+        ("https://newsroom.co.nz/pro/a-story/", "newsroom"),
+        ("https://www.newsroom.co.nz/pro/a-story/?utm_source=x", "newsroom"),
+        # Hosts that only contain a registered domain
+        ("https://evil.com/?nzherald.co.nz", None),
+        ("evil.com/nzherald.co.nz/nz/a-story/", None),
+        ("https://nzherald.co.nz.evil.com/nz/a-story/", None),
+        ("https://notnzherald.co.nz/nz/a-story/", None),
+        ("https://evil.com#nzherald.co.nz", None),
+        ("https://evil.com@nzherald.co.nz/", None),
+        ("/nz/a-story/", None),
+        ("", None),
+    ],
+)
+def test_get_extractor(url, name):
+    extractor = ex.get_extractor(url)
+    assert (extractor and extractor.name) == name
+    assert ex.get_extractor(url, ex.nzherald) is (extractor or ex.nzherald)
+
+
+def test_normalize_url():
+    assert (
+        ex.nzherald.normalize_url(" nzherald.co.nz/nz/a-story/?ref=rss#top ")
+        == "https://www.nzherald.co.nz/nz/a-story/"
+    )
+    newsroom = ex.extractors["newsroom.co.nz"]
+    assert (
+        newsroom.normalize_url("http://newsroom.co.nz") == "https://www.newsroom.co.nz/"
+    )
+
+
+@pytest.mark.parametrize(
+    "url, path",
+    [
+        ("https://www.nzherald.co.nz/nz/a-story/", "/nz/a-story/"),
+        ("https://www.newsroom.co.nz/pro/a-story/", "/newsroom.co.nz/pro/a-story/"),
+        ("https://www.newsroom.co.nz/", "/newsroom.co.nz/"),
+    ],
+)
+def test_to_path_and_from_path(url, path):
+    assert ex.to_path(url) == path
+    assert ex.from_path(path) == url
+
+
+def test_from_path_of_nzherald_section():
+    # NZ Herald paths are served unprefixed, so its domain is part of the path
+    assert (
+        ex.from_path("/nzherald.co.nz/nz/")
+        == "https://www.nzherald.co.nz/nzherald.co.nz/nz/"
+    )
+    assert ex.from_path("/world/") == "https://www.nzherald.co.nz/world/"
+
+
+def test_get_story_id():
+    assert (
+        ex.nzherald.get_story_id(
+            "https://www.nzherald.co.nz/nz/a-story/YQMPIC4PJQWJCR2SF7AHYX3BO4/"
+        )
+        == "YQMPIC4PJQWJCR2SF7AHYX3BO4"
+    )
+    assert ex.nzherald.get_story_id("https://www.nzherald.co.nz/nz/a-story/") is None
+    assert (
+        ex.extractors["newsroom.co.nz"].get_story_id("https://newsroom.co.nz/a/") is None
+    )
+
+
+def test_register_checks_element_types(monkeypatch):
+    monkeypatch.setattr(ex, "extractors", dict(ex.extractors))
+
+    class Video(ex.Extractor):
+        domain = "video.example.com"
+        element_types = ("text", "video")
+
+    with pytest.raises(ValueError, match="video"):
+        ex.register(Video())
+    assert ex.get_extractor("https://video.example.com/a/") is None
+
+
+def test_nzherald_extract():
+    url = "https://www.nzherald.co.nz/nz/a-story/"
+    story = ex.nzherald.extract(standin.make_page("/nz/a-story/", 4), url)
+    assert story["url"] == url
+    assert story["source"] == "nzherald"
+    assert story["title"]
+    assert {el["type"] for el in story["elements"]} <= {"text", "image"}
+    assert len(story["elements"]) == 4
+
+    with pytest.raises(ValueError):
+        ex.nzherald.extract("<html><title>Not a story</title></html>", url)
+
+
+def test_newsroom_extract():
+    page = """
+    <html><head><title>A story | Newsroom</title></head>
+    <body>
+    <nav><p>Menu</p></nav>
+    <article id="post-123">
+      <h1>A <em>story</em></h1>
+      <div class="entry-content">
+        <p>First <a href="https://www.newsroom.co.nz/b/">paragraph</a>.</p>
+        <p> </p>
+        <figure>
+          <img data-src="/wp-content/kiwi.jpg" src="data:,">
+          <figcaption>A <b>kiwi</b></figcaption>
+        </figure>
+        <blockquote><p>Quoted</p></blockquote>
+        <ul><li>Item</li></ul>
+      </div>
+    </article>
+    </body></html>
+    """
+    newsroom = ex.extractors["newsroom.co.nz"]
+    url = "https://www.newsroom.co.nz/a-story/"
+    story = newsroom.extract(page, url)
+
+    assert story["title"] == "A story"
+    assert story["id"] == "post-123"
+    assert story["source"] == "newsroom"
+    assert story["elements"] == [
+        {
+            "type": "text",
+            "content": '<p>First <a href="https://www.newsroom.co.nz/b/">paragraph'
+            "</a>.</p>",
+        },
+        {
+            "type": "image",
+            "src": "https://www.newsroom.co.nz/wp-content/kiwi.jpg",
+            "caption": "A kiwi",
+        },
+        {"type": "text", "content": "<blockquote><p>Quoted</p></blockquote>"},
+        {"type": "text", "content": "<ul><li>Item</li></ul>"},
+    ]
+
+    with pytest.raises(ValueError):
+        newsroom.extract("<html><p>No article</p></html>", url)
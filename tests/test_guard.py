@@ -0,0 +1,119 @@
+import flask
+import flask_login as fl
+import pytest
+
+from .context import settings
+import guard as gu
+import stories as sto
+
+BROWSER = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+BOT = "Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko); compatible; GPTBot/1.1"
+
+
+def test_read_bot_user_agents(tmp_path):
+    path = tmp_path / "agents.txt"
+    path.write_text("GPTBot\n\n  CCBot \n")
+    assert gu.read_bot_user_agents(path) == ["GPTBot", "CCBot"]
+    assert gu.read_bot_user_agents(tmp_path / "missing.txt") == []
+
+
+def test_make_bot_matcher():
+    is_bot = gu.make_bot_matcher(["GPTBot", "Claude-Web", "a.b"])
+    assert is_bot(BOT)
+    assert is_bot("claude-web/1.0")
+    assert not is_bot(BROWSER)
+    # The user agents are matched literally
+    assert is_bot("a.b") and not is_bot("axb")
+
+    assert not gu.make_bot_matcher([])(BOT)
+
+
+@pytest.fixture
+def server():
+    server = flask.Flask(__name__)
+    server.add_url_rule("/", "story", lambda: "story")
+    server.add_url_rule("/robots.txt", "robots", lambda: "robots")
+    server.wsgi_app = gu.BotBlocker(server.wsgi_app, gu.make_bot_matcher(["GPTBot"]))
+    server.register_blueprint(gu.blueprint)
+    return server
+
+
+def test_bot_blocker(server, monkeypatch):
+    monkeypatch.setattr(gu, "counters", gu.collections.Counter())
+    client = server.test_client()
+
+    assert client.get("/", headers={"User-Agent": BROWSER}).text == "story"
+    response = client.get("/", headers={"User-Agent": BOT})
+    assert response.status_code == 403
+    # Bots may read robots.txt
+    assert client.get("/robots.txt", headers={"User-Agent": BOT}).text == "robots"
+    assert gu.counters == {"requests": 3, "bot_requests_blocked": 1}
+
+
+def test_guard_endpoint_is_local(server):
+    client = server.test_client()
+    assert client.get("/_internal/guard").json["counters"]["requests"] > 0
+
+    # Through the proxy, or from another host
+    headers = {"X-Forwarded-For": "203.0.113.1"}
+    assert client.get("/_internal/guard", headers=headers).status_code == 403
+    response = client.get(
+        "/_internal/guard", environ_overrides={"REMOTE_ADDR": "203.0.113.1"}
+    )
+    assert response.status_code == 403
+
+
+def test_token_bucket_limiter(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(gu.time, "monotonic", lambda: now)
+    limiter = gu.TokenBucketLimiter(rate=0.5, burst=3, max_keys=2)
+
+    assert limiter.tokens("a") == 3
+    assert [limiter.allow("a") for __ in range(4)] == [True, True, True, False]
+    assert limiter.tokens("a") == 0
+    # Buckets are per key
+    assert limiter.allow("b")
+
+    # The bucket refills at the rate, up to the burst
+    now += 2
+    assert limiter.allow("a") and not limiter.allow("a")
+    now += 100
+    assert [limiter.allow("a") for __ in range(4)] == [True, True, True, False]
+
+    # Forgotten buckets are full
+    limiter.allow("c")
+    assert list(limiter._buckets) == ["a", "c"]
+    assert [limiter.allow("b") for __ in range(4)] == [True, True, True, False]
+
+
+def test_allow_story_fetch(reader, cache, monkeypatch):
+    monkeypatch.setattr(gu, "ip_limiter", gu.TokenBucketLimiter(rate=0, burst=2))
+    monkeypatch.setattr(gu, "user_limiter", gu.TokenBucketLimiter(rate=0, burst=1))
+    url = "https://www.nzherald.co.nz/nz/a-story/ABC123/"
+
+    # The user's bucket runs out first, and then the IP address keeps its token
+    assert gu.allow_story_fetch(url)
+    assert not gu.allow_story_fetch(url)
+    assert gu.ip_limiter.tokens(gu.get_client_ip()) == 1
+
+    # Cached stories cost nothing
+    sto.cache_story({"url": url, "title": "", "elements": []})
+    assert gu.allow_story_fetch(url)
+
+
+def test_client_ip_is_the_proxys_hop(cache, monkeypatch):
+    import app as ap
+
+    monkeypatch.setattr(gu, "ip_limiter", gu.TokenBucketLimiter(rate=0, burst=1))
+    url = "https://www.nzherald.co.nz/nz/a-story/ABC123/"
+
+    def allow(forwarded):
+        headers = {"X-Forwarded-For": forwarded}
+        with ap.app.server.test_request_context("/", headers=headers):
+            fl.logout_user()
+            return gu.get_client_ip(), gu.allow_story_fetch(url)
+
+    assert allow("198.51.100.7") == ("198.51.100.7", True)
+    # A client can't get a fresh bucket by sending addresses of its own
+    assert allow("203.0.113.1, 198.51.100.7") == ("198.51.100.7", False)
+    assert allow("203.0.113.2,198.51.100.7") == ("198.51.100.7", False)
@@ -0,0 +1,39 @@
+import importlib
+import types
+
+from .context import settings
+import gunicorn_config
+
+
+def test_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("GUNICORN_WORKERS", "2")
+    monkeypatch.setenv("GUNICORN_THREADS", "8")
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "sync")
+    monkeypatch.setenv("GUNICORN_MAX_REQUESTS", "0")
+    monkeypatch.delenv("GUNICORN_BIND", raising=False)
+    try:
+        config = importlib.reload(gunicorn_config)
+        assert (config.workers, config.threads, config.worker_class) == (2, 8, "sync")
+        assert config.max_requests == config.max_requests_jitter == 0
+        assert config.bind == ["127.0.0.1:5020"]
+
+        # A cache node listens on its private address too
+        monkeypatch.setenv("GUNICORN_BIND", "10.0.0.1:5020")
+        config = importlib.reload(gunicorn_config)
+        assert config.bind == ["127.0.0.1:5020", "10.0.0.1:5020"]
+    finally:
+        monkeypatch.undo()
+        importlib.reload(gunicorn_config)
+
+
+def test_post_request_recycles_worker(monkeypatch):
+    worker = types.SimpleNamespace(
+        pid=1, alive=True, log=types.SimpleNamespace(info=lambda message: None)
+    )
+    monkeypatch.setattr(settings.config, "WORKER_MAX_RSS", 0)
+    gunicorn_config.post_request(worker, None, {}, None)
+    assert worker.alive
+
+    monkeypatch.setattr(settings.config, "WORKER_MAX_RSS", 1)
+    gunicorn_config.post_request(worker, None, {}, None)
+    assert not worker.alive
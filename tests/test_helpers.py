@@ -0,0 +1,93 @@
+import json
+import threading
+
+from dash import html
+
+from .context import settings
+import helpers as hp
+
+
+def make_tree():
+    return html.Div(
+        [
+            html.P("a", id="first"),
+            html.Div([html.Span("b", id="second")], id="middle"),
+            html.Div(html.Span("c"), id="third"),
+        ],
+        id="root",
+    )
+
+
+def test_to_plain():
+    plain = hp.to_plain(make_tree())
+    assert plain == json.loads(hp.to_json(make_tree()))
+    assert plain["type"] == "Div"
+    assert plain["namespace"] == "dash_html_components"
+    assert plain["props"]["children"][0] == {
+        "type": "P",
+        "namespace": "dash_html_components",
+        "props": {"children": "a", "id": "first"},
+    }
+
+
+def test_with_props():
+    tree = hp.to_plain(make_tree())
+    before = json.dumps(tree)
+    new = hp.with_props(tree, {"second": {"children": "B"}, "root": {"title": "t"}})
+
+    assert new["props"]["title"] == "t"
+    assert new["props"]["children"][1]["props"]["children"][0]["props"] == {
+        "children": "B",
+        "id": "second",
+    }
+    # The given tree is unchanged, and the branches without updates are shared
+    assert json.dumps(tree) == before
+    assert new["props"]["children"][0] is tree["props"]["children"][0]
+    assert new["props"]["children"][2] is tree["props"]["children"][2]
+
+
+def test_with_props_without_updates():
+    tree = hp.to_plain(make_tree())
+    assert hp.with_props(tree, {}) is tree
+    assert hp.with_props(tree, {"missing": {"children": "x"}}) is tree
+
+
+def test_with_props_replaces_children():
+    tree = hp.to_plain(make_tree())
+    new = hp.with_props(tree, {"middle": {"children": "plain"}})
+    assert new["props"]["children"][1]["props"]["children"] == "plain"
+
+
+def test_get_layout_is_memoized():
+    import index
+
+    for page in index.PAGES:
+        layout = index.get_layout(page)
+        assert layout is index.get_layout(page)
+        # Plain values, which Dash sends as they are
+        assert json.loads(json.dumps(layout)) == layout
+
+
+def test_lazy_thread():
+    ran = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def run():
+        runs.append(1)
+        ran.set()
+        release.wait()
+
+    thread = hp.LazyThread(run)
+    assert thread._thread is None
+    thread.start()
+    thread.start()
+    assert ran.wait(5)
+    assert len(runs) == 1
+
+    # A thread that ended starts again
+    release.set()
+    thread._thread.join()
+    thread.start()
+    thread._thread.join()
+    assert len(runs) == 2
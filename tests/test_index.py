@@ -0,0 +1,87 @@
+import dash
+import flask_login as fl
+
+from .context import settings
+import helpers as hp
+import index
+import memory as mem
+
+
+def find_props(layout: dict, id_: str) -> dict:
+    """
+    Return the props of the component of the given ID in the given plain layout.
+    """
+    found = hp.with_props(layout, {id_: {"found": True}})
+    stack = [found]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            props = item.get("props", {})
+            if props.get("found"):
+                return {k: v for k, v in props.items() if k != "found"}
+            stack.append(props.get("children"))
+    raise KeyError(id_)
+
+
+def test_display_page_logged_out(reader):
+    fl.logout_user()
+    content, session, store = index.display_page("/", None)
+    assert content is index.get_layout("login")
+    assert session is None
+    assert store is dash.no_update
+
+
+def test_display_page(reader):
+    content, session, store = index.display_page("/search", None)
+    assert content is index.get_layout("search")
+    assert session == {"username": "reader"}
+    assert store is dash.no_update
+
+    # Non-admins don't see the admin page
+    assert index.display_page("/admin", None)[0] is index.get_layout("error_404")
+
+
+def test_display_page_with_story(reader, cache, upstream, monkeypatch):
+    monkeypatch.setattr(
+        mem, "calls", mem.collections.defaultdict(mem.calls.default_factory)
+    )
+    content, session, store = index.display_page("/nz/a-story/ABC123/", None)
+
+    # The main page comes with the story shown and stored
+    url = "https://www.nzherald.co.nz/nz/a-story/ABC123/"
+    assert store.value["url"] == url
+    assert find_props(content, "story-version")["data"]["url"] == url
+    assert find_props(content, "story-content")["children"][0]["props"] == {
+        "children": store.value["title"]
+    }
+    assert session == {"username": "reader"}
+    assert upstream.n_requests == 1
+    # The story's rendering is attributed in the memory diagnostics
+    assert mem.calls["display_page"]["calls"] == 1
+    # The memoized layout is unchanged
+    assert find_props(index.get_layout("main"), "story-version").get("data") is None
+
+
+def get_outputs(output: str) -> list[str]:
+    if output.startswith(".."):
+        return output[2:-2].split("...")
+    return [output]
+
+
+def test_no_duplicate_outputs():
+    # The dependency graph that the browser loads
+    response = index.app.server.test_client().get("/_dash-dependencies")
+    assert response.status_code == 200
+
+    outputs = []
+    for callback in response.get_json():
+        for output in get_outputs(callback["output"]):
+            # Dash marks the outputs with allow_duplicate=True with a hash suffix
+            if "@" in output:
+                assert callback["prevent_initial_call"], output
+            else:
+                outputs.append(output)
+    assert "story-store.data" in outputs
+    assert len(outputs) == len(set(outputs))
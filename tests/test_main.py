@@ -1,7 +1,251 @@
+import concurrent.futures as cf
+import gzip
+import json
+import types
+
+import dash
+import flask_login as fl
 import pytest
+import werkzeug.exceptions
+
+from .context import settings
+from app import app
+import guard as gu
+from pages import main
+import rendering as rn
+import search_index as si
+import stories as sto
+
+
+def test_story_links_are_internal():
+    markdown = rn.html_to_markdown(
+        '<p><a href="https://www.nzherald.co.nz/nz/a-story/ABC123/">A story</a> and '
+        '<a href="https://example.com/">elsewhere</a></p>'
+    )
+    assert markdown.children.strip() == (
+        "[A story](/nz/a-story/ABC123/) and [elsewhere](https://example.com/)"
+    )
+
+
+def prefetch(path: str, user=None):
+    with app.server.test_request_context(
+        "/_prefetch", method="POST", query_string={"path": path}
+    ):
+        if user is None:
+            fl.logout_user()
+        else:
+            fl.login_user(user)
+        return main.prefetch_story()
+
+
+def test_prefetch_story(reader, cache, upstream, monkeypatch):
+    pool = cf.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(main, "prefetch_pool", pool)
+
+    assert prefetch("/nz/a-story/ABC123/", reader) == ("", 202)
+    pool.shutdown(wait=True)
+    url = "https://www.nzherald.co.nz/nz/a-story/ABC123/"
+    assert sto.get_cached_story(url)["url"] == url
+    assert upstream.n_requests == 1
+
+    # Cached stories aren't fetched again
+    monkeypatch.setattr(main, "prefetch_pool", None)
+    assert prefetch("/nz/a-story/ABC123/", reader) == ("", 202)
+
+
+def test_prefetch_has_its_own_budget(reader, cache, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(
+        main,
+        "prefetch_pool",
+        types.SimpleNamespace(submit=lambda *a: submitted.append(a)),
+    )
+    monkeypatch.setattr(gu, "ip_limiter", gu.TokenBucketLimiter(rate=0, burst=4))
+    monkeypatch.setattr(gu, "user_limiter", gu.TokenBucketLimiter(rate=0, burst=4))
+    monkeypatch.setattr(gu, "prefetch_limiter", gu.TokenBucketLimiter(rate=0, burst=2))
+    paths = [f"/nz/story-{i}/ABC12{i}/" for i in range(3)]
+
+    for path in paths:
+        prefetch(path, reader)
+    assert len(submitted) == 2
+    # Prefetches cost the reader none of their own fetches
+    with app.server.test_request_context("/"):
+        fl.login_user(reader)
+        assert gu.ip_limiter.tokens(gu.get_client_ip()) == 4
+        assert gu.user_limiter.tokens(reader.get_id()) == 4
+
+        # Readers fetching plenty don't prefetch
+        monkeypatch.setattr(gu, "prefetch_limiter", gu.TokenBucketLimiter(0, 2))
+        for i in range(3):
+            assert gu.allow_story_fetch(f"https://www.nzherald.co.nz/nz/s/ABC{i}/")
+    prefetch(paths[2], reader)
+    assert len(submitted) == 2
+
+
+@pytest.mark.parametrize(
+    "path, user, error",
+    [
+        ("/nz/a-story/ABC123/", None, werkzeug.exceptions.Unauthorized),
+        ("nz/a-story/ABC123/", True, werkzeug.exceptions.BadRequest),
+        ("//example.com/nz/", True, werkzeug.exceptions.BadRequest),
+    ],
+)
+def test_prefetch_story_refused(reader, monkeypatch, path, user, error):
+    monkeypatch.setattr(main, "prefetch_pool", None)
+    with pytest.raises(error):
+        prefetch(path, reader if user else None)
+
+
+def make_story(*texts: str) -> dict:
+    return {
+        "url": "https://www.nzherald.co.nz/nz/live/ABC123/",
+        "title": "Live",
+        "elements": [{"type": "text", "content": f"<p>{t}</p>"} for t in texts],
+    }
+
+
+def apply_patch(content: list, patch) -> list:
+    content = list(content)
+    for op in patch.to_plotly_json()["operations"]:
+        if op["operation"] == "Delete":
+            del content[op["location"][0]]
+        else:
+            assert op["operation"] == "Insert"
+            content.insert(op["params"]["index"], op["params"]["value"])
+    return content
+
+
+@pytest.mark.parametrize(
+    "new",
+    [
+        ["a", "b2", "c", "d"],
+        ["new", "a", "b", "c", "d"],
+        ["a", "c", "d", "e", "f"],
+        ["d", "c", "b", "a"],
+        [],
+    ],
+)
+def test_update_live_story(reader, monkeypatch, new):
+    old = make_story("a", "b", "c", "d")
+    content = rn.render(old)["content"]
+    version = {"url": old["url"], "start": 0, "hashes": rn.hash_elements(old)}
+    monkeypatch.setattr(sto, "refresh_story", lambda url, max_age: make_story(*new))
+
+    patch, new_version, store = main.update_live_story(1, version, None)
+
+    # Patching the shown content gives the newly rendered content
+    assert apply_patch(content, patch) == rn.render(make_story(*new))["content"]
+    assert new_version == version | {"hashes": rn.hash_elements(make_story(*new))}
+    assert store.value == make_story(*new)
+
+
+def test_update_live_story_unchanged(reader, monkeypatch):
+    story = make_story("a", "b")
+    version = {"url": story["url"], "start": 0, "hashes": rn.hash_elements(story)}
+    monkeypatch.setattr(sto, "refresh_story", lambda url, max_age: story)
+    with pytest.raises(dash.exceptions.PreventUpdate):
+        main.update_live_story(1, version, None)
+    with pytest.raises(dash.exceptions.PreventUpdate):
+        main.update_live_story(1, None, None)
+
+
+def test_apply_reader_settings(monkeypatch):
+    monkeypatch.setattr(
+        settings.config, "IMAGE_RESIZER_URL", "https://img.example.com/{width}/{url}"
+    )
+    src = "https://www.nzherald.co.nz/a.jpg"
+    story = make_story("a")
+    story["elements"].append({"type": "image", "src": src, "caption": "Kiwi"})
+    content = rn.render(story)["content"]
+    title, text, image = content
+
+    # The defaults show the original images
+    assert main.apply_reader_settings(content, None) is content
+    assert main.apply_reader_settings(content, {"font_size": "large"}) is content
+
+    # Without images, the captions stay
+    result = main.apply_reader_settings(content, {"images": False})
+    assert result[:2] == [title, text]
+    assert result[2]["props"]["children"] == image["props"]["children"][-1:]
+    assert result[2]["props"]["data-src"] == src
+
+    result = main.apply_reader_settings(content, {"image_quality": "low"})
+    img, caption = result[2]["props"]["children"]
+    assert img["props"]["src"] == (
+        "https://img.example.com/480/https%3A%2F%2Fwww.nzherald.co.nz%2Fa.jpg"
+    )
+    assert caption == image["props"]["children"][-1]
+    # The given content is unchanged
+    assert content[2] == image
+    assert image["props"]["children"][0]["props"]["src"] == src
+
+
+def test_get_image_src(monkeypatch):
+    src = "https://www.nzherald.co.nz/a.jpg"
+    monkeypatch.setattr(settings.config, "IMAGE_RESIZER_URL", "")
+    assert main.get_image_src(src, "low") == src
+
+    monkeypatch.setattr(
+        settings.config, "IMAGE_RESIZER_URL", "https://img.example.com/{width}/{url}"
+    )
+    assert main.get_image_src(src, "high") == src
+    assert main.get_image_src(src, "medium").startswith("https://img.example.com/960/")
+
+
+def test_warm_stories(cache, upstream):
+    urls = [f"https://www.nzherald.co.nz/nz/warm-{i}/WARM{i}/" for i in range(3)]
+    for url in urls:
+        main.get_rendered_story(url)
+    si._queue.join()
+    assert si.recent_urls(3) == urls[::-1]
+
+    # Fresh stories aren't fetched again
+    assert main.warm_stories(2) == 2
+    assert upstream.n_requests == 3
+    sto.purge_story(urls[2])
+    assert main.warm_stories(2) == 2
+    assert upstream.n_requests == 4
+
+    assert main.load_recent_stories(3) == 3
+
+
+def test_warm_is_local(cache):
+    def warm(**environ):
+        with app.server.test_request_context(
+            "/_internal/warm?n=0", method="POST", environ_base=environ
+        ):
+            return main.warm()
+
+    assert warm(REMOTE_ADDR="127.0.0.1") == {"warmed": 0}
+    with pytest.raises(werkzeug.exceptions.Forbidden):
+        warm(REMOTE_ADDR="203.0.113.1")
+    # Through the proxy
+    with pytest.raises(werkzeug.exceptions.Forbidden):
+        warm(REMOTE_ADDR="127.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.1")
+
+
+STORY_ID = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def get_story_json(path: str, accept_encoding: str):
+    with app.server.test_request_context(
+        f"/story/{path}.json", headers={"Accept-Encoding": accept_encoding}
+    ):
+        return main.get_story_json(path)
+
 
-from .context import nzherald, TEST_DATA_DIR
-from nzherald import *
+def test_get_story_json(reader, cache, upstream):
+    response = get_story_json(f"nz/a-story/{STORY_ID}", "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    response.direct_passthrough = False
+    rendered = json.loads(gzip.decompress(response.get_data()))
+    story = sto.get_cached_story(f"https://www.nzherald.co.nz/nz/a-story/{STORY_ID}/")
+    assert rendered == rn.render(story)
 
-# Rename this file to 'test_<module>.py',
-# where <module> is the name of the module you want to test.
+    # Then from the render files, under any of the story's URLs
+    response = get_story_json(f"world/a-story/{STORY_ID}", "")
+    assert "Content-Encoding" not in response.headers
+    response.direct_passthrough = False
+    assert json.loads(response.get_data()) == rendered
+    assert upstream.n_requests == 1
@@ -0,0 +1,74 @@
+import tracemalloc
+
+import flask
+import pytest
+
+from .context import settings
+import memory as mem
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    """
+    Trace allocations in the test, and take a snapshot on every sample.
+    """
+    monkeypatch.setattr(settings.config, "MEMORY_TRACE_FRAMES", 1)
+    monkeypatch.setattr(settings.config, "MEMORY_SNAPSHOT_INTERVAL", 0)
+    monkeypatch.setattr(
+        mem,
+        "_snapshots",
+        {"first": None, "previous": None, "latest": None, "taken_at": 0},
+    )
+    monkeypatch.setattr(
+        mem, "calls", mem.collections.defaultdict(mem.calls.default_factory)
+    )
+    yield
+    tracemalloc.stop()
+
+
+def test_should_recycle(monkeypatch):
+    monkeypatch.setattr(settings.config, "WORKER_MAX_RSS", 0)
+    assert not mem.should_recycle()
+    monkeypatch.setattr(settings.config, "WORKER_MAX_RSS", 1)
+    assert mem.should_recycle()
+    monkeypatch.setattr(settings.config, "WORKER_MAX_RSS", 2 * mem.get_rss())
+    assert not mem.should_recycle()
+
+
+def test_track(tracing):
+    for __ in range(2):
+        with mem.track("story"):
+            data = bytearray(2**20)
+            del data
+    stats = mem.calls["story"]
+    assert stats["calls"] == 2
+    assert stats["max_peak"] >= 2**20
+    assert tracemalloc.is_tracing()
+    assert mem.sampler._thread.is_alive()
+
+
+def test_get_report(tracing):
+    mem.start()
+    mem.sample()
+    kept = [bytearray(2**10) for __ in range(1000)]
+    mem.sample()
+
+    report = mem.get_report(n_sites=3)
+    assert report["rss"] > 0
+    assert report["tracing"]
+    assert report["samples"][-1][1] > 0
+    # The site that allocated the kept memory grew the most
+    [top, *__] = report["growth_since_previous"]
+    assert top["site"].startswith(__file__)
+    assert top["size_diff"] >= len(kept) * 2**10
+    assert len(report["growth_since_first"]) <= 3
+
+
+def test_memory_endpoint_is_local():
+    server = flask.Flask(__name__)
+    mem.init_app(server)
+    client = server.test_client()
+
+    assert client.get("/_internal/memory").json["pid"] > 0
+    headers = {"X-Forwarded-For": "203.0.113.1"}
+    assert client.get("/_internal/memory", headers=headers).status_code == 403
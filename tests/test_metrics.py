@@ -0,0 +1,153 @@
+import collections
+import json
+import os
+import time
+
+import flask
+import pytest
+
+from .context import settings
+import metrics as mt
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    """
+    Give the metrics fresh counters.
+    """
+    monkeypatch.setattr(mt, "counters", collections.Counter())
+    monkeypatch.setattr(mt, "_previous_counters", collections.Counter())
+    monkeypatch.setattr(mt, "views", collections.Counter())
+    monkeypatch.setattr(mt, "view_urls", {})
+    monkeypatch.setattr(mt, "view_titles", {})
+    monkeypatch.setattr(mt, "upstream", collections.deque(maxlen=1000))
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.config, "METRICS_DIR", tmp_path)
+    mt.clear_read()
+    yield tmp_path
+    mt.clear_read()
+
+
+@pytest.mark.parametrize("p, expected", [(0, 1), (50, 3), (95, 5), (100, 5)])
+def test_percentile(p, expected):
+    assert mt.percentile([1, 2, 3, 4, 5], p) == expected
+    assert mt.percentile([], p) == 0
+
+
+def test_record_view_keeps_most_viewed(counters):
+    for i in range(10_001):
+        mt.record_view(f"k{i}", f"https://example.com/{i}")
+    mt.record_view("k0", "https://example.com/0", "Kiwi")
+    mt.record_view("k1", "https://example.com/1")
+
+    mt.record_view("new", "https://example.com/new")
+    assert len(mt.views) == 1001
+    assert mt.views["k0"] == 2
+    assert mt.view_titles == {"k0": "Kiwi"}
+    assert set(mt.view_urls) == set(mt.views)
+
+
+def test_snapshots_copy_under_lock(cache, counters, monkeypatch):
+    # The request threads record while the publisher copies, so the copies are
+    # taken under the lock that the records take
+    class Views(collections.Counter):
+        def most_common(self, n=None):
+            assert mt._lock.locked()
+            return super().most_common(n)
+
+    monkeypatch.setattr(mt, "views", Views())
+    mt.record_view("a", "https://example.com/a")
+    assert mt.get_snapshot()["views"] == [["a", "https://example.com/a", "", 1]]
+    assert not mt._lock.locked()
+
+
+def test_snapshots_aggregate(cache, counters):
+    mt.record_cache("disk", True)
+    mt.record_cache("disk", False)
+    mt.record_view("a", "https://example.com/a", "A")
+    mt.record_upstream("example.com", 0.5, True)
+    first = mt.get_snapshot()
+    mt.record_cache("disk", True)
+    mt.record_view("a", "https://example.com/a")
+    mt.record_view("b", "https://example.com/b")
+    mt.record_upstream("example.com", 1.5, False)
+    second = mt.get_snapshot()
+
+    assert first["cache"] == {"disk": {"hits": 1, "misses": 1}}
+    assert second["cache"] == {"disk": {"hits": 2, "misses": 1}}
+    assert second["cache_recent"] == {"disk": {"hits": 1, "misses": 0}}
+
+    # Two workers, as it were
+    first["breakers"] = {"example.com": "open"}
+    second["breakers"] = {"example.com": "closed"}
+    metrics = mt.aggregate([first, second])
+    assert metrics["cache"]["disk"]["hits"] == 3
+    assert metrics["cache"]["disk"]["hit_rate"] == 0.6
+    assert metrics["cache"]["disk"]["recent_hit_rate"] == 2 / 3
+    assert metrics["stories"][0] == {
+        "key": "a",
+        "url": "https://example.com/a",
+        "title": "A",
+        "views": 3,
+    }
+    assert [s["key"] for s in metrics["stories"]] == ["a", "b"]
+    assert metrics["upstream"]["fetches"] == 3
+    assert metrics["upstream"]["failures"] == 1
+    assert metrics["upstream"]["max"] == 1.5
+    assert metrics["breakers"] == {"example.com": "open"}
+    assert len(metrics["workers"]) == 2
+
+
+def test_read_metrics(cache, counters, metrics_dir):
+    mt.record_cache("memory", True)
+    mt.publish()
+    assert (metrics_dir / f"{os.getpid()}.json").exists()
+    assert "measured_at" in json.loads((metrics_dir / "tiers.json").read_text())
+
+    # Snapshots of workers gone a while are skipped, and after an hour deleted
+    gone = metrics_dir / "1.json"
+    gone.write_text((metrics_dir / f"{os.getpid()}.json").read_text())
+    old = time.time() - 3601
+    os.utime(gone, (old, old))
+
+    metrics = mt.read_metrics()
+    assert [w["pid"] for w in metrics["workers"]] == [os.getpid()]
+    assert metrics["cache"]["memory"]["hits"] == 1
+    assert metrics["sizes_measured_at"] is not None
+    assert "disk" in metrics["sizes"]
+    assert not gone.exists()
+
+    # The result is reused within the interval
+    mt.record_cache("memory", True)
+    mt.publish()
+    assert mt.read_metrics()["cache"]["memory"]["hits"] == 1
+    mt.clear_read()
+    assert mt.read_metrics()["cache"]["memory"]["hits"] == 2
+
+
+def test_update_tier_sizes(cache, metrics_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(mt, "get_tier_sizes", lambda: calls.append(1) or {})
+    mt.update_tier_sizes()
+    mt.update_tier_sizes()
+    assert len(calls) == 1
+    mt.update_tier_sizes(force=True)
+    assert len(calls) == 2
+
+
+def test_metrics_endpoint_is_local(metrics_dir):
+    server = flask.Flask(__name__)
+    server.register_blueprint(mt.blueprint)
+    client = server.test_client()
+    assert client.get("/_internal/metrics").status_code == 200
+    response = client.get(
+        "/_internal/metrics", headers={"X-Forwarded-For": "203.0.113.1"}
+    )
+    assert response.status_code == 403
+    response = client.get(
+        "/_internal/metrics", environ_base={"REMOTE_ADDR": "203.0.113.1"}
+    )
+    assert response.status_code == 403
@@ -0,0 +1,17 @@
+from .context import settings
+from pages import reading_list
+
+
+def test_parse_urls():
+    text = (
+        "https://www.nzherald.co.nz/nz/a/ABCDEFGHIJKLMNOPQRSTUVWXYZ/\n"
+        "not a url, https://example.com/nz/story/,"
+        "www.newsroom.co.nz/pro/a-story\n\n"
+        "  nzherald.co.nz/world/b/  "
+    )
+    assert reading_list.parse_urls(text) == [
+        "https://www.nzherald.co.nz/nz/a/ABCDEFGHIJKLMNOPQRSTUVWXYZ/",
+        "www.newsroom.co.nz/pro/a-story",
+        "nzherald.co.nz/world/b/",
+    ]
+    assert reading_list.parse_urls("") == []
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from .context import settings
+import scheduler as sch
+
+
+class Fetches:
+    """
+    Fetches from one host through the given scheduler in threads of their own,
+    which record the order in which they're admitted, or how they fail.
+    """
+
+    def __init__(self, scheduler: sch.Scheduler, budget: int = 1):
+        self.scheduler = scheduler
+        self.budget = budget
+        self.order = []
+        self.threads = []
+
+    def acquire(self, url, priority="interactive", user="", wait=5.0):
+        return self.scheduler.acquire(url, "host", priority, user, self.budget, wait)
+
+    def start(self, url, priority="interactive", user="", wait=5.0) -> None:
+        def fetch():
+            try:
+                ticket = self.acquire(url, priority, user, wait)
+            except (sch.Cancelled, sch.QueueTimeout) as e:
+                self.order.append((url, type(e).__name__))
+            else:
+                self.order.append(url)
+                self.scheduler.release(ticket)
+
+        n_seen = self.n_seen() + 1
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        self.threads.append(thread)
+        # Queue the fetches in the order given
+        while self.n_seen() < n_seen:
+            time.sleep(0.001)
+
+    def n_seen(self) -> int:
+        """
+        Return the number of fetches queued, admitted, or given up so far.
+        """
+        classes = self.scheduler.get_stats()["classes"].values()
+        return sum(
+            c["queued"] + c["admitted"] + c["timed_out"] + c["cancelled"]
+            for c in classes
+        )
+
+    def join(self) -> list:
+        for thread in self.threads:
+            thread.join(5)
+        return self.order
+
+
+def test_priority_order():
+    fetches = Fetches(sch.Scheduler(reserve=0))
+    held = fetches.acquire("held")
+    fetches.start("a", "prefetch")
+    fetches.start("b", "revalidation")
+    fetches.start("c", "interactive")
+    fetches.start("d", "revalidation")
+
+    fetches.scheduler.release(held)
+    assert fetches.join() == ["c", "b", "d", "a"]
+
+
+def test_users_take_turns():
+    fetches = Fetches(sch.Scheduler(reserve=0))
+    held = fetches.acquire("held")
+    for url in ["a1", "a2", "a3"]:
+        fetches.start(url, "revalidation", "ann")
+    fetches.start("b1", "revalidation", "bob")
+    fetches.start("c1", "revalidation", "cat")
+
+    fetches.scheduler.release(held)
+    assert fetches.join() == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_reserve_for_interactive_fetches():
+    fetches = Fetches(sch.Scheduler(reserve=1), budget=2)
+    background = fetches.acquire("a", "prefetch")
+
+    # The last slot is reserved
+    with pytest.raises(sch.QueueTimeout):
+        fetches.acquire("b", "prefetch", wait=0.05)
+    interactive = fetches.acquire("c", "interactive", wait=0.05)
+
+    stats = fetches.scheduler.get_stats()
+    assert stats["in_flight"] == {"host": 2}
+    assert stats["classes"]["prefetch"]["admitted"] == 1
+    assert stats["classes"]["prefetch"]["timed_out"] == 1
+    assert stats["classes"]["interactive"]["admitted"] == 1
+    for ticket in [background, interactive]:
+        fetches.scheduler.release(ticket)
+    assert fetches.scheduler.get_stats()["in_flight"] == {"host": 0}
+
+
+def test_timeout_lets_the_next_fetch_go():
+    fetches = Fetches(sch.Scheduler(reserve=0))
+    held = fetches.acquire("held")
+    fetches.start("a", wait=0.05)
+    fetches.start("b", "prefetch")
+    fetches.threads[0].join(5)
+    assert fetches.order == [("a", "QueueTimeout")]
+
+    fetches.scheduler.release(held)
+    assert fetches.join() == [("a", "QueueTimeout"), "b"]
+
+
+def test_interactive_fetch_cancels_queued_background_fetches():
+    fetches = Fetches(sch.Scheduler(reserve=0))
+    held = fetches.acquire("held")
+    fetches.start("story", "prefetch", "ann")
+    fetches.start("story", "revalidation", "bob")
+    fetches.start("other", "prefetch", "ann")
+    fetches.start("story", "interactive", "cat")
+    for thread in fetches.threads[:2]:
+        thread.join(5)
+    assert fetches.order == [("story", "Cancelled")] * 2
+
+    fetches.scheduler.release(held)
+    assert fetches.join()[2:] == ["story", "other"]
+    classes = fetches.scheduler.get_stats()["classes"]
+    assert classes["prefetch"]["cancelled"] == 1
+    assert classes["revalidation"]["cancelled"] == 1
+
+
+def test_work():
+    assert sch.get_work() == ("interactive", "")
+    with sch.work("prefetch", "user:1"):
+        assert sch.get_work() == ("prefetch", "user:1")
+        with sch.work("revalidation"):
+            assert sch.get_work() == ("revalidation", "")
+        assert sch.get_work() == ("prefetch", "user:1")
+    assert sch.get_work() == ("interactive", "")
+
+    with pytest.raises(ValueError):
+        with sch.work("urgent"):
+            pass
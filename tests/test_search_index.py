@@ -0,0 +1,88 @@
+import pytest
+
+from .context import settings
+import search_index as si
+
+
+def make_story(url, title, *paragraphs):
+    return {
+        "url": url,
+        "title": title,
+        "elements": [{"type": "text", "content": f"<p>{p}</p>"} for p in paragraphs]
+        + [{"type": "image", "src": "https://example.com/a.jpg", "caption": "Kiwi"}],
+    }
+
+
+def test_html_to_text():
+    assert si.html_to_text("<p>Fish &amp; <b>chips</b></p>").split() == [
+        "Fish",
+        "&",
+        "chips",
+    ]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("", ""),
+        ("kiwi", '"kiwi"*'),
+        ("kiwi bird", '"kiwi" "bird"*'),
+        # FTS5 syntax is searched for literally
+        ('kiwi" OR *', '"kiwi""" "OR" "*"*'),
+    ],
+)
+def test_to_fts_query(query, expected):
+    assert si.to_fts_query(query) == expected
+
+
+def test_write_and_search():
+    si.write_stories(
+        [
+            make_story("https://www.nzherald.co.nz/nz/a/", "Tuatara found", "In Otago."),
+            make_story(
+                "https://www.nzherald.co.nz/nz/b/",
+                "Election results",
+                "A tuatara sighting in Fiordland.",
+            ),
+        ]
+    )
+
+    results, total = si.search("tuatara")
+    assert total == 2
+    # Title matches rank first
+    assert [r["url"] for r in results] == [
+        "https://www.nzherald.co.nz/nz/a/",
+        "https://www.nzherald.co.nz/nz/b/",
+    ]
+    assert results[1]["path"] == "/nz/b/"
+    assert "**tuatara**" in results[1]["snippet"]
+
+    # Stemming, prefixes, and captions match
+    assert si.search("sightings")[1] == 1
+    assert si.search("Fiord")[1] == 1
+    assert si.search("kiwi")[1] >= 2
+
+    # Pages
+    results, total = si.search("tuatara", page=2, per_page=1)
+    assert total == 2
+    assert [r["url"] for r in results] == ["https://www.nzherald.co.nz/nz/b/"]
+
+    assert si.search('" OR ) *') == ([], 0)
+
+
+def test_write_updates_story():
+    url = "https://www.nzherald.co.nz/nz/c/"
+    si.write_stories([make_story(url, "Weta", "First version.")])
+    si.write_stories([make_story(url, "Weta", "Second version.")])
+
+    assert si.search("weta")[1] == 1
+    assert si.search("first")[0] == []
+    assert si.recent_urls(1) == [url]
+
+
+def test_index_story_in_background():
+    url = "https://www.nzherald.co.nz/nz/d/"
+    si.index_story(make_story(url, "Kakapo chicks hatch"))
+    si._queue.join()
+
+    assert [r["url"] for r in si.search("kakapo")[0]] == [url]
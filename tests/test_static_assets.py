@@ -0,0 +1,164 @@
+import gzip
+import json
+
+import click.testing
+import flask
+import pytest
+
+from .context import settings
+import cache as ca
+import static_assets as sa
+
+CSS = """
+@font-face { src: url("./fonts/icons.woff2?v=1") format("woff2"),
+  url('fonts/icons.woff') format("woff"); }
+.a { background: url(data:image/png;base64,AAAA); }
+.b { background: url(https://example.com/b.png); }
+"""
+
+
+def test_get_css_references():
+    assert sa.get_css_references(CSS) == ["./fonts/icons.woff2", "fonts/icons.woff"]
+
+
+def test_get_fingerprinted_name():
+    name = sa.get_fingerprinted_name("vendor/reader.css", b"a")
+    assert name.startswith("vendor/reader.") and name.endswith(".css")
+    assert name == sa.get_fingerprinted_name("vendor/reader.css", b"a")
+    assert name != sa.get_fingerprinted_name("vendor/reader.css", b"b")
+
+
+def test_write_encoded(tmp_path):
+    content = b"body { color: red; }\n" * 100
+    sa.write_encoded(tmp_path / "a.css", content)
+    assert (tmp_path / "a.css").read_bytes() == content
+    assert gzip.decompress((tmp_path / "a.css.gz").read_bytes()) == content
+    brotli = ca.get_brotli()
+    if brotli is not None:
+        assert brotli.decompress((tmp_path / "a.css.br").read_bytes()) == content
+
+    # Fonts are compressed already, and short files don't shrink
+    sa.write_encoded(tmp_path / "a.woff2", content)
+    sa.write_encoded(tmp_path / "b.css", b"a{}")
+    assert (tmp_path / "a.woff2").read_bytes() == content
+    assert (tmp_path / "b.css").read_bytes() == b"a{}"
+    assert not list(tmp_path.glob("a.woff2.*"))
+    assert not list(tmp_path.glob("b.css.*"))
+
+
+def test_build_files(tmp_path):
+    src = tmp_path / "src"
+    (src / "fonts").mkdir(parents=True)
+    (src / "icons.css").write_text(CSS)
+    (src / "fonts" / "icons.woff2").write_bytes(b"woff2")
+    (src / "fonts" / "icons.woff").write_bytes(b"woff")
+    sources = {
+        "vendor/icons.css": src / "icons.css",
+        "vendor/fonts/icons.woff2": src / "fonts" / "icons.woff2",
+        "vendor/fonts/icons.woff": src / "fonts" / "icons.woff",
+    }
+    static = tmp_path / "static"
+    built = sa.build_files(sources, static)
+
+    assert set(built) == set(sources)
+    for name, path in sources.items():
+        if not name.endswith(".css"):
+            assert (static / built[name]).read_bytes() == path.read_bytes()
+    # Style sheets load the fingerprinted files, and other URLs stay
+    css = (static / built["vendor/icons.css"]).read_text()
+    woff2 = built["vendor/fonts/icons.woff2"].removeprefix("vendor/")
+    woff = built["vendor/fonts/icons.woff"].removeprefix("vendor/")
+    assert f'url("{woff2}")' in css
+    assert f'url("{woff}")' in css
+    assert "url(data:image/png;base64,AAAA)" in css
+    assert "url(https://example.com/b.png)" in css
+    # A changed font changes the names of the style sheets that load it
+    (src / "fonts" / "icons.woff").write_bytes(b"woff, changed")
+    rebuilt = sa.build_files(sources, static)
+    assert rebuilt["vendor/icons.css"] != built["vendor/icons.css"]
+
+
+def test_trim_scripts():
+    scripts = (
+        '<script src="/_dash-component-suites/dash/dcc/dash_core_components.v2.js">'
+        "</script>\n"
+        '<script src="/_dash-component-suites/dash/dash_table/bundle.v6.js">'
+        "</script>\n"
+        '<script src="/_dash-component-suites/dash_extensions/dash_extensions.v1.js">'
+        "</script>\n"
+    )
+    assert sa.trim_scripts(scripts) == scripts.split("\n")[0] + "\n"
+
+
+def test_serve_static(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.config, "STATIC_DIR", tmp_path)
+    sa.write_encoded(tmp_path / "reader.abc.css", b"body { color: red; }\n" * 100)
+    server = flask.Flask(__name__)
+    sa.init_app(server)
+    client = server.test_client()
+    url = f"{settings.config.STATIC_URL_PATH}/reader.abc.css"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"].startswith("text/css")
+    assert response.headers["Vary"] == "Accept-Encoding"
+    cache_control = response.headers["Cache-Control"]
+    assert "immutable" in cache_control and "max-age=31536000" in cache_control
+    assert "Content-Encoding" not in client.get(url).headers
+
+    assert (
+        client.get(f"{settings.config.STATIC_URL_PATH}/missing.css").status_code == 404
+    )
+    response = client.get(f"{settings.config.STATIC_URL_PATH}/../settings.py")
+    assert response.status_code == 404
+
+
+def test_build_requires_vendored_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.config, "VENDOR_DIR", tmp_path)
+    assert sa.get_missing_vendored(tmp_path) == list(sa.VENDOR_URLS)
+    (tmp_path / "bootstrap.min.css").write_text("")
+    assert sa.get_missing_vendored(tmp_path) == ["bootstrap-icons.css"]
+
+    result = click.testing.CliRunner().invoke(sa.cli, ["build", "--require-vendored"])
+    assert result.exit_code != 0
+    assert "bootstrap-icons.css not vendored" in result.output
+
+
+def test_build_vendors_missing_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.config, "VENDOR_DIR", tmp_path)
+
+    def vendor():
+        for name in sa.VENDOR_URLS:
+            (tmp_path / name).write_text("")
+        return list(sa.VENDOR_URLS)
+
+    monkeypatch.setattr(sa, "vendor", vendor)
+    monkeypatch.setattr(sa, "build", lambda: {"files": {}, "suites": {}})
+    result = click.testing.CliRunner().invoke(
+        sa.cli, ["build", "--vendor-missing", "--require-vendored"]
+    )
+    assert result.exit_code == 0
+    assert "Vendored bootstrap.min.css" in result.output
+    assert "Linking" not in result.output
+
+
+def test_get_manifest_checks_sources_by_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.config, "STATIC_DIR", tmp_path)
+    source = tmp_path / "component.js"
+    source.write_text("")
+    mtime = source.stat().st_mtime
+    suites = {
+        # Of a library not imported by the app
+        "unimported/component.js": {"file": "a.js", "source": str(source)},
+        "unimported/changed.js": {"file": "b.js", "source": str(source)},
+        "unimported/missing.js": {"file": "c.js", "source": str(tmp_path / "x.js")},
+    }
+    suites["unimported/component.js"]["mtime"] = mtime
+    suites["unimported/changed.js"]["mtime"] = mtime - 1
+    suites["unimported/missing.js"]["mtime"] = mtime
+    (tmp_path / sa.MANIFEST).write_text(json.dumps({"files": {}, "suites": suites}))
+    sa.get_manifest.cache_clear()
+    try:
+        assert sa.get_manifest()["suites"] == {"unimported/component.js": "a.js"}
+    finally:
+        sa.get_manifest.cache_clear()
@@ -0,0 +1,235 @@
+import concurrent.futures as cf
+import urllib.parse as up
+
+import pytest
+
+from .context import settings
+from .conftest import standin
+import cache as ca
+import rendering as rn
+import stories as sto
+
+
+def make_url(i: int) -> str:
+    return f"https://www.nzherald.co.nz/nz/story-{i}/{i:026d}/".replace("0", "A")
+
+
+def test_get_stories(cache, upstream):
+    urls = [make_url(1), make_url(2), make_url(1), "nzherald.co.nz/nz/story-3/"]
+    reports = sto.get_stories(urls)
+
+    # Normalized, deduplicated, and in order
+    assert [r["url"] for r in reports] == [
+        make_url(1),
+        make_url(2),
+        "https://www.nzherald.co.nz/nz/story-3/",
+    ]
+    for report in reports:
+        assert report["error"] is None
+        assert not report["cached"]
+        assert report["story"]["url"] == report["url"]
+        assert report["story"]["elements"]
+        assert report["fetch_time"] <= report["time"]
+    assert upstream.n_requests == 3
+
+    # Now from the cache
+    reports = sto.get_stories(urls)
+    assert all(r["cached"] and r["story"] is not None for r in reports)
+    assert upstream.n_requests == 3
+
+
+def test_get_stories_reports_failures(cache, upstream):
+    sto.get_stories([make_url(1)])
+    upstream.failure_rate = 1
+    reports = sto.get_stories([make_url(1), make_url(4)])
+
+    assert reports[0]["cached"] and reports[0]["error"] is None
+    assert reports[1]["story"] is None
+    assert reports[1]["error"].startswith("Fetch failed")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_breaker(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sto.time, "monotonic", clock)
+    breaker = sto.CircuitBreaker(
+        failure_rate=0.5, slow_call=1, cooldown=30, window=10, min_calls=4, probes=2
+    )
+
+    # Closed until half the calls of the window fail, once there are enough calls
+    for ok in [True, True, True, False, False]:
+        assert breaker.allow()
+        breaker.record(ok, 0.1)
+        assert breaker.state == "closed"
+    # Slow calls count as failures
+    breaker.record(True, 2)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # Half-open after the cooldown, with one probe at a time
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == "half-open"
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+
+    # The window starts afresh
+    for __ in range(3):
+        breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+
+
+def test_circuit_breaker_reopens_on_failed_probe(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sto.time, "monotonic", clock)
+    breaker = sto.CircuitBreaker(cooldown=30, min_calls=1)
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_fetch_upstream_stops_at_open_breaker(cache, upstream):
+    upstream.failure_rate = 1
+    for i in range(10):
+        assert sto.fetch_upstream(make_url(i)).status_code >= 500
+    assert upstream.n_requests == 10
+
+    with pytest.raises(sto.UpstreamUnavailable, match="Circuit breaker"):
+        sto.fetch_upstream(make_url(10))
+    assert upstream.n_requests == 10
+
+
+def test_parse_page():
+    url = make_url(5)
+    page = standin.make_page(up.urlparse(url).path, n_elements=5).encode()
+    story, rendered = sto.parse_page(page, "utf-8", url, pooled=False)
+
+    assert story["url"] == url
+    assert len(story["elements"]) == 5
+    assert rendered == rn.render(story)
+    # The parsing processes give the same result
+    try:
+        assert sto.parse_page(page, "utf-8", url, pooled=True) == (story, rendered)
+    finally:
+        sto.get_parse_pool().shutdown()
+        sto._parse_pool = None
+
+    with pytest.raises(ValueError):
+        sto.parse_page(page, "utf-8", "https://example.com/story/", pooled=False)
+
+
+def test_parse_page_survives_broken_pool(monkeypatch):
+    url = make_url(6)
+    page = standin.make_page(up.urlparse(url).path, n_elements=2).encode()
+
+    class BrokenPool:
+        def submit(self, *args):
+            future = cf.Future()
+            future.set_exception(cf.process.BrokenProcessPool())
+            return future
+
+    monkeypatch.setattr(sto, "_parse_pool", BrokenPool())
+    story, rendered = sto.parse_page(page, "utf-8", url, pooled=True)
+    assert story["url"] == url
+    # The pool starts afresh on next use
+    assert sto._parse_pool is None
+
+
+STORY_ID = "YQMPIC4PJQWJCR2SF7AHYX3BO4"
+
+
+def make_story(url: str, **kwargs) -> dict:
+    return {"url": url, "title": "Kiwi", "elements": [], **kwargs}
+
+
+def test_make_story_key():
+    url = f"https://www.nzherald.co.nz/nz/a-story/{STORY_ID}/"
+    assert sto.make_story_key(make_story(url)) == f"nzherald:{STORY_ID}"
+    # From the ID on the page
+    url = "https://www.nzherald.co.nz/nz/a-story/"
+    assert sto.make_story_key(make_story(url, id="PAGEID")) == "nzherald:PAGEID"
+    assert sto.make_story_key(make_story(url)) == url
+    url = "https://www.newsroom.co.nz/a-story/"
+    assert sto.make_story_key(make_story(url, id="post-1")) == "newsroom:post-1"
+
+
+def test_story_urls_share_cache_entries(cache, upstream):
+    story = sto.get_story(f"https://www.nzherald.co.nz/nz/a-story/{STORY_ID}/")
+    assert cache.get(f"article:nzherald:{STORY_ID}") == story
+
+    # Another section path of the same story
+    url = f"https://www.nzherald.co.nz/world/a-story/{STORY_ID}/"
+    assert sto.get_story_key(url) == f"nzherald:{STORY_ID}"
+    assert sto.get_story(url) == story
+    assert upstream.n_requests == 1
+    # Counted as an alias
+    assert cache.get(f"alias:{url}") == f"nzherald:{STORY_ID}"
+
+
+def test_aliases_resolve_urls_without_ids(cache):
+    url = "https://www.nzherald.co.nz/nz/a-story/"
+    assert sto.get_story_key(url) == url
+
+    sto.cache_story(make_story(url, id="PAGEID"))
+    assert cache.get(f"alias:{url}") == "nzherald:PAGEID"
+    assert sto.get_story_key(url) == "nzherald:PAGEID"
+    assert sto.get_cached_story(url)["id"] == "PAGEID"
+
+    # Purged with its story
+    assert sto.purge_story(url)
+    assert sto.get_story_key(url) == url
+    assert sto.get_cached_story(url) is None
+    assert not sto.purge_story(url)
+
+
+def test_purge_story_via_alias(cache):
+    url = f"https://www.nzherald.co.nz/nz/a-story/{STORY_ID}/"
+    alias = f"https://www.nzherald.co.nz/world/a-story/{STORY_ID}/"
+    story = make_story(url)
+    sto.cache_story(story, rn.render(story))
+    store_key = sto.get_store_key(url)
+    ca.story_store.set(store_key, story)
+    assert ca.render_files.size()[0] == 1
+
+    assert sto.purge_story(alias)
+    assert sto.get_cached_story(url) is None
+    assert sto.get_cached_render(story) is None
+    assert ca.render_files.size()[0] == 0
+    assert ca.story_store.get(store_key) is None
+
+
+def test_renderings_are_keyed_by_content(cache):
+    first = make_story(f"https://www.nzherald.co.nz/nz/a/{STORY_ID}/")
+    second = make_story("https://www.nzherald.co.nz/nz/b/", id="OTHER")
+    rendered = rn.render(first)
+    sto.cache_story(first, rendered)
+    sto.cache_story(second)
+
+    assert sto.get_content_hash(first) == sto.get_content_hash(second)
+    assert sto.get_cached_render(second) == rendered
+
+    report = sto.get_dedup_report()
+    assert report["stories"] == 2
+    assert report["contents"] == 1
+    assert report["content_ratio"] == 2
+    assert report["bytes_saved"] > 0
@@ -0,0 +1,123 @@
+import json
+
+import click.testing
+import pytest
+import sqlalchemy as sa
+import werkzeug.security as ws
+
+from .context import settings
+import user_management as um
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """
+    Point the command line interface at an empty user database of its own.
+    """
+    engine = sa.create_engine(
+        f"sqlite:///{tmp_path / 'users.sqlite'}",
+        **settings.config.SQLALCHEMY_ENGINE_OPTIONS,
+    )
+    monkeypatch.setattr(um, "engine", engine)
+    invoke("create-user-table")
+    yield engine
+    engine.dispose()
+
+
+def invoke(*args: str, input: str | None = None) -> str:
+    result = click.testing.CliRunner().invoke(um.cli, args, input=input)
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def get_users(engine) -> list[tuple]:
+    with engine.connect() as conn:
+        return conn.execute(
+            sa.select(um.user_table.c.username, um.user_table.c.email).order_by(
+                um.user_table.c.id
+            )
+        ).all()
+
+
+def test_sqlite_pragmas(engine):
+    with engine.connect() as conn:
+        pragmas = {
+            name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in settings.config.SQLITE_PRAGMAS
+        }
+    assert pragmas == {
+        "journal_mode": "wal",
+        # NORMAL
+        "synchronous": 1,
+        "cache_size": settings.config.SQLITE_PRAGMAS["cache_size"],
+        "mmap_size": settings.config.SQLITE_PRAGMAS["mmap_size"],
+    }
+
+
+def test_add_and_remove_user(engine):
+    invoke("add-user", "ann", "secret", "ann@example.com")
+    invoke("add-user", "bob", "secret", "bob@example.com")
+    assert get_users(engine) == [("ann", "ann@example.com"), ("bob", "bob@example.com")]
+
+    invoke("remove-user", "ann")
+    assert get_users(engine) == [("bob", "bob@example.com")]
+
+
+def test_import_and_export_users(engine, tmp_path):
+    users = tmp_path / "users.csv"
+    users.write_text(
+        "username,email,password\n"
+        "ann,ann@example.com,secret\n"
+        "bob,bob@example.com,hunter2\n"
+        "carl,carl@example.com,\n"
+    )
+    output = invoke("import-users", str(users), "--batch-size", "1", "--processes", "1")
+    assert "Skipped line 3: missing username or password" in output
+    assert "Imported 2 of 3 users" in output
+    assert get_users(engine) == [("ann", "ann@example.com"), ("bob", "bob@example.com")]
+
+    exported = tmp_path / "users.jsonl"
+    invoke("export-users", str(exported), "--hashes")
+    rows = [json.loads(line) for line in exported.read_text().splitlines()]
+    assert [(r["username"], r["email"]) for r in rows] == get_users(engine)
+    assert ws.check_password_hash(rows[0]["password_hash"], "secret")
+
+    # Importing the export with its hashes changes nothing
+    invoke("import-users", str(exported), "--processes", "1")
+    with engine.connect() as conn:
+        hashes = conn.execute(sa.select(um.user_table.c.password)).scalars().all()
+    assert sorted(hashes) == sorted(r["password_hash"] for r in rows)
+
+
+def test_import_users_updates_existing_users(engine):
+    invoke("add-user", "ann", "secret", "ann@example.com")
+    invoke("add-user", "bob", "secret", "bob@example.com")
+
+    output = invoke(
+        "import-users",
+        "-",
+        "--format",
+        "jsonl",
+        "--processes",
+        "1",
+        input="\n".join(
+            json.dumps(u)
+            for u in [
+                {"username": "ann", "email": "ann@example.org", "password": "new"},
+                # Bob's address is taken
+                {"username": "dan", "email": "bob@example.com", "password": "x"},
+                {"username": "eve", "email": "eve@example.com", "password": "y"},
+            ]
+        ),
+    )
+    assert "Skipped user dan: email address taken" in output
+    assert get_users(engine) == [
+        ("ann", "ann@example.org"),
+        ("bob", "bob@example.com"),
+        ("eve", "eve@example.com"),
+    ]
+    with engine.connect() as conn:
+        password = conn.execute(
+            sa.select(um.user_table.c.password).where(um.user_table.c.username == "ann")
+        ).scalar()
+    assert ws.check_password_hash(password, "new")
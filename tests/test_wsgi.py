@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from .context import ROOT, TMP_DIR
+
+LAZY_PACKAGES = ["bs4", "markdownify", "requests"]
+
+
+def run_in_app(code: str) -> str:
+    """
+    Run the given Python code after importing the app in a fresh interpreter, as
+    a preloading Gunicorn master does, and return its output.
+    """
+    p = subprocess.run(
+        [sys.executable, "-c", f"import wsgi\n{code}"],
+        cwd=os.path.join(ROOT, "nzharold"),
+        env=os.environ | {"CACHE_DIR": str(TMP_DIR / "wsgi_cache")},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return p.stdout
+
+
+def test_import_defers_dependencies_and_threads():
+    out = run_in_app(
+        "import sys, threading\n"
+        f"print([m for m in {LAZY_PACKAGES!r} if m in sys.modules])\n"
+        "print(threading.active_count())"
+    )
+    # Neither the lazily imported packages nor threads, which forked workers
+    # wouldn't inherit
+    assert out.split("\n")[:2] == ["[]", "1"]
+
+
+def test_import_dependencies():
+    out = run_in_app(
+        "import sys, stories\n"
+        "stories.import_dependencies()\n"
+        f"print(all(m in sys.modules for m in {LAZY_PACKAGES!r}))"
+    )
+    assert out.strip() == "True"